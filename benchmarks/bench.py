@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from utils import CaptureUtil, GraphColorUtil, TemplateUtil
+from utils.DictOCR import DictOCR
+from utils.OCR import OCR
+
+"""
+    图色和ocr的性能测试，在项目根目录运行：
+    python -m benchmarks.bench --output result.json
+    python -m benchmarks.bench --compare result.json    和之前的结果比较
+    截图用ArrayCaptureBackend从合成的画面里取，不需要Windows；没有tesseract的dll时跳过ocr
+"""
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+}
+TEMPLATE_SIZES = (16, 32, 64, 128)
+# 多点找色用的颜色，合成画面里不会自然出现
+PATTERN = ['FF00FF-000000', '3|0|00FF00-000000,0|3|00FFFF-000000,3|3|FFFF00-000000']
+DIGITS = '0123456789'
+
+
+def _synthetic_frame(width, height, seed=0) -> np.ndarray:
+    """
+    合成画面：放大后的随机色块加上逐像素的噪声，颜色都在0x10~0xEF之间，右下角放一个PATTERN的多点颜色
+    :return: BGRA数组
+    """
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0x20, 0xE0, size=(height // 4, width // 4, 3), dtype=np.uint8)
+    frame = cv2.resize(blocks, (width, height), interpolation=cv2.INTER_LINEAR)
+    # 逐像素的噪声保证模糊匹配时只有一个最佳位置
+    frame = cv2.add(frame, rng.integers(0, 0x10, size=frame.shape, dtype=np.uint8))
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)
+    x, y = width - 40, height - 40
+    frame[y, x, :3] = (255, 0, 255)
+    frame[y, x + 3, :3] = (0, 255, 0)
+    frame[y + 3, x, :3] = (255, 255, 0)
+    frame[y + 3, x + 3, :3] = (0, 255, 255)
+    return frame
+
+
+def _render_digits(text, color=(255, 255, 255)) -> np.ndarray:
+    """
+    用OpenCV的字体画数字，每个字固定14像素宽
+    :return: BGR数组
+    """
+    image = np.zeros((30, 14 * len(text) + 10, 3), dtype=np.uint8)
+    for i, char in enumerate(text):
+        cv2.putText(image, char, (4 + 14 * i, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2, cv2.LINE_8)
+    return image
+
+
+def _near(x, y, distance):
+    """
+    模糊找图返回第一个超过相似度的位置，不一定正好是模板的位置，相差不超过distance就算对
+    """
+    return lambda point: abs(point[0] - x) <= distance and abs(point[1] - y) <= distance
+
+
+def _measure(func, iterations, warmup=3, inner=1) -> dict:
+    """
+    多次运行func，统计耗时
+    :param iterations: 采样次数
+    :param warmup: 预热次数，不计入统计
+    :param inner: 每次采样连续运行的次数，很快的函数用这个减少计时误差
+    :return: {'samples':, 'mean_ms':, 'p50_ms':, 'p95_ms':, 'p99_ms':, 'max_ms':, 'ops_per_sec':}
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for _ in range(inner):
+            func()
+        samples.append((time.perf_counter() - start) / inner)
+    samples.sort()
+    mean = sum(samples) / len(samples)
+
+    def percentile(p):
+        return samples[min(int(len(samples) * p), len(samples) - 1)] * 1000
+
+    return {'samples': len(samples), 'mean_ms': mean * 1000, 'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99), 'max_ms': samples[-1] * 1000,
+            'ops_per_sec': 1 / mean if mean > 0 else 0.0}
+
+
+class Benchmark(object):
+    """
+    收集各项测试的结果
+    """
+
+    def __init__(self, iterations, filters=None):
+        """
+        :param iterations: 每项测试的采样次数
+        :param filters: 只运行名字里包含这些字符串的测试，None表示全部运行
+        """
+        self.iterations = iterations
+        self.filters = filters
+        self.results = []
+        self.skipped = []
+
+    def run(self, name, func, expect=None, inner=1, **labels):
+        """
+        运行一项测试
+        :param name: 测试名
+        :param func: 被测的函数，没有参数
+        :param expect: 函数应该返回的结果，也可以是检查结果的函数，不对时报错，None表示不检查
+        :param inner: 见_measure
+        :param labels: 附加到结果里的信息，如分辨率、模板大小
+        """
+        if self.filters and not any(f in name for f in self.filters):
+            return
+        if expect is not None:
+            actual = func()
+            if not (expect(actual) if callable(expect) else actual == expect):
+                raise AssertionError('%s 结果不对：%r != %r' % (name, actual, expect))
+        result = {'name': name}
+        result.update(labels)
+        result.update(_measure(func, self.iterations, inner=inner))
+        self.results.append(result)
+        print('%-40s %-8s %-6s p50 %8.3fms  p95 %8.3fms  p99 %8.3fms  %10.1f/s' % (
+            name, labels.get('resolution', ''), labels.get('template', ''), result['p50_ms'], result['p95_ms'],
+            result['p99_ms'], result['ops_per_sec']))
+
+    def skip(self, name, reason):
+        self.skipped.append({'name': name, 'reason': reason})
+        print('%-40s 跳过：%s' % (name, reason))
+
+    def to_dict(self) -> dict:
+        return {
+            'meta': {
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'numpy': np.__version__,
+                'opencv': cv2.__version__,
+                'iterations': self.iterations,
+            },
+            'results': self.results,
+            'skipped': self.skipped,
+        }
+
+
+def bench_color_parsing(bench):
+    bench.run('get_color_rgb', lambda: GraphColorUtil.get_color_rgb('-4|8|864D1C-101010'), inner=1000)
+    bench.run('get_color_rgb/no_offset', lambda: GraphColorUtil.get_color_rgb('864D1C-101010'), inner=1000)
+
+
+def bench_resolution(bench, resolution, hwnd, frame, workdir):
+    width, height = RESOLUTIONS[resolution]
+    labels = {'resolution': resolution}
+
+    bench.run('capture', lambda: GraphColorUtil.screenshot_to_ndarray(hwnd, 0, 0, width, height, copy=True),
+              **labels)
+
+    pattern = GraphColorUtil.ColorPattern.compile(PATTERN)
+    expect = (width - 40, height - 40)
+    bench.run('screenshot_multi_point_find_color',
+              lambda: GraphColorUtil.screenshot_multi_point_find_color(hwnd, 0, 0, width, height, pattern),
+              expect=expect, **labels)
+    bench.run('multi_point_find_color/parse_each_call',
+              lambda: GraphColorUtil.multi_point_find_color(frame, list(PATTERN)), expect=expect, **labels)
+
+    for size in TEMPLATE_SIZES:
+        # 模板取自画面中间，保证能找到
+        x, y = width // 2 - size // 2, height // 2 - size // 2
+        path = os.path.join(workdir, '%s_%d.png' % (resolution, size))
+        cv2.imwrite(path, frame[y:y + size, x:x + size, :3])
+        labels = {'resolution': resolution, 'template': size}
+        bench.run('screenshot_find_picture',
+                  lambda: GraphColorUtil.screenshot_find_picture(hwnd, 0, 0, width, height, path),
+                  expect=(x, y), **labels)
+        bench.run('screenshot_find_picture/color',
+                  lambda: GraphColorUtil.screenshot_find_picture(hwnd, 0, 0, width, height, path, grayscale=False),
+                  expect=(x, y), **labels)
+        bench.run('screenshot_find_picture2/step1',
+                  lambda: GraphColorUtil.screenshot_find_picture2(hwnd, 0, 0, width, height, path),
+                  expect=_near(x, y, 2), **labels)
+        bench.run('screenshot_find_picture2/step2',
+                  lambda: GraphColorUtil.screenshot_find_picture2(hwnd, 0, 0, width, height, path, 0.95,
+                                                                  step=2), expect=_near(x, y, 2), **labels)
+        bench.run('screenshot_find_picture2/pyramid',
+                  lambda: GraphColorUtil.screenshot_find_picture2(hwnd, 0, 0, width, height, path, pyramid=-1),
+                  expect=_near(x, y, 2), **labels)
+
+
+def bench_ocr(bench, workdir, dll_path, tessdata):
+    # 字库识别：先用0~9的样本做字库，再识别一行数字
+    dict_ocr = DictOCR(color='FFFFFF-101010')
+    dict_ocr.build_from_sample(_render_digits(DIGITS), DIGITS)
+    line = _render_digits('31415926')
+    fixture = os.path.join(workdir, 'digits.png')
+    cv2.imwrite(fixture, line)
+    bench.run('DictOCR.get_text_from_array', lambda: dict_ocr.get_text_from_array(line), expect='31415926')
+    bench.run('DictOCR.get_text', lambda: dict_ocr.get_text(fixture), expect='31415926')
+
+    if dll_path is None:
+        bench.skip('OCR', '没有指定--dll')
+        return
+    try:
+        ocr = OCR(dll_path, tessdata.encode(), b'eng')
+    except OSError as e:
+        bench.skip('OCR', '加载dll失败：%s' % e)
+        return
+    if not ocr.ready:
+        bench.skip('OCR', 'tesseract初始化失败')
+        return
+    with ocr:
+        # tesseract对太小的字识别不好，放大后再识别
+        bench.run('OCR.get_text_from_array/digits',
+                  lambda: ocr.get_text_from_array(line, scale=2.0, profile='digits'), **{'template': 'digits'})
+        bench.run('OCR.get_text', lambda: ocr.get_text(fixture.encode()))
+
+
+def compare(old, new):
+    """
+    打印两次结果的p50对比
+    """
+    def key(result):
+        return result['name'], result.get('resolution'), result.get('template')
+
+    old_results = {key(r): r for r in old['results']}
+    print('\n%-40s %-8s %-6s %12s %12s %8s' % ('name', 'res', 'tpl', 'old p50', 'new p50', 'ratio'))
+    for result in new['results']:
+        before = old_results.get(key(result))
+        if before is None:
+            continue
+        print('%-40s %-8s %-6s %10.3fms %10.3fms %7.2fx' % (
+            result['name'], result.get('resolution', ''), result.get('template', ''), before['p50_ms'],
+            result['p50_ms'], before['p50_ms'] / result['p50_ms'] if result['p50_ms'] > 0 else 0.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='图色和ocr的性能测试')
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS), help='逗号分隔，可选 %s' % ','.join(
+        RESOLUTIONS))
+    parser.add_argument('--iterations', type=int, default=30, help='每项测试的采样次数')
+    parser.add_argument('--filter', action='append', help='只运行名字里包含这个字符串的测试，可以指定多次')
+    parser.add_argument('--output', help='结果保存为json')
+    parser.add_argument('--compare', help='和之前保存的json比较')
+    parser.add_argument('--dll', help='tesseract的dll路径，不指定时跳过OCR')
+    parser.add_argument('--tessdata', default='tessdata', help='tesseract语言包目录')
+    args = parser.parse_args(argv)
+
+    bench = Benchmark(args.iterations, args.filter)
+    frames = {}
+    CaptureUtil.set_backend_factory(lambda hwnd: CaptureUtil.ArrayCaptureBackend(frames[hwnd]))
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            bench_color_parsing(bench)
+            for hwnd, resolution in enumerate(args.resolutions.split(','), 1):
+                if resolution not in RESOLUTIONS:
+                    raise ValueError('不支持的分辨率：%s' % resolution)
+                frames[hwnd] = _synthetic_frame(*RESOLUTIONS[resolution], seed=hwnd)
+                bench_resolution(bench, resolution, hwnd, frames[hwnd], workdir)
+                # 每个分辨率的模板只用一次，不占着缓存
+                TemplateUtil.default_store.clear()
+            bench_ocr(bench, workdir, args.dll, args.tessdata)
+    finally:
+        CaptureUtil.close_all_sessions()
+        CaptureUtil.set_backend_factory(None)
+
+    data = bench.to_dict()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), data)
+    return data
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,166 @@
+import argparse
+import itertools
+import json
+import queue
+import sys
+import threading
+import time
+
+from utils import KeymouseUtil
+
+"""
+    send_text各模式的性能测试，在项目根目录运行：
+    python -m benchmarks.bench_send_text --length 200 --output send_text.json
+    消息发给本地的模拟窗口(StandInReceiver)，不会真的输入到别的程序里，不需要Windows
+"""
+
+WM_NULL = KeymouseUtil.WM_NULL
+WM_CHAR = KeymouseUtil.WM_CHAR
+WM_IME_CHAR = KeymouseUtil.WM_IME_CHAR
+WM_PASTE = KeymouseUtil.WM_PASTE
+
+
+class StandInReceiver(KeymouseUtil.TextTarget):
+    """
+    模拟窗口：一个线程处理消息队列，每条消息耗时cost微秒
+    和Windows一样，发送(send)的消息排在投递(post)的消息前面处理
+    send等处理完才返回，post放进队列就返回，ping只等WM_NULL处理完，不等之前投递的消息
+    """
+
+    def __init__(self, cost=20):
+        """
+        :param cost: 处理每条消息的耗时，微秒
+        """
+        self.cost = cost / 1000000
+        self.text = []
+        self.clipboard = None
+        self._clipboard_lock = threading.Lock()
+        # (优先级, 序号, 消息, wparam, 处理完后set的Event)，发送的消息优先级为0，投递的为1
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread = threading.Thread(target=self._run, name='stand-in-receiver', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        pending_surrogate = None
+        while True:
+            _, _, msg, wparam, done = self._queue.get()
+            if msg is None:
+                self._queue.task_done()
+                return
+            end = time.perf_counter() + self.cost
+            while time.perf_counter() < end:
+                pass
+            if msg == WM_CHAR:
+                if 0xD800 <= wparam < 0xDC00:
+                    pending_surrogate = wparam
+                elif pending_surrogate is not None:
+                    self.text.append((pending_surrogate.to_bytes(2, 'little') + wparam.to_bytes(2, 'little'))
+                                     .decode('utf-16-le'))
+                    pending_surrogate = None
+                else:
+                    self.text.append(chr(wparam))
+            elif msg == WM_IME_CHAR:
+                self.text.append(chr(wparam))
+            elif msg == WM_PASTE and self.clipboard is not None:
+                self.text.append(self.clipboard)
+            if done is not None:
+                done.set()
+            self._queue.task_done()
+
+    def post(self, hwnd, msg, wparam, lparam):
+        self._queue.put((1, next(self._seq), msg, wparam, None))
+
+    def send(self, hwnd, msg, wparam, lparam, timeout=None) -> bool:
+        done = threading.Event()
+        self._queue.put((0, next(self._seq), msg, wparam, done))
+        return done.wait(timeout)
+
+    def ping(self, hwnd, timeout) -> bool:
+        return self.send(hwnd, WM_NULL, 0, 0, timeout / 1000)
+
+    def acquire_clipboard(self, timeout) -> bool:
+        return self._clipboard_lock.acquire(timeout=timeout / 1000)
+
+    def release_clipboard(self):
+        self._clipboard_lock.release()
+
+    def get_clipboard(self):
+        return self.clipboard
+
+    def set_clipboard(self, text):
+        self.clipboard = text
+
+    def received(self) -> str:
+        self._queue.join()
+        text = ''.join(self.text)
+        self.text = []
+        return text
+
+    def close(self):
+        self._queue.put((2, next(self._seq), None, 0, None))
+        self._thread.join()
+
+
+def _sample_text(length) -> str:
+    # 混合ASCII、中文和基本平面以外的字符
+    pattern = 'Hello 你好 world 😀 '
+    return (pattern * (length // len(pattern) + 1))[:length]
+
+
+def run(length, repeat, cost, batch, delay):
+    receiver = StandInReceiver(cost)
+    KeymouseUtil.set_text_target(receiver)
+    text = _sample_text(length)
+    cases = [
+        ('ime(原来的逐字发送)', {'mode': 'ime'}),
+        ('post', {'mode': 'post', 'batch': batch, 'delay': delay}),
+        ('post/no_confirm', {'mode': 'post', 'batch': batch, 'delay': delay, 'confirm': False}),
+        ('paste', {'mode': 'paste'}),
+    ]
+    results = []
+    try:
+        for name, kwargs in cases:
+            wall = []
+            cpu = []
+            for _ in range(repeat):
+                start, start_cpu = time.perf_counter(), time.thread_time()
+                KeymouseUtil.send_text(0, text, **kwargs)
+                received = receiver.received()
+                cpu.append(time.thread_time() - start_cpu)
+                wall.append(time.perf_counter() - start)
+                if received != text:
+                    raise AssertionError('%s 收到的文字不对：%r' % (name, received[:40]))
+            wall.sort()
+            result = {'name': name, 'length': length, 'wall_ms': wall[len(wall) // 2] * 1000,
+                      'cpu_ms': sorted(cpu)[len(cpu) // 2] * 1000,
+                      'chars_per_sec': length / wall[len(wall) // 2]}
+            result.update(kwargs)
+            results.append(result)
+            print('%-22s 耗时 %9.2fms  发送线程CPU %9.2fms  %10.0f字/秒' % (
+                name, result['wall_ms'], result['cpu_ms'], result['chars_per_sec']))
+    finally:
+        KeymouseUtil.set_text_target(None)
+        receiver.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='send_text各模式的性能测试')
+    parser.add_argument('--length', type=int, default=200, help='文字长度')
+    parser.add_argument('--repeat', type=int, default=5, help='每个模式运行次数，取中位数')
+    parser.add_argument('--cost', type=float, default=20, help='模拟窗口处理每条消息的耗时，微秒')
+    parser.add_argument('--batch', type=int, default=64, help='post模式每批的字数')
+    parser.add_argument('--delay', type=int, default=0, help='post模式批之间的延时，毫秒')
+    parser.add_argument('--output', help='结果保存为json')
+    args = parser.parse_args(argv)
+    results = run(args.length, args.repeat, args.cost, args.batch, args.delay)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, ensure_ascii=False,
+                      indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
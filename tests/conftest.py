@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 直接运行pytest时也能import utils
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
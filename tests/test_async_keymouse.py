@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from utils import AsyncKeymouseUtil, KeymouseUtil
+
+
+@pytest.fixture
+def poster():
+    poster = AsyncKeymouseUtil.RecordingPoster({0x41: 0x1E})
+    AsyncKeymouseUtil.set_poster(poster)
+    yield poster
+    AsyncKeymouseUtil.set_poster(None)
+
+
+def _messages(poster):
+    return [message[1:] for message in poster.messages]
+
+
+def test_key_lparams_come_from_lparam_table(poster):
+    asyncio.run(AsyncKeymouseUtil.key_press(1, 0x41, delay=0))
+    asyncio.run(AsyncKeymouseUtil.alt_combo_key(1, 0x41, delay=0))
+    table = poster.lparam_table()
+    assert _messages(poster) == [
+        ('post', 1, KeymouseUtil.WM_KEYDOWN, 0x41, 0x001E0001),
+        ('post', 1, KeymouseUtil.WM_KEYUP, 0x41, 0xC01E0001),
+        ('post', 1, KeymouseUtil.WM_SYSKEYDOWN, 0x41, table.alt_down[0x41]),
+        ('post', 1, KeymouseUtil.WM_SYSKEYUP, 0x41, table.alt_up[0x41]),
+    ]
+    assert table.alt_down[0x41] == 0x201E0001
+    # 没给扫描码的键扫描码为0
+    assert table.down[0x42] == 0x0001
+
+
+def test_click_and_windows_run_concurrently(poster):
+    async def main():
+        await asyncio.gather(AsyncKeymouseUtil.left_click(1, 10, 20, delay=0),
+                             AsyncKeymouseUtil.right_click(2, 30, 40, delay=0))
+
+    asyncio.run(main())
+    first = [m for m in _messages(poster) if m[1] == 1]
+    assert first == [
+        ('post', 1, KeymouseUtil.WM_MOUSEMOVE, 0, KeymouseUtil.make_long(10, 20)),
+        ('post', 1, KeymouseUtil.WM_LBUTTONDOWN, KeymouseUtil.MK_LBUTTON, KeymouseUtil.make_long(10, 20)),
+        ('post', 1, KeymouseUtil.WM_MOUSEMOVE, 0, KeymouseUtil.make_long(10, 20)),
+        ('post', 1, KeymouseUtil.WM_LBUTTONUP, KeymouseUtil.MK_LBUTTON, KeymouseUtil.make_long(10, 20)),
+    ]
+    assert len(poster.messages) == 8
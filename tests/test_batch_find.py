@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from utils import CaptureUtil, GraphColorUtil
+
+# 截图在窗口中的位置
+ORIGIN = (10, 10)
+
+
+@pytest.fixture
+def frame():
+    # 50x40的截图，窗口坐标(15, 20)和(40, 30)是红点，(30, 40)开始是一块蓝色
+    frame = np.zeros((40, 50, 3), dtype=np.uint8)
+    frame[10, 5] = (0, 0, 255)
+    frame[20, 30] = (0, 0, 255)
+    frame[30:36, 20:28] = (255, 0, 0)
+    return frame
+
+
+def _red(name, rect=None, query_type='color'):
+    query = {'name': name, 'type': query_type, 'multi_point_color_str': ['FF0000', '']}
+    if rect is not None:
+        query['rect'] = rect
+    return query
+
+
+def test_rects_are_clipped_to_the_frame(frame):
+    queries = [
+        # 查询区域从截图外面开始，结果还是窗口坐标
+        _red('partial', (0, 0, 30, 30)),
+        _red('all', (0, 0, 100, 100), 'color_all'),
+        _red('inside', (30, 25, 60, 50)),
+        _red('outside', (100, 100, 140, 140)),
+        _red('outside_all', (-50, -50, 5, 5), 'color_all'),
+        _red('whole'),
+    ]
+    result = GraphColorUtil.batch_find(frame, queries, ORIGIN, parallel=False)
+    assert result == {'partial': (15, 20), 'all': [(15, 20), (40, 30)], 'inside': (40, 30), 'outside': (-1, -1),
+                      'outside_all': [], 'whole': (15, 20)}
+
+
+def test_pixel_queries_are_bounds_checked(frame):
+    queries = [
+        {'name': 'red', 'type': 'pixel', 'x': 15, 'y': 20},
+        {'name': 'red_match', 'type': 'pixel', 'x': 15, 'y': 20, 'color_str': 'FF0000'},
+        # 负的相对坐标不能绕到截图另一边
+        {'name': 'left_of_frame', 'type': 'pixel', 'x': 5, 'y': 20},
+        {'name': 'below_frame', 'type': 'pixel', 'x': 15, 'y': 50, 'color_str': '000000'},
+    ]
+    result = GraphColorUtil.batch_find(frame, queries, ORIGIN, parallel=False)
+    assert result == {'red': (255, 0, 0), 'red_match': True, 'left_of_frame': None, 'below_frame': False}
+
+
+def test_parallel_matches_sequential(frame):
+    dest = frame[28:38, 18:30].copy()
+    queries = [
+        _red('red', (0, 0, 60, 50)),
+        {'name': 'blue', 'type': 'picture2', 'rect': (20, 30, 60, 50), 'dest_image_url': dest, 'confidence': 0.99},
+        {'name': 'pixel', 'type': 'pixel', 'x': 40, 'y': 30, 'color_str': 'FF0000'},
+    ]
+    sequential = GraphColorUtil.batch_find(frame, queries, ORIGIN, parallel=False)
+    assert sequential == GraphColorUtil.batch_find(frame, queries, ORIGIN, parallel=True)
+    assert sequential['blue'] == (28, 38)
+
+
+def test_unknown_query_type(frame):
+    with pytest.raises(ValueError):
+        GraphColorUtil.batch_find(frame, [{'name': 'x', 'type': 'ocr', 'rect': (10, 10, 20, 20)}], ORIGIN)
+
+
+def test_screenshot_batch_find_captures_union_of_rects(frame):
+    window = np.zeros((100, 100, 3), dtype=np.uint8)
+    window[10:50, 10:60] = frame
+    CaptureUtil.close_all_sessions()
+    CaptureUtil.set_backend_factory(lambda hwnd: CaptureUtil.ArrayCaptureBackend(window))
+    try:
+        result = GraphColorUtil.screenshot_batch_find(1, [_red('a', (12, 12, 30, 30)), _red('b', (35, 25, 45, 35))])
+    finally:
+        CaptureUtil.close_all_sessions()
+        CaptureUtil.set_backend_factory(None)
+    assert result == {'a': (15, 20), 'b': (40, 30)}
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from utils import CaptureUtil
+
+
+class CountingBackend(CaptureUtil.ArrayCaptureBackend):
+    """
+    记录allocate和close的调用
+    """
+
+    def __init__(self, frame):
+        super().__init__(frame)
+        self.allocations = []
+        self.closed = False
+
+    def allocate(self, width, height):
+        self.allocations.append((width, height))
+
+    def close(self):
+        self.closed = True
+
+
+def _frame(width, height):
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[:, :, 2] = np.arange(width, dtype=np.uint8)
+    frame[:, :, 1] = np.arange(height, dtype=np.uint8)[:, None]
+    return frame
+
+
+def test_buffers_are_reused_across_rect_sizes():
+    backend = CountingBackend(_frame(64, 48))
+    with CaptureUtil.CaptureSession(1, backend=backend) as session:
+        for rect in [(0, 0, 10, 10), (5, 5, 60, 40), None, (1, 2, 3, 4)] * 3:
+            session.capture_array(rect)
+        assert backend.allocations == [(64, 48)]
+        # 窗口大小变了才重新创建
+        backend.set_frame(_frame(80, 30))
+        session.capture_array()
+        assert backend.allocations == [(64, 48), (80, 30)]
+    assert backend.closed
+
+
+def test_capture_array_values_and_copy():
+    backend = CountingBackend(_frame(64, 48))
+    with CaptureUtil.CaptureSession(1, backend=backend) as session:
+        view = session.capture_array((10, 20, 14, 22))
+        assert view.shape == (2, 4, 4)
+        assert (view[0, 0] == (0, 20, 10, 255)).all()
+        assert not view.flags.writeable
+        kept = session.capture_array((10, 20, 14, 22), copy=True)
+        session.capture_array((0, 0, 4, 2))
+        # 不复制的结果被下次截图覆盖，复制的不变
+        assert (view[0, 0] == (0, 0, 0, 255)).all()
+        assert (kept[0, 0] == (0, 20, 10, 255)).all()
+        image = session.capture_image((10, 20, 14, 22))
+        assert image.mode == 'RGBA' and image.getpixel((0, 0)) == (10, 20, 0, 255)
+
+
+def test_invalid_rect_and_closed_session():
+    session = CaptureUtil.CaptureSession(1, backend=CountingBackend(_frame(10, 10)))
+    with pytest.raises(ValueError):
+        session.capture_array((5, 5, 5, 8))
+    session.close()
+    with pytest.raises(ValueError):
+        session.capture_array()
+
+
+def test_shared_sessions():
+    backends = []
+
+    def factory(hwnd):
+        backends.append(CountingBackend(_frame(16, 16)))
+        return backends[-1]
+
+    CaptureUtil.close_all_sessions()
+    CaptureUtil.set_backend_factory(factory)
+    try:
+        assert CaptureUtil.get_session(1) is CaptureUtil.get_session(1)
+        assert CaptureUtil.get_session(2) is not CaptureUtil.get_session(1)
+        CaptureUtil.close_session(1)
+        assert backends[0].closed and not backends[1].closed
+    finally:
+        CaptureUtil.close_all_sessions()
+        CaptureUtil.set_backend_factory(None)
+    assert backends[1].closed
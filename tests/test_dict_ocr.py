@@ -0,0 +1,36 @@
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.DictOCR import DictOCR
+
+DIGITS = '0123456789'
+
+
+def _render(text):
+    image = np.zeros((28, 14 * len(text) + 8, 3), dtype=np.uint8)
+    for i, char in enumerate(text):
+        cv2.putText(image, char, (4 + 14 * i, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2, cv2.LINE_8)
+    return image
+
+
+@pytest.mark.parametrize('similarity', [0.9, 0.8, 0.75, 0.7])
+def test_exact_glyph_beats_heavier_glyph(similarity):
+    # 完全匹配的"3"、"5"不能被笔画更多的"8"盖过
+    ocr = DictOCR(color='FFFFFF-101010', similarity=similarity)
+    ocr.build_from_sample(_render(DIGITS), DIGITS)
+    rng = random.Random(1)
+    for _ in range(20):
+        text = ''.join(rng.choice(DIGITS) for _ in range(8))
+        assert ocr.get_text_from_array(_render(text)) == text
+
+
+def test_save_and_load(tmp_path):
+    ocr = DictOCR(color='FFFFFF-101010')
+    ocr.build_from_sample(_render(DIGITS), DIGITS)
+    path = str(tmp_path / 'digits.txt')
+    ocr.save(path)
+    loaded = DictOCR(path, color='FFFFFF-101010')
+    assert loaded.get_text_from_array(_render('31415926')) == '31415926'
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from utils import KeymouseUtil
+
+
+class Recorder(object):
+    """
+    记录发出的消息，发给failing里的窗口时抛异常(和窗口关闭后PostMessage一样)
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def __call__(self, hwnd, msg, wparam, lparam):
+        if hwnd in self.failing:
+            raise OSError('窗口已关闭')
+        with self.lock:
+            self.messages.append((time.perf_counter(), hwnd, msg, wparam, lparam))
+
+
+@pytest.fixture
+def lparam_table(monkeypatch):
+    table = KeymouseUtil.LparamTable(None, lambda virtual_key: {0x11: 0x1D, 0x41: 0x1E}.get(virtual_key, 0))
+    monkeypatch.setattr(KeymouseUtil, '_lparam_table', table)
+    return table
+
+
+def test_dispatcher_survives_failed_post():
+    recorder = Recorder(failing=[2])
+    dispatcher = KeymouseUtil.InputDispatcher(recorder)
+    try:
+        first = dispatcher.submit(KeymouseUtil.click_events(2, 1, 1, delay=0, interval=0))
+        assert first.wait(1)
+        assert len(dispatcher.errors) == 3
+        assert dispatcher.is_alive()
+        second = dispatcher.submit(KeymouseUtil.click_events(1, 10, 20, delay=0, interval=0))
+        assert second.wait(1)
+        assert [m[2] for m in recorder.messages] == [KeymouseUtil.WM_MOUSEMOVE, KeymouseUtil.WM_LBUTTONDOWN,
+                                                     KeymouseUtil.WM_LBUTTONUP]
+    finally:
+        dispatcher.stop()
+    with pytest.raises(ValueError):
+        dispatcher.submit([(0, 1, KeymouseUtil.WM_MOUSEMOVE, 0, 0)])
+
+
+def test_events_are_sent_in_time_order(lparam_table):
+    recorder = Recorder()
+    dispatcher = KeymouseUtil.InputDispatcher(recorder)
+    try:
+        start = time.perf_counter()
+        slow = dispatcher.submit(KeymouseUtil.key_sequence_events(1, [0x41, 0x41], hold=20, interval=20), start)
+        fast = dispatcher.submit(KeymouseUtil.key_chord_events(2, [0x11, 0x41], hold=10), start)
+        assert slow.wait(1) and fast.wait(1)
+    finally:
+        dispatcher.stop()
+    times = [m[0] for m in recorder.messages]
+    assert times == sorted(times)
+    chord = [m[1:] for m in recorder.messages if m[1] == 2]
+    assert chord == [
+        (2, KeymouseUtil.WM_KEYDOWN, 0x11, lparam_table.down[0x11]),
+        (2, KeymouseUtil.WM_KEYDOWN, 0x41, lparam_table.down[0x41]),
+        (2, KeymouseUtil.WM_KEYUP, 0x41, lparam_table.up[0x41]),
+        (2, KeymouseUtil.WM_KEYUP, 0x11, lparam_table.up[0x11]),
+    ]
+    # 最后一个消息在60毫秒的时间点
+    assert times[-1] - start >= 0.06
+
+
+def test_stop_without_drain_releases_waiters():
+    dispatcher = KeymouseUtil.InputDispatcher(Recorder())
+    done = dispatcher.submit([(10000, 1, KeymouseUtil.WM_MOUSEMOVE, 0, 0)])
+    assert dispatcher.pending() == 1
+    dispatcher.stop(drain=False)
+    assert done.is_set()
+    assert not dispatcher.is_alive()
@@ -0,0 +1,35 @@
+import cv2
+import numpy as np
+
+from utils import GraphColorUtil
+
+
+def _noisy_scenes(count, seed=7):
+    """
+    随机的模糊背景，目标图片从背景里截出来再加噪声，相似度在0.9附近
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        src = cv2.GaussianBlur(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8), (0, 0), float(rng.uniform(0.8, 3)))
+        h, w = rng.integers(24, 80, 2)
+        y, x = rng.integers(0, 300 - h), rng.integers(0, 400 - w)
+        noise = rng.normal(0, rng.uniform(5, 25), (h, w, 3))
+        dest = np.clip(src[y:y + h, x:x + w] + noise, 0, 255).astype(np.uint8)
+        yield src, dest
+
+
+def test_pyramid_finds_what_full_resolution_finds():
+    found = 0
+    for src, dest in _noisy_scenes(60):
+        expected = GraphColorUtil.find_picture2(src, dest, 0.9)
+        if expected != (-1, -1):
+            found += 1
+            assert GraphColorUtil.find_picture2(src, dest, 0.9, pyramid=-1) == expected
+    assert found
+
+
+def test_pyramid_exact_match():
+    src, _ = next(_noisy_scenes(1, seed=1))
+    dest = src[120:184, 200:296].copy()
+    # 模糊的背景上相邻位置的相似度也很高，用接近1的相似度只留下原位置
+    assert GraphColorUtil.find_picture2(src, dest, 0.999, pyramid=-1) == (200, 120)
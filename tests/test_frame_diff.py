@@ -0,0 +1,59 @@
+import numpy as np
+
+from utils import FrameDiffUtil, GraphColorUtil
+from utils.FrameDiffUtil import ChangeDetector
+
+RED = {'name': 'red', 'type': 'color', 'rect': (0, 0, 40, 40), 'multi_point_color_str': ['FF0000', '']}
+
+
+def _frame(red_at=None):
+    frame = np.zeros((50, 50, 3), dtype=np.uint8)
+    if red_at is not None:
+        frame[red_at[1], red_at[0]] = (0, 0, 255)
+    return frame
+
+
+def test_unchanged_region_returns_cached_result():
+    detector = ChangeDetector()
+    frame = _frame((5, 5))
+    assert detector.batch_find(frame, [RED], (10, 10)) == {'red': (15, 15)}
+    # 查询区域外的变化不影响结果
+    frame[45, 45] = (0, 0, 255)
+    assert detector.batch_find(frame, [RED], (10, 10)) == {'red': (15, 15)}
+    assert (detector.hits, detector.misses) == (1, 1)
+
+
+def test_fingerprint_covers_only_the_clipped_rect():
+    # 截图从(10, 10)开始，查询区域(0, 0, 40, 40)裁剪后是截图里的(0, 0, 30, 30)
+    detector = ChangeDetector()
+    assert detector.batch_find(_frame(), [RED], (10, 10)) == {'red': (-1, -1)}
+    assert detector.batch_find(_frame((5, 5)), [RED], (10, 10)) == {'red': (15, 15)}
+    assert detector.misses == 2
+    # 截图里(35, 35)在查询区域外，和原来的指纹一样
+    assert detector.batch_find(_frame((35, 35)), [RED], (10, 10)) == {'red': (-1, -1)}
+    assert detector.hits == 0
+
+
+def test_query_outside_frame_is_not_cached():
+    detector = ChangeDetector()
+    query = dict(RED, rect=(100, 100, 120, 120))
+    for _ in range(2):
+        assert detector.batch_find(_frame((5, 5)), [query], (10, 10)) == {'red': (-1, -1)}
+    assert detector.stats()['entries'] == 0
+
+
+def test_results_match_batch_find():
+    detector = ChangeDetector()
+    queries = [RED, {'name': 'pixel', 'type': 'pixel', 'x': 15, 'y': 15, 'color_str': 'FF0000'},
+               {'name': 'gone', 'type': 'pixel', 'x': 0, 'y': 0}]
+    frame = _frame((5, 5))
+    expected = GraphColorUtil.batch_find(frame, queries, (10, 10))
+    assert detector.batch_find(frame, queries, (10, 10)) == expected
+    assert detector.batch_find(frame, queries, (10, 10)) == expected
+    assert expected == {'red': (15, 15), 'pixel': True, 'gone': None}
+
+
+def test_region_fingerprint():
+    fingerprint = FrameDiffUtil.region_fingerprint
+    assert fingerprint(_frame((5, 5)), (0, 0, 10, 10)) != fingerprint(_frame(), (0, 0, 10, 10))
+    assert fingerprint(_frame((5, 5)), (10, 10, 20, 20)) == fingerprint(_frame(), (10, 10, 20, 20))
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from utils.OCR import OCR_PROFILES, OCRCache
+
+
+class FakeEngine(object):
+    """
+    代替OCR的假引擎，识别结果就是当前的识别参数，能看出缓存返回的是哪个参数的结果
+    """
+
+    def __init__(self):
+        self.profile = None
+        self.calls = 0
+
+    def set_profile(self, profile):
+        if isinstance(profile, str):
+            profile = OCR_PROFILES[profile]
+        self.profile = dict(profile)
+
+    def get_text_from_array(self, image, rect=None, binarize=False, scale=1.0, profile=None):
+        self.calls += 1
+        return 'psm%d/%s' % (self.profile['psm'], self.profile['whitelist'])
+
+
+@pytest.fixture
+def image():
+    image = np.zeros((20, 40), dtype=np.uint8)
+    image[5:15, 5:30] = 255
+    return image
+
+
+def test_results_are_keyed_by_profile(image):
+    engine = FakeEngine()
+    cache = OCRCache(engine)
+    assert cache.get_text_from_array(image, profile='digits') == 'psm7/0123456789'
+    # 没指定参数时用default，不能返回digits的结果，也不能沿用引擎上次的参数
+    assert cache.get_text_from_array(image) == 'psm6/None'
+    assert cache.get_text_from_array(image, profile='default') == 'psm6/None'
+    # 名字和内容相同的dict命中同一条缓存
+    assert cache.get_text_from_array(image, profile=dict(OCR_PROFILES['digits'])) == 'psm7/0123456789'
+    assert engine.calls == 2
+    assert cache.stats()['entries'] == 2
+
+
+def test_cache_profile_and_options(image):
+    engine = FakeEngine()
+    cache = OCRCache(engine, profile='line')
+    assert cache.get_text_from_array(image) == 'psm7/None'
+    assert cache.get_text_from_array(image, binarize=True) == 'psm7/None'
+    assert engine.calls == 2
+    changed = image.copy()
+    changed[0, 0] = 255
+    cache.get_text_from_array(changed)
+    assert engine.calls == 3
+
+
+def test_near_duplicate_only_within_same_profile(image):
+    engine = FakeEngine()
+    cache = OCRCache(engine, near_duplicate=2)
+    cache.get_text_from_array(image, profile='word')
+    noisy = image.copy()
+    noisy[0, 0] = 255
+    assert cache.get_text_from_array(noisy, profile='word') == 'psm8/None'
+    assert cache.near_hits == 1
+    assert cache.get_text_from_array(noisy, profile='char') == 'psm10/None'
+    assert engine.calls == 2
+
+
+def test_eviction_by_entries(image):
+    engine = FakeEngine()
+    cache = OCRCache(engine, max_entries=2)
+    for name in ('line', 'word', 'char'):
+        cache.get_text_from_array(image, profile=name)
+    assert cache.stats()['entries'] == 2
+    cache.get_text_from_array(image, profile='line')
+    assert engine.calls == 4
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+
+from utils import CaptureUtil
+from utils.MultiWindowUtil import WindowOrchestrator
+
+# 工作进程里调用的函数要在模块级，才能传到子进程
+
+
+def array_backend(hwnd):
+    frame = np.zeros((20, 30, 3), dtype=np.uint8)
+    frame[:, :, 2] = hwnd
+    return CaptureUtil.ArrayCaptureBackend(frame)
+
+
+def capture_script(context):
+    frame = context.session.capture_array()
+    assert frame[0, 0, 2] == context.hwnd
+    time.sleep(0.001)
+
+
+def finish_script(context):
+    context.state['calls'] = context.state.get('calls', 0) + 1
+    return context.state['calls'] < 3
+
+
+def crash_script(context):
+    raise RuntimeError('脚本出错')
+
+
+def _poll_until(orchestrator, condition, timeout=20):
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        orchestrator.poll()
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_workers_follow_discovered_windows():
+    windows = [1, 2]
+    with WindowOrchestrator(capture_script, lambda: list(windows), array_backend) as orchestrator:
+        assert _poll_until(orchestrator, lambda: all(s['ticks'] > 0 for s in orchestrator.stats().values()))
+        assert set(orchestrator.stats()) == {1, 2}
+        process = orchestrator.workers[2].process
+        windows.remove(2)
+        orchestrator.poll()
+        assert set(orchestrator.workers) == {1}
+        assert not process.is_alive()
+    assert not orchestrator.workers[1].process.is_alive()
+
+
+def test_crashed_worker_is_restarted_up_to_max_restarts():
+    orchestrator = WindowOrchestrator(crash_script, lambda: [3], array_backend, max_restarts=2)
+    with orchestrator:
+        assert _poll_until(orchestrator, lambda: orchestrator.workers[3].finished)
+        stats = orchestrator.stats()[3]
+    assert stats['restarts'] == 2
+    assert not stats['alive']
+
+
+def test_finished_script_is_not_restarted():
+    with WindowOrchestrator(finish_script, lambda: [4], array_backend) as orchestrator:
+        assert _poll_until(orchestrator, lambda: orchestrator.workers[4].finished)
+        stats = orchestrator.stats()[4]
+    assert stats['restarts'] == 0
+    assert stats['ticks'] == 2
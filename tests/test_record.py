@@ -0,0 +1,108 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils import CaptureUtil, RecordUtil
+from utils.RecordUtil import FrameRing
+
+
+def _frame(value, height=8, width=10):
+    return np.full((height, width, 4), value, dtype=np.uint8)
+
+
+@pytest.fixture
+def ring(tmp_path):
+    ring = FrameRing(str(tmp_path / 'frames.ring'), slots=4, slot_size=64 * 64 * 4)
+    yield ring
+    ring.close()
+
+
+def test_append_read_and_wrap(ring):
+    for i in range(6):
+        assert ring.append(_frame(i), hwnd=7, timestamp=100 + i) == i
+    assert (ring.first_seq, ring.write_count, len(ring)) == (2, 6, 4)
+    info, frame = ring.read(5)
+    assert info['hwnd'] == 7 and info['rect'] == (0, 0, 10, 8)
+    assert (frame == 5).all()
+    assert (ring[0][1] == 2).all()
+    assert ring.seek_time(103.5) == 3
+    with pytest.raises(IndexError):
+        ring.read(1)
+
+
+def test_reopen_existing_file(ring):
+    ring.append(_frame(9))
+    ring.flush()
+    with FrameRing(ring.path) as reopened:
+        assert reopened.slots == 4
+        assert (reopened.read(0)[1] == 9).all()
+
+
+def test_read_detects_slot_overwritten_during_copy(ring):
+    for i in range(4):
+        ring.append(_frame(i))
+    info = ring.info
+
+    def info_then_wrap(seq):
+        # 读到帧信息之后、复制完之前，写的一方转了一圈把这个槽覆盖了
+        result = info(seq)
+        for i in range(ring.slots):
+            ring.append(_frame(100 + i))
+        return result
+
+    ring.info = info_then_wrap
+    with pytest.raises(IndexError):
+        ring.read(0)
+
+
+def test_concurrent_reads_are_never_torn(ring):
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            ring.append(_frame(i % 256, 64, 64))
+            i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    torn = complete = 0
+    end = time.perf_counter() + 0.3
+    try:
+        while time.perf_counter() < end:
+            try:
+                _, frame = ring.read(ring.first_seq)
+            except IndexError:
+                continue
+            if frame.min() != frame.max():
+                torn += 1
+            else:
+                complete += 1
+    finally:
+        stop.set()
+        thread.join()
+    assert torn == 0
+    assert complete
+
+
+def test_record_and_replay_session(ring):
+    frames = [_frame(i * 10, 20, 30) for i in range(3)]
+    backend = CaptureUtil.ArrayCaptureBackend(frames[0])
+    CaptureUtil.close_all_sessions()
+    CaptureUtil.set_backend_factory(lambda hwnd: backend)
+    try:
+        RecordUtil.install_recorder(ring)
+        for frame in frames:
+            backend.set_frame(frame)
+            CaptureUtil.get_session(1).capture_array((5, 5, 15, 10))
+        RecordUtil.install_replay(ring)
+        session = CaptureUtil.get_session(1)
+        replayed = [int(session.capture_array((6, 6, 8, 8))[0, 0, 0]) for _ in frames]
+        assert replayed == [0, 10, 20]
+        with pytest.raises(EOFError):
+            session.capture_array((6, 6, 8, 8))
+    finally:
+        CaptureUtil.close_all_sessions()
+        CaptureUtil.set_backend_factory(None)
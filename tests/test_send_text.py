@@ -0,0 +1,63 @@
+import threading
+
+from utils import KeymouseUtil
+
+
+class ClipboardTarget(KeymouseUtil.TextTarget):
+    """
+    只有剪贴板的模拟窗口，WM_PASTE时把剪贴板里的文字记下来
+    """
+
+    def __init__(self, clipboard=None):
+        self.clipboard = clipboard
+        self.pasted = []
+        self.lock = threading.Lock()
+        self.set_calls = []
+
+    def send(self, hwnd, msg, wparam, lparam):
+        if msg == KeymouseUtil.WM_PASTE:
+            self.pasted.append(self.clipboard)
+
+    def acquire_clipboard(self, timeout) -> bool:
+        return self.lock.acquire(timeout=timeout / 1000)
+
+    def release_clipboard(self):
+        self.lock.release()
+
+    def get_clipboard(self):
+        return self.clipboard
+
+    def set_clipboard(self, text):
+        self.set_calls.append(text)
+        self.clipboard = text
+
+
+def _send(target, *args, **kwargs):
+    KeymouseUtil.set_text_target(target)
+    try:
+        return KeymouseUtil.send_text(*args, **kwargs)
+    finally:
+        KeymouseUtil.set_text_target(None)
+
+
+def test_paste_restores_text_clipboard():
+    target = ClipboardTarget('old')
+    assert _send(target, 0, 'hello', mode='paste')
+    assert target.pasted == ['hello']
+    assert target.clipboard == 'old'
+    assert not target.lock.locked()
+
+
+def test_paste_does_not_empty_non_text_clipboard():
+    # get_clipboard对图片等非文字内容返回None，不能用set_clipboard(None)去"恢复"
+    target = ClipboardTarget(None)
+    assert _send(target, 0, 'hello', mode='paste')
+    assert target.set_calls == ['hello']
+
+
+def test_paste_waits_for_clipboard_lock():
+    target = ClipboardTarget('old')
+    target.lock.acquire()
+    assert not _send(target, 0, 'hello', mode='paste', timeout=50)
+    assert target.pasted == []
+    assert target.clipboard == 'old'
@@ -0,0 +1,34 @@
+import time
+
+import pytest
+
+from utils import TimeUtil
+
+
+@pytest.fixture
+def oversleep():
+    saved = list(TimeUtil._oversleep), TimeUtil._spin_margin
+    TimeUtil._oversleep.clear()
+    yield
+    TimeUtil._oversleep.clear()
+    TimeUtil._oversleep.extend(saved[0])
+    TimeUtil._spin_margin = saved[1]
+
+
+def test_one_hiccup_does_not_turn_delays_into_busy_waits(oversleep):
+    for _ in range(20):
+        TimeUtil._record_oversleep(0.0001)
+    TimeUtil._record_oversleep(0.05)
+    assert TimeUtil._spin_margin < 0.001
+
+
+def test_spin_margin_is_capped(oversleep):
+    for _ in range(TimeUtil.OVERSLEEP_HISTORY):
+        TimeUtil._record_oversleep(0.05)
+    assert TimeUtil._spin_margin <= TimeUtil._spin_max
+
+
+def test_delay_is_not_early():
+    start = time.perf_counter()
+    TimeUtil.delay(5)
+    assert time.perf_counter() - start >= 0.005
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from utils import CaptureUtil, WaitUtil
+
+
+class ChangingBackend(CaptureUtil.ArrayCaptureBackend):
+    """
+    第appear_at次截图起画面上出现目标
+    """
+
+    def __init__(self, before, after, appear_at):
+        super().__init__(before)
+        self.after = after
+        self.appear_at = appear_at
+        self.grabs = 0
+
+    def grab(self, left, top, width, height, out):
+        self.grabs += 1
+        if self.grabs == self.appear_at:
+            self.set_frame(self.after)
+        super().grab(left, top, width, height, out)
+
+
+@pytest.fixture
+def backend():
+    before = np.zeros((100, 100, 3), dtype=np.uint8)
+    after = before.copy()
+    after[15, 15] = (0, 0, 255)
+    backend = ChangingBackend(before, after, appear_at=3)
+    CaptureUtil.close_all_sessions()
+    CaptureUtil.set_backend_factory(lambda hwnd: backend)
+    yield backend
+    CaptureUtil.close_all_sessions()
+    CaptureUtil.set_backend_factory(None)
+
+
+def test_wait_for_any_with_rect_smaller_than_query(backend):
+    # 截图区域从(10, 10)开始，查询区域从(0, 0)开始，超出截图的部分要裁掉，不能一直返回缓存的结果
+    query = {'name': 'red', 'type': 'color', 'rect': (0, 0, 40, 40), 'multi_point_color_str': ['FF0000', '']}
+    name, result = WaitUtil.wait_for_any(1, [query], timeout=2000, rect=(10, 10, 60, 60), min_interval=1,
+                                         max_interval=5)
+    assert (name, result) == ('red', (15, 15))
+    assert backend.grabs == 3
+
+
+def test_wait_for_any_timeout(backend):
+    query = {'name': 'green', 'type': 'color', 'rect': (0, 0, 40, 40), 'multi_point_color_str': ['00FF00', '']}
+    assert WaitUtil.wait_for_any(1, [query], timeout=50, rect=(10, 10, 60, 60), min_interval=1,
+                                 max_interval=5) == (None, None)
@@ -0,0 +1,76 @@
+import pytest
+
+from utils.WindowRegistryUtil import FakeDesktop, WindowRegistry
+
+
+@pytest.fixture
+def desktop():
+    return FakeDesktop()
+
+
+def _registry(desktop, max_age=0):
+    # 标题的title_ttl很长，测试的是没到重新读取时间前标题变了的情况
+    return WindowRegistry(desktop, max_age=max_age, title_ttl=60)
+
+
+def test_find_by_index(desktop):
+    game = desktop.add_window('梦幻西游 - 1', 'GameWnd', pid=100)
+    desktop.add_window('记事本', 'Notepad', pid=200)
+    registry = _registry(desktop, max_age=60)
+    assert registry.find(class_name='GameWnd') == [game]
+    assert registry.find(pid=200, class_name='GameWnd') == []
+    assert registry.ergodic_window_hwnd('梦幻') == [game]
+    assert registry.find(title_regex=r'- \d$') == [game]
+    reads = desktop.calls['window_text']
+    # 按类名和进程id查找不读标题
+    registry.find(class_name='GameWnd', pid=100)
+    assert desktop.calls['window_text'] == reads
+
+
+def test_exact_hit_is_confirmed_against_live_title(desktop):
+    hwnd = desktop.add_window('登录', 'GameWnd')
+    registry = _registry(desktop, max_age=60)
+    assert registry.find_window('登录') == hwnd
+    desktop.set_title(hwnd, '游戏中')
+    assert registry.find_window('登录') == 0
+    assert registry.find_window('游戏中') == hwnd
+
+
+def test_regex_hit_is_confirmed_against_live_title(desktop):
+    hwnd = desktop.add_window('角色1 - 等待', 'GameWnd')
+    registry = _registry(desktop, max_age=60)
+    assert registry.find(title_regex='等待$') == [hwnd]
+    desktop.set_title(hwnd, '角色1 - 战斗')
+    assert registry.find(title_regex='等待$') == []
+
+
+def test_renamed_window_is_found_on_miss(desktop):
+    hwnd = desktop.add_window('加载中', 'GameWnd')
+    registry = _registry(desktop)
+    assert registry.find_window('主界面') == 0
+    desktop.set_title(hwnd, '主界面')
+    assert registry.find_window('主界面') == hwnd
+    assert registry.find(title_regex='^主') == [hwnd]
+
+
+def test_closed_window_is_dropped(desktop):
+    first = desktop.add_window('游戏', 'GameWnd')
+    second = desktop.add_window('游戏', 'GameWnd')
+    registry = _registry(desktop, max_age=60)
+    assert registry.find_window('游戏') == second
+    desktop.remove_window(second)
+    assert registry.find_window('游戏') == first
+    assert registry.get(second) is None
+
+
+def test_find_child_window_rereads_changed_children(desktop):
+    parent = desktop.add_window('游戏', 'GameWnd')
+    edit = desktop.add_window('', 'Edit', parent=parent)
+    registry = _registry(desktop, max_age=60)
+    assert registry.find_child_window(parent, None, 'Edit') == edit
+    desktop.remove_window(edit)
+    button = desktop.add_window('确定', 'Button', parent=parent)
+    assert registry.find_child_window(parent, None, 'Edit') == 0
+    assert registry.find_child_window(parent, '确定') == button
+    with pytest.raises(ValueError):
+        registry.find_child_window(parent, None, None)
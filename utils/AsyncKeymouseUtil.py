@@ -0,0 +1,178 @@
+import asyncio
+import time
+
+from utils import KeymouseUtil
+from utils.KeymouseUtil import (MK_LBUTTON, MK_RBUTTON, WM_IME_CHAR, WM_KEYDOWN, WM_KEYUP, WM_LBUTTONDOWN,
+                                WM_LBUTTONUP, WM_MOUSEMOVE, WM_RBUTTONDOWN, WM_RBUTTONUP, WM_SYSKEYDOWN, WM_SYSKEYUP,
+                                make_long)
+
+"""
+    KeymouseUtil的asyncio版本，按键之间的延时用asyncio.sleep，不阻塞线程
+    一个进程里可以同时操作很多个窗口：
+    await asyncio.gather(left_click(hwnd1, 100, 200), key_press(hwnd2, 0x41))
+    发送消息的部分可以用set_poster替换，方便在没有Windows的环境下测试
+    消息常量和按键的lparam表和KeymouseUtil共用
+"""
+
+
+class MessagePoster(object):
+    """
+    发送窗口消息的接口
+    """
+
+    def post(self, hwnd, msg, wparam, lparam):
+        """
+        PostMessage，不等待窗口处理
+        """
+        raise NotImplementedError
+
+    def send(self, hwnd, msg, wparam, lparam):
+        """
+        SendMessage，等待窗口处理完
+        """
+        raise NotImplementedError
+
+    def lparam_table(self) -> KeymouseUtil.LparamTable:
+        """
+        按键消息的lparam表
+        """
+        raise NotImplementedError
+
+
+class Win32MessagePoster(MessagePoster):
+    """
+    用pywin32发送消息，lparam表用KeymouseUtil当前的键盘布局，见KeymouseUtil.set_keyboard_layout
+    """
+
+    def __init__(self):
+        import win32gui
+        self._win32gui = win32gui
+
+    def post(self, hwnd, msg, wparam, lparam):
+        self._win32gui.PostMessage(hwnd, msg, wparam, lparam)
+
+    def send(self, hwnd, msg, wparam, lparam):
+        self._win32gui.SendMessage(hwnd, msg, wparam, lparam)
+
+    def lparam_table(self) -> KeymouseUtil.LparamTable:
+        return KeymouseUtil.get_lparam_table()
+
+
+class RecordingPoster(MessagePoster):
+    """
+    只记录消息不发送，用于测试
+    messages: [(time.perf_counter(), 'post'/'send', hwnd, msg, wparam, lparam), ...]
+    """
+
+    def __init__(self, scancodes=None):
+        """
+        :param scancodes: 虚拟键码到扫描码的dict，没有的键扫描码为0
+        """
+        self.scancodes = scancodes or {}
+        self.messages = []
+        self._lparam_table = KeymouseUtil.LparamTable(None, lambda virtual_key: self.scancodes.get(virtual_key, 0))
+
+    def post(self, hwnd, msg, wparam, lparam):
+        self.messages.append((time.perf_counter(), 'post', hwnd, msg, wparam, lparam))
+
+    def send(self, hwnd, msg, wparam, lparam):
+        self.messages.append((time.perf_counter(), 'send', hwnd, msg, wparam, lparam))
+
+    def lparam_table(self) -> KeymouseUtil.LparamTable:
+        return self._lparam_table
+
+
+_poster = None
+
+
+def set_poster(poster):
+    """
+    替换发送消息的实现
+    :param poster: MessagePoster，传None恢复为Win32MessagePoster
+    """
+    global _poster
+    _poster = poster
+
+
+def get_poster() -> MessagePoster:
+    global _poster
+    if _poster is None:
+        _poster = Win32MessagePoster()
+    return _poster
+
+
+async def key_down(hwnd, virtual_key):
+    poster = get_poster()
+    poster.post(hwnd, WM_KEYDOWN, virtual_key, poster.lparam_table().down[virtual_key])
+
+
+async def key_up(hwnd, virtual_key):
+    poster = get_poster()
+    poster.post(hwnd, WM_KEYUP, virtual_key, poster.lparam_table().up[virtual_key])
+
+
+async def key_press(hwnd, virtual_key, delay=50):
+    await key_down(hwnd, virtual_key)
+    await asyncio.sleep(delay / 1000)
+    await key_up(hwnd, virtual_key)
+
+
+async def move_to(hwnd, x, y):
+    get_poster().post(hwnd, WM_MOUSEMOVE, 0, make_long(x, y))
+
+
+async def _button(hwnd, x, y, msg, button, delay):
+    await move_to(hwnd, x, y)
+    await asyncio.sleep(delay / 1000)
+    get_poster().post(hwnd, msg, button, make_long(x, y))
+
+
+async def left_down(hwnd, x, y, delay=50):
+    await _button(hwnd, x, y, WM_LBUTTONDOWN, MK_LBUTTON, delay)
+
+
+async def left_up(hwnd, x, y, delay=50):
+    await _button(hwnd, x, y, WM_LBUTTONUP, MK_LBUTTON, delay)
+
+
+async def left_click(hwnd, x, y, delay=50):
+    await left_down(hwnd, x, y, delay)
+    await asyncio.sleep(delay / 1000)
+    await left_up(hwnd, x, y, delay)
+    await asyncio.sleep(delay / 1000)
+
+
+async def right_down(hwnd, x, y, delay=50):
+    await _button(hwnd, x, y, WM_RBUTTONDOWN, MK_RBUTTON, delay)
+
+
+async def right_up(hwnd, x, y, delay=50):
+    await _button(hwnd, x, y, WM_RBUTTONUP, MK_RBUTTON, delay)
+
+
+async def right_click(hwnd, x, y, delay=50):
+    await right_down(hwnd, x, y, delay)
+    await asyncio.sleep(delay / 1000)
+    await right_up(hwnd, x, y, delay)
+
+
+async def alt_combo_key(hwnd, virtual_key, delay=50):
+    """
+    alt的组合键
+    """
+    poster = get_poster()
+    poster.post(hwnd, WM_SYSKEYDOWN, virtual_key, poster.lparam_table().alt_down[virtual_key])
+    await asyncio.sleep(delay / 1000)
+    poster.post(hwnd, WM_SYSKEYUP, virtual_key, poster.lparam_table().alt_up[virtual_key])
+
+
+async def send_text(hwnd, text, delay=10):
+    """
+    输入字符串
+    SendMessage会等待窗口处理，放到线程池里执行，不阻塞事件循环
+    """
+    loop = asyncio.get_running_loop()
+    poster = get_poster()
+    for char in text:
+        await loop.run_in_executor(None, poster.send, hwnd, WM_IME_CHAR, ord(char), 0)
+        await asyncio.sleep(delay / 1000)
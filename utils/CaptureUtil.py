@@ -0,0 +1,342 @@
+import atexit
+import ctypes
+import threading
+from struct import pack, calcsize
+
+import numpy as np
+from PIL import Image
+
+from utils import MetricsUtil
+
+
+class CaptureBackend(object):
+    """
+    截图后端接口
+    CaptureSession只通过这几个方法截图，Windows下用GdiCaptureBackend，其他场景可以换成ArrayCaptureBackend
+    """
+
+    def client_size(self) -> (int, int):
+        """
+        窗口客户区大小
+        :return: (宽, 高)
+        """
+        raise NotImplementedError
+
+    def allocate(self, width, height):
+        """
+        窗口大小变化时调用，重新创建截图用的资源，之后要能截取这个大小以内的任意区域
+        :param width: 宽，不小于客户区宽
+        :param height: 高，不小于客户区高
+        """
+
+    def grab(self, left, top, width, height, out):
+        """
+        截图到out里
+        :param left: 窗口中截图区域左上角x坐标
+        :param top: 窗口中截图区域左上角y坐标
+        :param width: 截图宽
+        :param height: 截图高
+        :param out: 形状为(高, 宽, 4)的uint8数组，BGRA顺序，从上到下
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        释放资源
+        """
+
+
+class GdiCaptureBackend(CaptureBackend):
+    """
+    用GDI的BitBlt截图，DC和位图按客户区大小创建，窗口大小不变时一直复用，截不同的区域不用重新创建
+    位图是从上到下的DIB section，BitBlt把截图区域画到位图左上角后直接从位图的内存拷贝到输出缓冲区
+    """
+
+    def __init__(self, hwnd):
+        import win32gui
+        self.hwnd = hwnd
+        # 源DC
+        self.src_dc = win32gui.GetDC(hwnd)
+        # 内存DC
+        self.mem_dc = win32gui.CreateCompatibleDC(self.src_dc)
+        self.bitmap = None
+        # 内存DC创建时自带的位图，删除自己的位图前要先选回去，选在DC里的位图DeleteObject会失败
+        self.default_bitmap = None
+        # 位图的像素，形状为(高, 宽, 4)的uint8数组，指向DIB section的内存
+        self.bits = None
+
+    def client_size(self) -> (int, int):
+        import win32gui
+        rect = win32gui.GetClientRect(self.hwnd)
+        return rect[2] - rect[0], rect[3] - rect[1]
+
+    def allocate(self, width, height):
+        import win32con
+        import win32gui
+        self._delete_bitmap()
+        # BITMAPINFOHEADER 高度为负数表示从上到下
+        bmi = pack('<LllHHLLllLL', calcsize('<LllHHLLllLL'), width, -height, 1, 32, 0, 0, 0, 0, 0, 0)
+        pixels = ctypes.c_void_p()
+        create_dib_section = ctypes.windll.gdi32.CreateDIBSection
+        create_dib_section.restype = ctypes.c_void_p
+        # 创建可以直接访问像素内存的位图
+        self.bitmap = create_dib_section(self.src_dc, bmi, win32con.DIB_RGB_COLORS, ctypes.byref(pixels), None, 0)
+        if not self.bitmap:
+            self.bitmap = None
+            raise ValueError('创建位图失败：%dx%d' % (width, height))
+        # 选择一对象到指定的设备上下文环境中
+        previous = win32gui.SelectObject(self.mem_dc, self.bitmap)
+        if self.default_bitmap is None:
+            self.default_bitmap = previous
+        buffer = (ctypes.c_ubyte * (width * height * 4)).from_address(pixels.value)
+        self.bits = np.ctypeslib.as_array(buffer).reshape(height, width, 4)
+
+    def grab(self, left, top, width, height, out):
+        import win32con
+        import win32gui
+        # 实际截图，画到位图的左上角
+        win32gui.BitBlt(self.mem_dc, 0, 0, width, height, self.src_dc, left, top, win32con.SRCCOPY)
+        # 等GDI画完再读位图的内存
+        ctypes.windll.gdi32.GdiFlush()
+        out[:] = self.bits[:height, :width]
+
+    def _delete_bitmap(self):
+        if self.bitmap is not None:
+            import win32gui
+            self.bits = None
+            win32gui.SelectObject(self.mem_dc, self.default_bitmap)
+            win32gui.DeleteObject(self.bitmap)
+            self.bitmap = None
+
+    def close(self):
+        import win32gui
+        self._delete_bitmap()
+        if self.mem_dc is not None:
+            win32gui.DeleteDC(self.mem_dc)
+            win32gui.ReleaseDC(self.hwnd, self.src_dc)
+            self.mem_dc = None
+            self.src_dc = None
+
+
+class ArrayCaptureBackend(CaptureBackend):
+    """
+    从numpy数组或图片文件截图，不依赖Windows，用于测试或者离线跑脚本
+    """
+
+    def __init__(self, frame=None):
+        """
+        :param frame: 当前画面，numpy数组(BGR/BGRA)、PIL的image对象或者图片路径
+        """
+        self.frame = None
+        if frame is not None:
+            self.set_frame(frame)
+
+    def set_frame(self, frame):
+        """
+        更换当前画面
+        :param frame: numpy数组(BGR/BGRA)、PIL的image对象或者图片路径
+        """
+        if not isinstance(frame, np.ndarray):
+            if not isinstance(frame, Image.Image):
+                with Image.open(frame) as image:
+                    frame = image.convert('RGBA')
+            frame = np.asarray(frame.convert('RGBA'))[:, :, [2, 1, 0, 3]]
+        if frame.ndim != 3 or frame.shape[2] not in (3, 4):
+            raise ValueError('画面必须是BGR或BGRA数组')
+        self.frame = frame
+
+    def client_size(self) -> (int, int):
+        return self.frame.shape[1], self.frame.shape[0]
+
+    def grab(self, left, top, width, height, out):
+        region = self.frame[top:top + height, left:left + width]
+        if region.shape[:2] != (height, width):
+            raise ValueError('截图区域超出画面范围')
+        out[:, :, :3] = region[:, :, :3]
+        out[:, :, 3] = region[:, :, 3] if region.shape[2] == 4 else 255
+
+
+# 创建截图后端的函数，参数为窗口句柄
+_backend_factory = GdiCaptureBackend
+
+
+def set_backend_factory(factory):
+    """
+    替换默认的截图后端，之后新建的CaptureSession都使用它
+    :param factory: 参数为窗口句柄，返回CaptureBackend的函数，传None恢复为GdiCaptureBackend
+    """
+    global _backend_factory
+    _backend_factory = factory if factory is not None else GdiCaptureBackend
+
+
+def get_backend_factory():
+    """
+    当前创建截图后端的函数，包装已有后端时用
+    """
+    return _backend_factory
+
+
+def create_backend(hwnd) -> CaptureBackend:
+    """
+    创建默认的截图后端
+    :param hwnd: 窗口句柄
+    :return: CaptureBackend
+    """
+    return _backend_factory(hwnd)
+
+
+class CaptureSession(object):
+    """
+    持续截图的会话，DC、位图和输出缓冲区按客户区大小创建，窗口大小不变时一直复用
+    交替截取大小不同的区域也不会重新创建
+    可以用with语句，退出时释放资源
+    """
+
+    def __init__(self, hwnd, rect=None, backend=None):
+        """
+        :param hwnd: 要截图的窗口句柄
+        :param rect: 默认截图区域(left, top, right, bottom)，None表示整个客户区
+        :param backend: 截图后端，None时用create_backend创建
+        """
+        self.hwnd = hwnd
+        self.rect = rect
+        self.backend = backend if backend is not None else create_backend(hwnd)
+        self.frames = 0
+        # 上次创建资源时的客户区大小和资源的大小(宽, 高)
+        self._client = None
+        self._capacity = None
+        # 输出缓冲区，一维，只增不减，每次截图取开头的宽*高*4个字节作为输出
+        self._storage = None
+        self._buffer = None
+        # 截图和使用截图结果时都可以持有这个锁，防止别的线程覆盖缓冲区
+        self.lock = threading.RLock()
+
+    def _resolve_rect(self, rect, client):
+        """
+        确定截图区域，None时取默认区域，默认区域也是None时取整个客户区
+        """
+        rect = rect if rect is not None else self.rect
+        if rect is None:
+            return (0, 0) + tuple(client)
+        return rect
+
+    def _grab(self, rect):
+        """
+        截图到内部缓冲区，调用方需要持有锁
+        :return: (缓冲区, 截图区域)
+        """
+        if self.backend is None:
+            raise ValueError('CaptureSession已关闭')
+        client = self.backend.client_size()
+        left, top, right, bottom = self._resolve_rect(rect, client)
+        width = right - left
+        height = bottom - top
+        if width <= 0 or height <= 0:
+            raise ValueError('截图区域为空：%s' % ((left, top, right, bottom),))
+        # 窗口大小变了(或者截图区域超出了已有的资源)才重新创建资源，截图区域大小变化不用
+        if self._client != client or width > self._capacity[0] or height > self._capacity[1]:
+            capacity = (max(client[0], width), max(client[1], height))
+            self.backend.allocate(*capacity)
+            self._client = client
+            self._capacity = capacity
+        size = width * height * 4
+        if self._storage is None or self._storage.size < size:
+            self._storage = np.empty(self._capacity[0] * self._capacity[1] * 4, dtype=np.uint8)
+        self._buffer = self._storage[:size].reshape(height, width, 4)
+        with MetricsUtil.timer('capture'):
+            self.backend.grab(left, top, width, height, self._buffer)
+        self.frames += 1
+        MetricsUtil.count('capture_frames')
+        MetricsUtil.count('capture_bytes', self._buffer.nbytes)
+        return self._buffer, (left, top, right, bottom)
+
+    def capture_array(self, rect=None, copy=False) -> np.ndarray:
+        """
+        截图转成numpy数组，默认直接返回内部缓冲区，不做任何复制
+        注意：不复制时返回的数组在本会话下次截图时会被覆盖，多线程共用会话时在self.lock内使用
+        :param rect: 截图区域(left, top, right, bottom)，None时取默认区域
+        :param copy: 是否返回一份复制，需要保留截图结果时传True
+        :return: 形状为(高, 宽, 4)的uint8数组，BGRA顺序，不复制时只读
+        """
+        with self.lock:
+            buffer, _ = self._grab(rect)
+            if copy:
+                return buffer.copy()
+            view = buffer.view()
+            view.flags.writeable = False
+            return view
+
+    def capture_image(self, rect=None) -> Image.Image:
+        """
+        截图转成PIL的image对象
+        :param rect: 截图区域(left, top, right, bottom)，None时取默认区域
+        :return: RGBA的image对象
+        """
+        with self.lock:
+            buffer, _ = self._grab(rect)
+            height, width = buffer.shape[:2]
+            # 解码时直接调整颜色通道的顺序 (BGRA -> RGBA)
+            return Image.frombytes('RGBA', (width, height), buffer, 'raw', 'BGRA')
+
+    def close(self):
+        """
+        释放截图资源
+        """
+        with self.lock:
+            if self.backend is not None:
+                self.backend.close()
+                self.backend = None
+                self._buffer = None
+                self._storage = None
+                self._client = None
+                self._capacity = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# 每个窗口一个会话，供screenshot_*函数复用
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(hwnd) -> CaptureSession:
+    """
+    获取窗口共用的截图会话，没有时创建
+    :param hwnd: 窗口句柄
+    :return: CaptureSession
+    """
+    with _sessions_lock:
+        session = _sessions.get(hwnd)
+        if session is None:
+            session = CaptureSession(hwnd)
+            _sessions[hwnd] = session
+        return session
+
+
+def close_session(hwnd):
+    """
+    释放窗口共用的截图会话，窗口关闭后调用
+    :param hwnd: 窗口句柄
+    """
+    with _sessions_lock:
+        session = _sessions.pop(hwnd, None)
+    if session is not None:
+        session.close()
+
+
+def close_all_sessions():
+    """
+    释放所有共用的截图会话
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_all_sessions)
@@ -0,0 +1,321 @@
+import sys
+
+import cv2
+import numpy as np
+
+from utils import GraphColorUtil, MetricsUtil
+
+"""
+    字库识别：游戏界面的文字一般只有几种固定字体，按颜色二值化后和字库里的点阵逐个比对，比tesseract快得多
+    字库文件每行一个字：字符\\t高\\t宽\\t点阵(按行展开后np.packbits的十六进制)
+"""
+
+
+class Glyph(object):
+    """
+    字库里的一个字
+    bits: 点阵，形状为(高, 宽)的bool数组，已经裁掉四周的空白
+    popcount: 点阵里有颜色的点数
+    """
+
+    def __init__(self, char, bits):
+        self.char = char
+        self.bits = np.asarray(bits, dtype=bool)
+        self.popcount = int(self.bits.sum())
+
+    @property
+    def shape(self):
+        return self.bits.shape
+
+    def to_line(self) -> str:
+        height, width = self.bits.shape
+        return '%s\t%d\t%d\t%s' % (self.char, height, width, np.packbits(self.bits, axis=None).tobytes().hex())
+
+    @staticmethod
+    def from_line(line):
+        char, height, width, data = line.rstrip('\r\n').split('\t')
+        height, width = int(height), int(width)
+        bits = np.unpackbits(np.frombuffer(bytes.fromhex(data), dtype=np.uint8), count=height * width)
+        return Glyph(char, bits.reshape(height, width))
+
+
+def _trim(mask):
+    """
+    裁掉四周的空白
+    :return: (裁好的点阵, left, top)，全空时点阵为None
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return None, 0, 0
+    return mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1], int(cols[0]), int(rows[0])
+
+
+def _runs(flags):
+    """
+    连续为True的区间
+    :return: [(开始, 结束), ...]，不包括结束
+    """
+    padded = np.concatenate(([False], flags, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+class DictOCR(object):
+    """
+    字库识别，用法和OCR类似
+    ocr = DictOCR('font.txt', 'FFFFFF-202020')
+    ocr.get_text_from_array(frame, (100, 20, 200, 40))
+    """
+
+    def __init__(self, dict_path=None, color='FFFFFF-101010', similarity=0.9):
+        """
+        :param dict_path: 字库文件路径，None时为空字库
+        :param color: 文字颜色，如FFFFFF-101010，多个颜色用list
+        :param similarity: 相似度，点阵不同的点数不超过(1-similarity)*面积才算匹配
+        """
+        self.color = color
+        self.similarity = similarity
+        self.ready = True
+        # key: (高, 宽) value: (字list, 点阵矩阵(字数, 高*宽), popcount数组)，按popcount从小到大排列
+        self._index = {}
+        self.glyphs = []
+        if dict_path is not None:
+            self.load(dict_path)
+
+    def load(self, path):
+        """
+        加载字库文件，会追加到当前字库
+        """
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    self.glyphs.append(Glyph.from_line(line))
+        self._build_index()
+
+    def save(self, path):
+        """
+        保存字库文件
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            for glyph in self.glyphs:
+                f.write(glyph.to_line() + '\n')
+
+    def _build_index(self):
+        """
+        按点阵大小分组，同一组的点阵按popcount从小到大排好后叠成一个矩阵，比对时一次算完
+        """
+        groups = {}
+        for glyph in self.glyphs:
+            groups.setdefault(glyph.shape, []).append(glyph)
+        self._index = {}
+        for shape, glyphs in groups.items():
+            glyphs.sort(key=lambda g: g.popcount)
+            matrix = np.array([g.bits.reshape(-1) for g in glyphs], dtype=np.float32)
+            popcount = np.array([g.popcount for g in glyphs], dtype=np.float32)
+            self._index[shape] = (glyphs, matrix, popcount)
+
+    def binarize(self, image, rect=None, color=None) -> np.ndarray:
+        """
+        按文字颜色二值化
+        :param image: numpy数组(BGR/BGRA)或者PIL的image对象
+        :param rect: 区域(left, top, right, bottom)，None表示整张图
+        :param color: 文字颜色，None时用创建时的颜色
+        :return: 形状为(高, 宽)的bool数组，文字颜色的点为True
+        """
+        image = GraphColorUtil._to_bgr_array(image)
+        if rect is not None:
+            left, top, right, bottom = rect
+            image = image[top:bottom, left:right]
+        colors = color if color is not None else self.color
+        if isinstance(colors, str):
+            colors = [colors]
+        mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        for color_str in colors:
+            pattern = GraphColorUtil.ColorPattern.compile([color_str, ''])
+            mask |= cv2.inRange(image, *pattern.anchor_bounds(image.shape[2]))
+        return mask.astype(bool)
+
+    def add_glyph(self, char, mask):
+        """
+        往字库里加一个字
+        :param char: 字符
+        :param mask: 二值化后的点阵，会自动裁掉四周的空白
+        """
+        bits, _, _ = _trim(np.asarray(mask, dtype=bool))
+        if bits is None:
+            raise ValueError('点阵是空的：%s' % char)
+        self.glyphs.append(Glyph(char, bits))
+        self._build_index()
+
+    def add_glyph_from_image(self, char, image, rect=None, color=None):
+        """
+        从截图里取一个字加到字库
+        :param char: 字符
+        :param image: numpy数组(BGR/BGRA)或者PIL的image对象
+        :param rect: 字所在的区域，None表示整张图
+        :param color: 文字颜色，None时用创建时的颜色
+        """
+        self.add_glyph(char, self.binarize(image, rect, color))
+
+    def build_from_sample(self, image, text, rect=None, color=None):
+        """
+        从样本截图批量制作字库
+        样本里的字按列投影切开(字和字之间要有空白列)，切出的个数要和text去掉空格后的字数一样
+        左右结构中间有空白的字(如"川")请用add_glyph_from_image单独添加
+        :param image: numpy数组(BGR/BGRA)或者PIL的image对象
+        :param text: 样本里的文字，按从左到右的顺序
+        :param rect: 样本所在的区域，None表示整张图
+        :param color: 文字颜色，None时用创建时的颜色
+        :return: 添加的字数
+        """
+        mask = self.binarize(image, rect, color)
+        chars = [c for c in text if not c.isspace()]
+        segments = _runs(mask.any(axis=0))
+        if len(segments) != len(chars):
+            raise ValueError('切出了%d个字，和文字的字数%d不一致' % (len(segments), len(chars)))
+        for char, (start, end) in zip(chars, segments):
+            bits, _, _ = _trim(mask[:, start:end])
+            self.glyphs.append(Glyph(char, bits))
+        self._build_index()
+        return len(chars)
+
+    def _match_at(self, line, x):
+        """
+        在x列找最匹配的字，字的左边对齐x，上下位置不限
+        :return: (字, 上边y, 不匹配点数)，没找到返回None
+        """
+        line_height, line_width = line.shape
+        best = None
+        best_key = None
+        for (height, width), (glyphs, matrix, popcount) in self._index.items():
+            if height > line_height or x + width > line_width:
+                continue
+            # 所有上下位置的窗口展开成(位置数, 高*宽)
+            windows = np.lib.stride_tricks.sliding_window_view(line[:, x:x + width], (height, width))
+            windows = windows.reshape(-1, height * width).astype(np.float32)
+            ink = windows.sum(axis=1)
+            limit = (1 - self.similarity) * height * width
+            # 不匹配点数至少是|字的点数 - 窗口的点数|，按popcount只取可能在limit以内的字
+            low = np.searchsorted(popcount, ink.min() - limit, 'left')
+            high = np.searchsorted(popcount, ink.max() + limit, 'right')
+            if low >= high:
+                continue
+            overlap = matrix[low:high] @ windows.T
+            # 不匹配点数 = 字的点数 + 窗口的点数 - 2 * 重合的点数
+            mismatch = popcount[low:high, None] + ink[None, :] - 2 * overlap
+            ys = mismatch.argmin(axis=1)
+            rows = np.arange(high - low)
+            values = mismatch[rows, ys]
+            # 得分 = 重合的点数 - 不匹配点数：笔画多的字不会盖过完全匹配的字(如"3"被认成"8")，
+            # 笔画少的字也不会因为刚好是别的字的一部分(如"1"是"4"的一部分)而被选中
+            scores = overlap[rows, ys] - values
+            for i in np.flatnonzero(values <= limit):
+                glyph = glyphs[low + i]
+                # 得分相同时优先笔画多的字
+                key = (scores[i], glyph.popcount)
+                if best_key is None or key > best_key:
+                    best_key = key
+                    best = (glyph, int(ys[i]), float(values[i]))
+        return best
+
+    def _recognize_line(self, line, offset_x, offset_y):
+        result = []
+        columns = line.any(axis=0)
+        x = 0
+        width = line.shape[1]
+        while x < width:
+            if not columns[x]:
+                x += 1
+                continue
+            match = self._match_at(line, x)
+            if match is None:
+                # 不认识的字，跳过这一列
+                x += 1
+                continue
+            glyph, y, mismatch = match
+            height, glyph_width = glyph.shape
+            result.append({'text': glyph.char,
+                           'confidence': 100.0 * (1 - mismatch / (height * glyph_width)),
+                           'box': (offset_x + x, offset_y + y, offset_x + x + glyph_width, offset_y + y + height)})
+            x += glyph_width
+        return result
+
+    def _recognize_lines(self, image, rect, color):
+        """
+        按行投影切成多行后逐行识别
+        :return: 每行的识别结果list
+        """
+        mask = self.binarize(image, rect, color)
+        offset_x, offset_y = (rect[0], rect[1]) if rect is not None else (0, 0)
+        return [self._recognize_line(mask[top:bottom], offset_x, offset_y + top)
+                for top, bottom in _runs(mask.any(axis=1))]
+
+    @MetricsUtil.timed('dict_ocr.recognize')
+    def recognize(self, image, rect=None, color=None):
+        """
+        识别并返回每个字的内容、置信度和位置，多行时按行从上到下
+        :param image: numpy数组(BGR/BGRA)或者PIL的image对象
+        :param rect: 只识别这个区域(left, top, right, bottom)，None表示整张图
+        :param color: 文字颜色，None时用创建时的颜色
+        :return: [{'text': 字, 'confidence': 置信度(0~100), 'box': (left, top, right, bottom)}, ...]，box为image中的坐标
+        """
+        return [item for line in self._recognize_lines(image, rect, color) for item in line]
+
+    @MetricsUtil.timed('dict_ocr.get_text_from_array')
+    def get_text_from_array(self, image, rect=None, color=None):
+        """
+        识别内存中的图片
+        :param image: numpy数组(BGR/BGRA)或者PIL的image对象
+        :param rect: 只识别这个区域(left, top, right, bottom)，None表示整张图
+        :param color: 文字颜色，None时用创建时的颜色
+        :return: 识别结果，多行用换行分隔
+        """
+        lines = self._recognize_lines(image, rect, color)
+        return '\n'.join(''.join(item['text'] for item in line) for line in lines if line)
+
+    def get_text(self, path, rect=None, color=None):
+        """
+        识别图片文件
+        :param path: 图片路径
+        """
+        from PIL import Image
+        if isinstance(path, bytes):
+            path = bytes.decode(path)
+        with Image.open(path) as image:
+            return self.get_text_from_array(image.convert('RGB'), rect, color)
+
+    def screenshot_get_text(self, hwnd, left, top, right, bottom, color=None):
+        """
+        截图并识别
+        :param hwnd: 要截图的窗口句柄
+        :param left: 窗口中截图区域左上角x坐标
+        :param top: 窗口中截图区域左上角y坐标
+        :param right: 右下角x坐标
+        :param bottom: 右下角y坐标
+        :param color: 文字颜色，None时用创建时的颜色
+        :return: 识别结果
+        """
+        with GraphColorUtil.screenshot_frame(hwnd, left, top, right, bottom) as frame:
+            return self.get_text_from_array(frame, None, color)
+
+    def close(self):
+        """
+        和OCR的接口保持一致，没有需要释放的资源
+        """
+
+
+if __name__ == '__main__':
+    # 制作字库(在项目根目录运行)：python -m utils.DictOCR 样本图片 样本文字 文字颜色 字库文件
+    # 例如：python -m utils.DictOCR sample.png 0123456789 FFFFFF-202020 digits.txt
+    from PIL import Image
+
+    sample_path, sample_text, sample_color, dict_file = sys.argv[1:5]
+    builder = DictOCR(color=sample_color)
+    try:
+        builder.load(dict_file)
+    except FileNotFoundError:
+        pass
+    with Image.open(sample_path) as sample:
+        print('添加了%d个字' % builder.build_from_sample(sample.convert('RGB'), sample_text))
+    builder.save(dict_file)
@@ -0,0 +1,173 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import CaptureUtil, GraphColorUtil
+
+
+def region_fingerprint(image, rect=None, step=1) -> int:
+    """
+    计算区域的指纹，区域内像素不变指纹就不变
+    :param image: numpy数组(BGR/BGRA/灰度)
+    :param rect: 区域(left, top, right, bottom)，相对image的坐标，None表示整张图
+    :param step: 采样步长，1表示逐像素计算(任何像素变化都能发现)，大于1时只看部分像素，更快但可能漏掉小的变化
+    :return: 指纹
+    """
+    if rect is not None:
+        left, top, right, bottom = rect
+        image = image[top:bottom, left:right]
+    if step > 1:
+        image = image[::step, ::step]
+    return zlib.crc32(np.ascontiguousarray(image)) ^ hash(image.shape)
+
+
+class ChangeDetector(object):
+    """
+    区域没变化时直接返回上次的查找结果，不重新找图找色
+    每个key记一份(指纹, 结果)，超过max_entries时淘汰最久没用到的
+    """
+
+    def __init__(self, max_entries=256, step=1):
+        """
+        :param max_entries: 最多缓存几个key的结果
+        :param step: 计算指纹的采样步长，见region_fingerprint
+        """
+        self.max_entries = max_entries
+        self.step = step
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        命中率，命中表示跳过了一次查找
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _lookup(self, key, fingerprint):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def _store(self, key, fingerprint, result):
+        with self._lock:
+            self._cache[key] = (fingerprint, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def evaluate(self, key, image, rect, func, *args, **kwargs):
+        """
+        区域和上次相同时返回上次的结果，否则调用func(*args, **kwargs)
+        :param key: 查询的唯一标识，不同的查询要用不同的key
+        :param image: numpy数组(BGR/BGRA/灰度)
+        :param rect: func用到的区域(left, top, right, bottom)，相对image的坐标，None表示整张图
+        :param func: 查找函数
+        :return: func的结果
+        """
+        fingerprint = region_fingerprint(image, rect, self.step)
+        found, result = self._lookup(key, fingerprint)
+        if found:
+            return result
+        result = func(*args, **kwargs)
+        self._store(key, fingerprint, result)
+        return result
+
+    def batch_find(self, image, queries, origin=(0, 0), parallel=True):
+        """
+        和GraphColorUtil.batch_find一样，区域没变化的查询直接返回上次的结果
+        查询的key由name和所有参数组成，参数变了会重新查找
+        :param image: 截图，PIL的image对象或者numpy数组(BGR/BGRA)
+        :param queries: 查询dict的list，格式见GraphColorUtil.batch_find
+        :param origin: 截图左上角在窗口中的坐标
+        :param parallel: 是否用线程池并行查找
+        :return: {name: 结果}
+        """
+        if not isinstance(image, np.ndarray):
+            image = GraphColorUtil._to_bgr_array(image)
+        height, width = image.shape[:2]
+        results = {}
+        pending = []
+        fingerprints = {}
+        for query in queries:
+            rect = _query_rect(query, origin, width, height)
+            if rect is None:
+                # 查询区域不在截图里，没有可以比较的像素，每次都重新查找，不缓存
+                pending.append(query)
+                continue
+            key = (query['name'], repr(sorted(query.items(), key=lambda item: item[0])))
+            fingerprint = region_fingerprint(image, rect, self.step)
+            found, result = self._lookup(key, fingerprint)
+            if found:
+                results[query['name']] = result
+            else:
+                pending.append(query)
+                fingerprints[query['name']] = (key, fingerprint)
+        if pending:
+            found = GraphColorUtil.batch_find(image, pending, origin, parallel)
+            for name, result in found.items():
+                if name in fingerprints:
+                    key, fingerprint = fingerprints[name]
+                    self._store(key, fingerprint, result)
+                results[name] = result
+        return {query['name']: results[query['name']] for query in queries}
+
+    def screenshot_batch_find(self, hwnd, queries, rect=None, parallel=True):
+        """
+        截一次图，批量查找，区域没变化的查询直接返回上次的结果
+        :param hwnd: 要截图的窗口句柄
+        :param queries: 查询dict的list，格式见GraphColorUtil.batch_find
+        :param rect: 截图区域(left, top, right, bottom)，None时取所有查询区域的外接矩形
+        :param parallel: 是否用线程池并行查找
+        :return: {name: 结果}
+        """
+        if rect is None:
+            rect = GraphColorUtil._queries_rect(queries)
+        session = CaptureUtil.get_session(hwnd)
+        with session.lock:
+            frame = session.capture_array(rect)
+            return self.batch_find(frame, queries, rect[:2] if rect is not None else (0, 0), parallel)
+
+    def clear(self):
+        """
+        清空缓存和统计
+        """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        统计信息
+        :return: {'hits': 命中次数, 'misses': 未命中次数, 'hit_rate': 命中率, 'entries': 缓存数量}
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate, 'entries': len(self._cache)}
+
+
+def _query_rect(query, origin, width, height):
+    """
+    查询区域裁到截图范围内，转成相对截图的坐标，和GraphColorUtil.batch_find实际查找的区域一致
+    :return: (left, top, right, bottom)，不在截图里时返回None
+    """
+    if query['type'] == 'pixel':
+        rect = (query['x'], query['y'], query['x'] + 1, query['y'] + 1)
+    else:
+        rect = query.get('rect')
+        if rect is None:
+            return 0, 0, width, height
+    rect = GraphColorUtil._clip_rect(rect, origin, width, height)
+    if rect is None:
+        return None
+    left, top, right, bottom = rect
+    return left - origin[0], top - origin[1], right - origin[0], bottom - origin[1]
@@ -1,20 +1,19 @@
-import ctypes
+import contextlib
+import functools
 import math
-
-import threading
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
-import win32con
-import win32gui
-from struct import pack, calcsize
-
 import numpy as np
-from PIL import Image, ImageOps
+
+from utils import CaptureUtil, MetricsUtil, TemplateUtil
 
 
 def screenshot_to_bitmap_array(hwnd, left, top, right, bottom):
     """
     截图转成image对象
+    同一个窗口共用一个CaptureSession，DC、位图和缓冲区会一直复用，见CaptureUtil
     :param hwnd: 要截图的窗口句柄
     :param left: 窗口中截图区域左上角x坐标
     :param top: 窗口中截图区域左上角y坐标
@@ -22,43 +21,38 @@ def screenshot_to_bitmap_array(hwnd, left, top, right, bottom):
     :param bottom: 右下角y坐标
     :return: 返回PIL的image对象
     """
-    width = right - left
-    height = bottom - top
-    # 创建互斥锁对象
-    mutex = threading.Lock()
-    # 源DC
-    src_dc = win32gui.GetDC(hwnd)
-    # 内存DC
-    mem_dc = win32gui.CreateCompatibleDC(src_dc)
-    # 创建与指定的设备环境相关的设备兼容的位图
-    save_bitmap = ctypes.windll.gdi32.CreateCompatibleBitmap(src_dc, width, height)
-    # 选择一对象到指定的设备上下文环境中
-    win32gui.SelectObject(mem_dc, save_bitmap)
-    # 使用互斥锁保护代码块
-    with mutex:
-        # 实际截图
-        win32gui.BitBlt(mem_dc, 0, 0, width, height, src_dc, left, top, win32con.SRCCOPY)
-        # 分配内存空间
-        _data = ctypes.create_string_buffer(height * width * 4)
-        bmi = pack('LHHHH', calcsize('LHHHH'), width, height, 1, 32)
-        # 获取的图像信息按照底部-顶部的顺序排列
-        ctypes.windll.gdi32.GetDIBits(mem_dc, save_bitmap, 0, height, _data, bmi, win32con.DIB_RGB_COLORS)
-    # 将图像数据转为numpy数组
-    image_array = np.ctypeslib.as_array(_data)
-    # 翻转图像数据
-    image_array = image_array.reshape((height, width, 4))
-    image_array = np.flipud(image_array)
-    # 调整颜色通道的顺序 (BGR -> RGB)
-    image_array = image_array[:, :, [2, 1, 0, 3]]
-    # 将 numpy 数组转换为一维，以便创建 PIL Image 对象
-    image_array = image_array.flatten()
-    # 创建PIL Image对象
-    image = Image.frombytes('RGBA', (width, height), image_array)
-    # 释放内存
-    win32gui.DeleteObject(save_bitmap)
-    win32gui.DeleteDC(mem_dc)
-    win32gui.ReleaseDC(hwnd, src_dc)
-    return image
+    return CaptureUtil.get_session(hwnd).capture_image((left, top, right, bottom))
+
+
+def screenshot_to_ndarray(hwnd, left, top, right, bottom, copy=False):
+    """
+    截图转成numpy数组，不创建PIL对象，默认不复制
+    :param hwnd: 要截图的窗口句柄
+    :param left: 窗口中截图区域左上角x坐标
+    :param top: 窗口中截图区域左上角y坐标
+    :param right: 右下角x坐标
+    :param bottom: 右下角y坐标
+    :param copy: 是否复制，不复制时返回的数组在这个窗口下次截图时会被覆盖
+    :return: 形状为(高, 宽, 4)的uint8数组，BGRA顺序
+    """
+    return CaptureUtil.get_session(hwnd).capture_array((left, top, right, bottom), copy)
+
+
+@contextlib.contextmanager
+def screenshot_frame(hwnd, left, top, right, bottom):
+    """
+    截图并在with语句内使用，期间其他线程不能截同一个窗口，截图结果不会被覆盖
+    用法：with screenshot_frame(hwnd, 0, 0, 800, 600) as frame: ...
+    :param hwnd: 要截图的窗口句柄
+    :param left: 窗口中截图区域左上角x坐标
+    :param top: 窗口中截图区域左上角y坐标
+    :param right: 右下角x坐标
+    :param bottom: 右下角y坐标
+    :return: 形状为(高, 宽, 4)的uint8数组，BGRA顺序，只读
+    """
+    session = CaptureUtil.get_session(hwnd)
+    with session.lock:
+        yield session.capture_array((left, top, right, bottom))
 
 
 def screenshot_to_file(hwnd, left, top, right, bottom, path):
@@ -113,7 +107,7 @@ def get_color_rgb(color_str):
             result['DB'] = int(color_str[i_pos + 5:i_pos + 7], 16)
             return result
             # 字符串长度为6，则只解析RGB值
-    elif len(point[2]) == 6:
+    elif len(color_str) == 6:
         result['R'] = int(color_str[0:2], 16)
         result['G'] = int(color_str[2:4], 16)
         result['B'] = int(color_str[4:6], 16)
@@ -137,64 +131,275 @@ def rgb_compare(pixel_rgb, rgb_attribute) -> bool:
     return False
 
 
+def _to_bgr_array(image):
+    """
+    把图片统一转成numpy数组，通道顺序与OpenCV一致(BGR或BGRA)
+    :param image: PIL的image对象，或者numpy数组(BGR/BGRA，二维数组视为灰度图)
+    :return: 形状为(高, 宽, 通道数)的uint8数组
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return image
+    if image.mode == 'RGBA':
+        return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGBA2BGRA)
+    return cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+
+def get_pixel_rgb(image, x, y):
+    """
+    获取像素点颜色
+    :param image: PIL的image对象或者numpy数组(BGR/BGRA)
+    :param x: x坐标
+    :param y: y坐标
+    :return: (R, G, B)
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            value = int(image[y, x])
+            return value, value, value
+        b, g, r = image[y, x, :3]
+        return int(r), int(g), int(b)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image.getpixel((x, y))
+
+
+def compare_pixel(image, x, y, color_str) -> bool:
+    """
+    比较像素点颜色
+    :param image: PIL的image对象或者numpy数组(BGR/BGRA)
+    :param x: x坐标
+    :param y: y坐标
+    :param color_str: 颜色字符串 如：B9B9B9-101010
+    :return: 匹配返回true，反之返回false
+    """
+    return rgb_compare(get_pixel_rgb(image, x, y), get_color_rgb(color_str))
+
+
+def _color_bounds(rgb_attribute):
+    """
+    把颜色值和偏差值转成比较用的上下限
+    :param rgb_attribute: get_color_rgb的返回值
+    :return: (下限, 上限)，BGR顺序
+    """
+    color = np.array([rgb_attribute['B'], rgb_attribute['G'], rgb_attribute['R']], dtype=np.int16)
+    diff = np.array([rgb_attribute['DB'], rgb_attribute['DG'], rgb_attribute['DR']], dtype=np.int16)
+    lower = np.clip(color - diff, 0, 255).astype(np.uint8)
+    upper = np.clip(color + diff, 0, 255).astype(np.uint8)
+    return lower, upper
+
+
+# 多点字符串解析结果的缓存数量
+COLOR_PATTERN_CACHE_SIZE = 256
+
+
+class ColorPattern(object):
+    """
+    解析好的多点颜色，同一个多点字符串只解析一次
+    offsets: 其他点相对第一个点的偏移 [[x, y], ...]
+    rgb: 其他点的颜色值 [[R, G, B], ...]
+    tolerance: 其他点的偏差值 [[DR, DG, DB], ...]
+    lower/upper: 其他点颜色的上下限，BGR顺序，和numpy数组的通道顺序一致
+    bbox: 所有点(包括第一个点)的偏移范围 (min_x, min_y, max_x, max_y)
+    """
+
+    def __init__(self, single_color, multi_color):
+        self.source = (single_color, multi_color)
+        anchor = get_color_rgb(single_color)
+        if 'R' not in anchor:
+            raise ValueError('颜色字符串格式不对：%s' % single_color)
+        self.anchor_rgb = np.array([anchor['R'], anchor['G'], anchor['B']], dtype=np.uint8)
+        self.anchor_tolerance = np.array([anchor['DR'], anchor['DG'], anchor['DB']], dtype=np.uint8)
+        lower, upper = _color_bounds(anchor)
+        # 4通道图片的alpha通道不参与比较
+        self._anchor_bounds = {
+            3: (lower, upper),
+            4: (np.append(lower, np.uint8(0)), np.append(upper, np.uint8(255))),
+        }
+
+        points = []
+        for color in multi_color.split(','):
+            if not color:
+                continue
+            rgb_attribute = get_color_rgb(color)
+            if 'R' not in rgb_attribute:
+                raise ValueError('颜色字符串格式不对：%s' % color)
+            points.append(rgb_attribute)
+        self.offsets = np.array([[p['x'], p['y']] for p in points], dtype=np.intp).reshape(-1, 2)
+        self.rgb = np.array([[p['R'], p['G'], p['B']] for p in points], dtype=np.uint8).reshape(-1, 3)
+        self.tolerance = np.array([[p['DR'], p['DG'], p['DB']] for p in points], dtype=np.uint8).reshape(-1, 3)
+        bounds = [_color_bounds(p) for p in points]
+        self.lower = np.array([b[0] for b in bounds], dtype=np.uint8).reshape(-1, 3)
+        self.upper = np.array([b[1] for b in bounds], dtype=np.uint8).reshape(-1, 3)
+
+        xs = [0] + [p['x'] for p in points]
+        ys = [0] + [p['y'] for p in points]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+        # 缓存里的对象是共享的，不允许修改
+        for array in (self.anchor_rgb, self.anchor_tolerance, self.offsets, self.rgb, self.tolerance,
+                      self.lower, self.upper):
+            array.setflags(write=False)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __repr__(self):
+        return 'ColorPattern(%r)' % (list(self.source),)
+
+    @staticmethod
+    def compile(multi_point_color_str):
+        """
+        解析多点字符串，结果会被缓存，重复传入同样的字符串直接返回缓存
+        :param multi_point_color_str: 多点字符串，格式同multi_point_find_color，已经是ColorPattern时原样返回
+        :return: ColorPattern
+        """
+        if isinstance(multi_point_color_str, ColorPattern):
+            return multi_point_color_str
+        single_color, multi_color = multi_point_color_str
+        return _compile_color_pattern(single_color, multi_color)
+
+    def anchor_bounds(self, channels=3):
+        """
+        第一个点颜色的上下限
+        :param channels: 图片通道数 3或4
+        :return: (下限, 上限)，BGR顺序
+        """
+        return self._anchor_bounds[channels]
+
+    def max_mismatch(self, similarity):
+        """
+        相似度对应的最大不匹配数
+        :param similarity: 相似度
+        :return: 最大不匹配数
+        """
+        multi_num = len(self.offsets)
+        return multi_num - math.trunc(multi_num * similarity)
+
+    def scan_area(self, width, height):
+        """
+        第一个点可能落在的区域，落在这个区域外时其他点必然越界
+        :param width: 图片宽
+        :param height: 图片高
+        :return: (x0, y0, x1, y1)，区域为空时返回None
+        """
+        min_x, min_y, max_x, max_y = self.bbox
+        x0, y0, x1, y1 = -min_x, -min_y, width - max_x, height - max_y
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+
+
+@functools.lru_cache(maxsize=COLOR_PATTERN_CACHE_SIZE)
+def _compile_color_pattern(single_color, multi_color):
+    return ColorPattern(single_color, multi_color)
+
+
+def _multi_point_candidates(image, multi_point_color_str, similarity):
+    """
+    多点找色的所有匹配点
+    :param image: 要比对的图片，PIL的image对象或者numpy数组(BGR/BGRA)
+    :param multi_point_color_str: 多点字符串或ColorPattern
+    :param similarity: 相似度
+    :return: (xs, ys) 两个numpy数组，按先列后行的顺序排列
+    """
+    pattern = ColorPattern.compile(multi_point_color_str)
+    array = _to_bgr_array(image)
+    # 截图的宽高
+    height, width = array.shape[:2]
+    area = pattern.scan_area(width, height)
+    if area is None:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    x0, y0, x1, y1 = area
+    # 最大不匹配数
+    max_mismatch_num = pattern.max_mismatch(similarity)
+
+    # 第一个点颜色比较，得到候选点
+    mask = cv2.inRange(array, *pattern.anchor_bounds(array.shape[2]))[y0:y1, x0:x1]
+    # 转置后再取非零点，保证候选点按先列后行的顺序排列
+    xs, ys = np.nonzero(mask.T)
+    xs += x0
+    ys += y0
+    # 每个候选点的不匹配数
+    mismatch = np.zeros(len(xs), dtype=np.int32)
+
+    # 逐个比较其他多点，只保留不匹配数没超的候选点
+    for (dx, dy), lower, upper in zip(pattern.offsets, pattern.lower, pattern.upper):
+        if len(xs) == 0:
+            break
+        pixel = array[ys + dy, xs + dx, :3]
+        mismatch += ~np.all((pixel >= lower) & (pixel <= upper), axis=1)
+        keep = mismatch <= max_mismatch_num
+        xs, ys, mismatch = xs[keep], ys[keep], mismatch[keep]
+    return xs, ys
+
+
+@MetricsUtil.timed('multi_point_find_color', MetricsUtil.found_point)
 def multi_point_find_color(image, multi_point_color_str, similarity=1.0):
     """
     多点找色
-    :param image: 要比对的图片
+    :param image: 要比对的图片，PIL的image对象或者numpy数组(BGR/BGRA)
     :param multi_point_color_str: 多点字符串，字符串格式参考按键精灵，例如
     ['844B1B-101010','1|4|763C12-101010,-4|8|864D1C-101010,21|2|7F4417-101010,24|2|EDC060-101010,-2|-7|F1C968-101010,23|14|ECAD55-101010,1|4|763C12-101010']
+    也可以传入ColorPattern.compile的结果
     :param similarity: 相似度
     :return: 找到的坐标，没找到返回(-1，-1)，注：这边返回的是相对坐标值
     """
-    # 截图的宽高
-    width, height = image.size
-    # 第一个点颜色
-    single_color = multi_point_color_str[0]
-    # 多点颜色list
-    multi_color = multi_point_color_str[1]
-    color_list = multi_color.split(',')
-    # 多点数量
-    multi_num = len(color_list)
-    # 最大不匹配数
-    max_mismatch_num = multi_num - math.trunc(multi_num * similarity)
-    # 不匹配数
-    mismatch_num = 0
-
-    for x in range(width):
-        for y in range(height):
-            # 获取像素点颜色
-            pixel_rgb = image.getpixel((x, y))
-            # 第一个点颜色值
-            rgb_attribute = get_color_rgb(single_color)
-
-            # 颜色比较
-            if rgb_compare(pixel_rgb, rgb_attribute):
-                # 用来判断是否得到坐标点
-                flag = True
-                # 进入比较其他多点
-                for color in color_list:
-                    temp_rgb_attribute = get_color_rgb(color)
-                    # 点的坐标不能越界
-                    tx = x + temp_rgb_attribute['x']
-                    ty = y + temp_rgb_attribute['y']
-                    if tx >= width or ty >= height or tx < 0 or ty < 0:
-                        flag = False
-                        break
-
-                    temp_pixel_rgb = image.getpixel((tx, ty))
-
-                    if not rgb_compare(temp_pixel_rgb, temp_rgb_attribute):
-                        # 不匹配
-                        mismatch_num += 1
-
-                        if mismatch_num > max_mismatch_num:
-                            flag = False
-                            break
-
-                if flag:
-                    # 这边获取的是相对坐标
-                    return x, y
-    return -1, -1
+    xs, ys = _multi_point_candidates(image, multi_point_color_str, similarity)
+    if len(xs) == 0:
+        return -1, -1
+    # 这边获取的是相对坐标
+    return int(xs[0]), int(ys[0])
+
+
+@MetricsUtil.timed('multi_point_find_color_all', bool)
+def multi_point_find_color_all(image, multi_point_color_str, similarity=1.0, max_count=0, min_distance=0,
+                               direction='left_right', origin=(0, 0)):
+    """
+    多点找色，返回所有找到的坐标
+    :param image: 要比对的图片，PIL的image对象或者numpy数组(BGR/BGRA)
+    :param multi_point_color_str: 多点字符串，格式同multi_point_find_color，也可以传入ColorPattern.compile的结果
+    :param similarity: 相似度
+    :param max_count: 最多返回几个坐标，0表示不限制
+    :param min_distance: 坐标之间的最小距离，离已找到的坐标小于这个距离的点会被合并掉，0表示不合并
+    :param direction: 查找方向 left_right 从左到右(先列后行，和multi_point_find_color一致)
+    top_bottom 从上到下(先行后列) nearest 离origin由近到远
+    :param origin: direction为nearest时的参照点，相对坐标
+    :return: 坐标list [(x, y), ...]，没找到返回空list，注：这边返回的是相对坐标值
+    """
+    if direction not in ('left_right', 'top_bottom', 'nearest'):
+        raise ValueError('direction 取值 "left_right", "top_bottom", 或 "nearest", 现在值为：%s' % direction)
+
+    xs, ys = _multi_point_candidates(image, multi_point_color_str, similarity)
+    if direction == 'top_bottom':
+        order = np.lexsort((xs, ys))
+        xs, ys = xs[order], ys[order]
+    elif direction == 'nearest':
+        distance = (xs - origin[0]) ** 2 + (ys - origin[1]) ** 2
+        order = np.argsort(distance, kind='stable')
+        xs, ys = xs[order], ys[order]
+
+    if min_distance <= 0:
+        if max_count > 0:
+            xs, ys = xs[:max_count], ys[:max_count]
+        return [(int(x), int(y)) for x, y in zip(xs, ys)]
+
+    # 按顺序合并相邻的点，保留先找到的那个
+    result = []
+    found_xs = np.empty(len(xs), dtype=np.intp)
+    found_ys = np.empty(len(ys), dtype=np.intp)
+    min_distance_sq = min_distance * min_distance
+    for x, y in zip(xs, ys):
+        count = len(result)
+        if count and np.any((found_xs[:count] - x) ** 2 + (found_ys[:count] - y) ** 2 < min_distance_sq):
+            continue
+        found_xs[count] = x
+        found_ys[count] = y
+        result.append((int(x), int(y)))
+        if 0 < max_count <= len(result):
+            break
+    return result
 
 
 def screenshot_multi_point_find_color(hwnd, left, top, right, bottom, multi_point_color_str, similarity=1.0):
@@ -207,43 +412,171 @@ def screenshot_multi_point_find_color(hwnd, left, top, right, bottom, multi_poin
     :param bottom: 右下角y坐标
     :param multi_point_color_str: 多点字符串，格式参考按键精灵，例如
     ['844B1B-101010','1|4|763C12-101010,-4|8|864D1C-101010,21|2|7F4417-101010,24|2|EDC060-101010,-2|-7|F1C968-101010,23|14|ECAD55-101010,1|4|763C12-101010']
+    也可以传入ColorPattern.compile的结果
     :param similarity: 相似度
     :return: 找到的绝对坐标 找不到返回(-1,-1)
     """
-    image = screenshot_to_bitmap_array(hwnd, left, top, right, bottom)
-    x, y = multi_point_find_color(image, multi_point_color_str, similarity)
+    with screenshot_frame(hwnd, left, top, right, bottom) as frame:
+        x, y = multi_point_find_color(frame, multi_point_color_str, similarity)
     if x == -1 and y == -1:
         return x, y
     # 转成绝对路径
     return x + left, y + top
 
 
-def _kmp(needle, haystack):
+def screenshot_multi_point_find_color_all(hwnd, left, top, right, bottom, multi_point_color_str, similarity=1.0,
+                                          max_count=0, min_distance=0, direction='left_right', origin=None):
+    """
+    截图多点找色，返回所有找到的坐标
+    :param hwnd: 要截图的窗口句柄
+    :param left: 窗口中截图区域左上角x坐标
+    :param top: 窗口中截图区域左上角y坐标
+    :param right: 右下角x坐标
+    :param bottom: 右下角y坐标
+    :param multi_point_color_str: 多点字符串，格式同screenshot_multi_point_find_color
+    :param similarity: 相似度
+    :param max_count: 最多返回几个坐标，0表示不限制
+    :param min_distance: 坐标之间的最小距离，0表示不合并
+    :param direction: 查找方向 left_right top_bottom nearest
+    :param origin: direction为nearest时的参照点，绝对坐标，默认截图区域左上角
+    :return: 绝对坐标list [(x, y), ...]，没找到返回空list
+    """
+    if origin is None:
+        origin = (left, top)
+    with screenshot_frame(hwnd, left, top, right, bottom) as frame:
+        points = multi_point_find_color_all(frame, multi_point_color_str, similarity, max_count, min_distance,
+                                            direction, (origin[0] - left, origin[1] - top))
+    # 转成绝对坐标
+    return [(x + left, y + top) for x, y in points]
+
+
+def _pixel_in_range(pixel, lower, upper):
     """
-    Knuth-Morris-Pratt (KMP) 字符串搜索算法
-    :param needle: 要搜索的短字符串
-    :param haystack: 在其中搜索模式的长字符串
-    :return: needle在haystack中第一次出现的位置
+    判断取出的像素是否在上下限内，灰度图为一维数组，彩色图为(n, 3)数组
     """
-    shifts = [1] * (len(needle) + 1)
-    shift = 1
-    for pos in range(len(needle)):
-        while shift <= pos and needle[pos] != needle[pos - shift]:
-            shift += shifts[pos - shift]
-        shifts[pos + 1] = shift
+    ok = (pixel >= lower) & (pixel <= upper)
+    if ok.ndim == 2:
+        ok = ok.all(axis=1)
+    return ok
+
+
+# 找图时每个方向上的采样点数，允许不匹配像素时会按max_mismatch增加
+FIND_PICTURE_SAMPLES = 5
+# 允许不匹配像素时，采样点筛完还剩这么多候选位置就再用平方差筛一次
+FIND_PICTURE_SQDIFF_CANDIDATES = 256
+# 逐个比对候选位置时每批的个数
+FIND_PICTURE_VERIFY_BATCH = 64
 
-    start_pos = 0
-    match_len = 0
-    for c in haystack:
-        while match_len == len(needle) or match_len >= 0 and needle[match_len] != c:
-            start_pos += shifts[match_len]
-            match_len -= shifts[match_len]
-        match_len += 1
-        if match_len == len(needle):
-            yield start_pos
+
+def _sampled_candidates(src_image, dest_image, tolerance, max_mismatch=0):
+    """
+    按采样点筛选候选位置：目标图片上均匀取一些采样点，超出偏差的采样点不超过max_mismatch个的位置才是候选
+    采样点是目标图片像素的一部分，真正匹配的位置一定会留下；采样点筛不掉多少位置时提前返回，候选位置会比较多
+    :return: (ys, xs) 候选的左上角坐标，按先行后列的顺序排列
+    """
+    dest_height, dest_width = dest_image.shape[:2]
+    dest = dest_image.astype(np.int16)
+    lower = np.clip(dest - tolerance, 0, 255).astype(np.uint8)
+    upper = np.clip(dest + tolerance, 0, 255).astype(np.uint8)
+
+    # 允许max_mismatch个不匹配时，要多取max_mismatch个采样点才能保持同样的筛选效果
+    count = max(FIND_PICTURE_SAMPLES, math.ceil(math.sqrt(FIND_PICTURE_SAMPLES ** 2 + max_mismatch)))
+    points = [(int(sy), int(sx)) for sy in np.unique(np.linspace(0, dest_height - 1, count).astype(np.intp))
+              for sx in np.unique(np.linspace(0, dest_width - 1, count).astype(np.intp))]
+
+    # 左上角只需要在能放下整张目标图片的区域里找
+    area_height = src_image.shape[0] - dest_height + 1
+    area_width = src_image.shape[1] - dest_width + 1
+    if len(points) <= max_mismatch:
+        # 采样点全不匹配也在允许范围内，筛不掉任何位置
+        ys, xs = np.mgrid[:area_height, :area_width]
+        return ys.reshape(-1), xs.reshape(-1)
+
+    # 采样点先对整个区域逐点计数(计数超过max_mismatch后饱和也没关系)，
+    # 前max_mismatch+1个采样点之后才能排除位置，候选位置还多时继续整块计数，比逐个位置取像素快
+    misses = np.zeros((area_height, area_width), dtype=np.uint8 if max_mismatch < 255 else np.uint16)
+    dense = 0
+    sparse = False
+    # 允许不匹配像素时调用方还可以用平方差筛选，整块计数的次数有上限
+    dense_limit = min(len(points), max_mismatch + 1 + FIND_PICTURE_SAMPLES) if max_mismatch > 0 else len(points)
+    while dense < dense_limit:
+        sy, sx = points[dense]
+        shifted = src_image[sy:sy + area_height, sx:sx + area_width]
+        in_range = cv2.inRange(shifted, np.atleast_1d(lower[sy, sx]), np.atleast_1d(upper[sy, sx]))
+        cv2.add(misses, 1, dst=misses, mask=cv2.bitwise_not(in_range))
+        dense += 1
+        if dense > max_mismatch and cv2.countNonZero(cv2.inRange(misses, 0, max_mismatch)) * 16 <= misses.size:
+            sparse = True
+            break
+    ys, xs = np.nonzero(misses <= max_mismatch)
+    if not sparse and dense < len(points):
+        # 采样点筛不掉多少位置(目标图片大片颜色和背景接近)，逐个位置取像素更慢，交给调用方用别的方法筛
+        return ys, xs
+    misses = misses[ys, xs]
+
+    # 剩下的采样点只检查候选位置，逐个缩小候选范围
+    for sy, sx in points[dense:]:
+        if len(ys) == 0:
+            break
+        misses += ~_pixel_in_range(src_image[ys + sy, xs + sx], lower[sy, sx], upper[sy, sx])
+        keep = misses <= max_mismatch
+        ys, xs, misses = ys[keep], xs[keep], misses[keep]
+    return ys, xs
+
+
+@MetricsUtil.timed('find_picture', MetricsUtil.found_point)
+def find_picture(image, dest_image_url, grayscale=True, tolerance=0, max_mismatch=0):
+    """
+    找图(全匹配)
+    先筛出候选位置，再逐个按像素精确比对
+    :param image: 要比对的图片，PIL的image对象或者numpy数组(BGR/BGRA)
+    :param dest_image_url: 目标图片url，读取过的图片会缓存，见TemplateUtil
+    :param grayscale: 是否转成灰度图片进行比较 默认True
+    :param tolerance: 每个通道允许的颜色偏差，0表示必须完全一样
+    :param max_mismatch: 允许超出偏差的像素个数，0表示一个都不允许
+    :return: 坐标(相对坐标)，没找到返回(-1,-1)
+    """
+    dest_image = _template_array(dest_image_url, grayscale)
+    src_image = _match_array(image, grayscale)
+    dest_height, dest_width = dest_image.shape[:2]
+    if dest_height > src_image.shape[0] or dest_width > src_image.shape[1]:
+        # 要找的图片比源图大
+        return -1, -1
+
+    max_mismatch = max(max_mismatch, 0)
+    ys, xs = _sampled_candidates(src_image, dest_image, tolerance, max_mismatch)
+    if max_mismatch > 0 and len(ys) > FIND_PICTURE_SQDIFF_CANDIDATES:
+        # 目标图片大片颜色和背景接近时采样点筛不掉多少位置，再用平方差的上限筛一次
+        channels = 1 if dest_image.ndim == 2 else dest_image.shape[2]
+        limit = (dest_height * dest_width * tolerance * tolerance + max_mismatch * 255 * 255) * channels
+        # matchTemplate用float32计算，留一点误差余量
+        limit += dest_height * dest_width * channels * 255 * 255 * 1e-5 + 1
+        with MetricsUtil.timer('matchTemplate'):
+            result = cv2.matchTemplate(src_image, dest_image, cv2.TM_SQDIFF)
+        keep = result[ys, xs] <= limit
+        ys, xs = ys[keep], xs[keep]
+
+    # 候选位置按先行后列的顺序排列，和原来逐行查找的顺序一致
+    MetricsUtil.count('find_picture_candidates', len(xs))
+    dest = dest_image.astype(np.int16)
+    windows = np.lib.stride_tricks.sliding_window_view(src_image, dest_image.shape)
+    with MetricsUtil.timer('find_picture.verify'):
+        # 一次比对一批候选位置
+        for start in range(0, len(ys), FIND_PICTURE_VERIFY_BATCH):
+            batch_ys = ys[start:start + FIND_PICTURE_VERIFY_BATCH]
+            batch_xs = xs[start:start + FIND_PICTURE_VERIFY_BATCH]
+            batch = windows[batch_ys, batch_xs].reshape((len(batch_ys),) + dest_image.shape)
+            diff = np.abs(batch.astype(np.int16) - dest) > tolerance
+            if diff.ndim == 4:
+                diff = diff.any(axis=3)
+            matched = np.flatnonzero(np.count_nonzero(diff.reshape(len(batch_ys), -1), axis=1) <= max_mismatch)
+            if len(matched):
+                return int(batch_xs[matched[0]]), int(batch_ys[matched[0]])
+    return -1, -1
 
 
-def screenshot_find_picture(hwnd, left, top, right, bottom, dest_image_url, grayscale=True):
+def screenshot_find_picture(hwnd, left, top, right, bottom, dest_image_url, grayscale=True, tolerance=0,
+                            max_mismatch=0):
     """
     截图找图(全匹配)
     :param hwnd: 要截图的窗口句柄
@@ -252,111 +585,337 @@ def screenshot_find_picture(hwnd, left, top, right, bottom, dest_image_url, gray
     :param right: 右下角x坐标
     :param bottom: 右下角y坐标
     :param dest_image_url: 目标图片url
-    :param grayscale: 是否转成灰度图片进行比较 这大概提升30%的效率 默认True
+    :param grayscale: 是否转成灰度图片进行比较 默认True
+    :param tolerance: 每个通道允许的颜色偏差，0表示必须完全一样
+    :param max_mismatch: 允许超出偏差的像素个数，0表示一个都不允许
     :return: 坐标
     """
-    src_image = screenshot_to_bitmap_array(hwnd, left, top, right, bottom)
-    dest_image = Image.open(dest_image_url)
+    with screenshot_frame(hwnd, left, top, right, bottom) as frame:
+        x, y = find_picture(frame, dest_image_url, grayscale, tolerance, max_mismatch)
+    if x == -1 and y == -1:
+        return x, y
+    # 返回找到的坐标，转成绝对坐标
+    return x + left, y + top
+
+
+def _template_array(dest_image, grayscale, step=1, level=0):
+    """
+    获取预处理好的目标图片
+    :param dest_image: 目标图片url，或者已经处理好的numpy数组(BGR/BGRA/灰度)
+    :param grayscale: 是否转成灰度
+    :param step: 缩小的步长
+    :param level: 金字塔层数
+    :return: numpy数组
+    """
+    if isinstance(dest_image, np.ndarray):
+        array = _match_array(dest_image, grayscale)[::step, ::step]
+        for _ in range(level):
+            array = cv2.pyrDown(array)
+        return array
+    return TemplateUtil.get_template(dest_image, grayscale, step, level)
+
+
+def _match_array(image, grayscale):
+    """
+    把图片转成matchTemplate用的数组
+    :param image: PIL的image对象或者numpy数组(BGR/BGRA/灰度)
+    :param grayscale: 是否转成灰度
+    :return: 灰度时为二维数组，否则为BGR三通道数组
+    """
+    if isinstance(image, np.ndarray) and image.ndim == 2:
+        return image
+    array = _to_bgr_array(image)
     if grayscale:
-        # 图片转灰度图片
-        src_image = ImageOps.grayscale(src_image)
-        dest_image = ImageOps.grayscale(dest_image)
-    else:
-        # 如果不使用灰度，请确保我们比较的是RGB图像，而不是RGBA图像。
-        if src_image.mode == 'RGBA':
-            src_image = src_image.convert('RGB')
-        if dest_image.mode == 'RGBA':
-            dest_image = dest_image.convert('RGB')
-
-    dest_width, dest_height = dest_image.size
-    src_width, src_height = src_image.size
-
-    dest_image_data = tuple(dest_image.getdata())
-    src_image_data = tuple(src_image.getdata())
-
-    dest_image_rows = [
-        dest_image_data[y * dest_width: (y + 1) * dest_width] for y in range(dest_height)
-    ]  # LEFT OFF - check this
-    dest_image_first_row = dest_image_rows[0]
-
-    assert (
-            len(dest_image_first_row) == dest_width
-    ), 'The calculated width of first row of the needle image is not the same as the width of the image.'
-    assert [len(row) for row in dest_image_rows] == [
-        dest_width
-    ] * dest_height, 'The dest_image_rows aren\'t the same size as the original image.'
-
-    # 从最左边的一列开始
-    for y in range(src_height):
-        # 拿出目标图片的第一行 在 源图片中一行一行对比 使用kmp算法
-        for matchx in _kmp(dest_image_first_row, src_image_data[y * src_width: (y + 1) * src_width]):
-            found_match = True
-            # 在源图片中找到了目标图片的第一行，对比剩下的
-            for searchy in range(1, dest_height):
-                dest_start = (searchy + y) * src_width + matchx
-                if (
-                        dest_image_data[searchy * dest_width: (searchy + 1) * dest_width]
-                        != src_image_data[dest_start: dest_start + dest_width]
-                ):
-                    found_match = False
-                    break
-            if found_match:
-                # 返回找到的坐标，转成绝对坐标
-                return matchx + left, y + top
-    # 没找到
-    return -1, -1
+        return cv2.cvtColor(array, cv2.COLOR_BGRA2GRAY if array.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    if array.shape[2] == 4:
+        return cv2.cvtColor(array, cv2.COLOR_BGRA2BGR)
+    return array
+
+
+# 金字塔找图自动选层数时，最顶层目标图片的最短边不小于这个值
+PYRAMID_MIN_SIZE = 12
+# 金字塔最多几层
+PYRAMID_MAX_LEVEL = 4
+# 金字塔最顶层最多保留几个候选位置
+PYRAMID_MAX_CANDIDATES = 16
+
+
+def _pyramid_level(dest_height, dest_width):
+    """
+    根据目标图片大小自动选择金字塔层数
+    :return: 层数，0表示不适合用金字塔
+    """
+    level = 0
+    size = min(dest_height, dest_width)
+    while level < PYRAMID_MAX_LEVEL and size // 2 >= PYRAMID_MIN_SIZE:
+        size //= 2
+        level += 1
+    return level
 
 
-def screenshot_find_picture2(hwnd, left, top, right, bottom, dest_image_url, confidence=0.9, grayscale=True, step=1):
+def _pyramid_match(src_image, dest_image_url, grayscale, confidence, level):
+    """
+    金字塔找图，先在缩小的图上找候选位置，再回到原图只比对候选位置附近的小块区域
+    :param src_image: matchTemplate用的源图数组
+    :param dest_image_url: 目标图片url或数组
+    :param grayscale: 是否灰度
+    :param confidence: 相似度
+    :param level: 金字塔层数
+    :return: 坐标(相对坐标)，没找到返回(-1,-1)
+    """
+    dest_image = _template_array(dest_image_url, grayscale)
+    dest_height, dest_width = dest_image.shape[:2]
+    src_height, src_width = src_image.shape[:2]
+
+    small_src = src_image
+    for _ in range(level):
+        small_src = cv2.pyrDown(small_src)
+    small_dest = _template_array(dest_image_url, grayscale, 1, level)
+    if small_dest.shape[0] > small_src.shape[0] or small_dest.shape[1] > small_src.shape[1]:
+        return -1, -1
+
+    # 缩小后细节丢失，相似度会偏低，候选位置的阈值放宽一些
+    with MetricsUtil.timer('matchTemplate'):
+        result = cv2.matchTemplate(small_src, small_dest, cv2.TM_CCOEFF_NORMED)
+    coarse_confidence = confidence - 0.1 * level
+    scale = 1 << level
+    # 候选位置附近的搜索范围，覆盖缩小带来的坐标误差
+    margin = scale + 1
+    # 取出分数最高的几个候选位置，每取一个就把它附近的分数抹掉
+    suppress_h = max(small_dest.shape[0] // 2, 1)
+    suppress_w = max(small_dest.shape[1] // 2, 1)
+    best = None
+    for _ in range(PYRAMID_MAX_CANDIDATES):
+        _, max_val, _, (cx, cy) = cv2.minMaxLoc(result)
+        if max_val < coarse_confidence:
+            break
+        result[max(cy - suppress_h, 0):cy + suppress_h + 1, max(cx - suppress_w, 0):cx + suppress_w + 1] = -1
+
+        # 回到原图比对
+        x0 = max(cx * scale - margin, 0)
+        y0 = max(cy * scale - margin, 0)
+        x1 = min(cx * scale + margin + dest_width, src_width)
+        y1 = min(cy * scale + margin + dest_height, src_height)
+        if x1 - x0 < dest_width or y1 - y0 < dest_height:
+            continue
+        window = cv2.matchTemplate(src_image[y0:y1, x0:x1], dest_image, cv2.TM_CCOEFF_NORMED)
+        match_indices = np.flatnonzero(window > confidence)
+        if len(match_indices) == 0:
+            continue
+        my, mx = np.unravel_index(match_indices[0], window.shape)
+        point = (int(my) + y0, int(mx) + x0)
+        # 和普通找图一样，返回最上面(同一行最左边)的那个
+        if best is None or point < best:
+            best = point
+
+    if best is None:
+        return -1, -1
+    return best[1], best[0]
+
+
+@MetricsUtil.timed('find_picture2', MetricsUtil.found_point)
+def find_picture2(image, dest_image_url, confidence=0.9, grayscale=True, step=1, pyramid=0):
+    """
+    找图(模糊匹配)
+    :param image: 要比对的图片，PIL的image对象或者numpy数组(BGR/BGRA)
+    :param dest_image_url: 目标图片url，读取过的图片会缓存，见TemplateUtil
+    :param confidence: 相似度
+    :param grayscale: 是否转成灰度图片进行比较 这大概提升30%的效率 默认True
+    :param step: 取值1或者2，为2时confidence默认0.95
+    :param pyramid: 金字塔找图的层数，0不使用，-1根据目标图片大小自动选择，使用金字塔时忽略step
+    区域越大提速越明显；缩小的图上没找到时回到原图完整找一遍，不会漏掉step=1能找到的图，但没找到时比不用金字塔慢
+    :return: 坐标(相对坐标)，没找到返回(-1,-1)
+    """
+    src_image = _match_array(image, grayscale)
+
+    if pyramid:
+        if pyramid < 0:
+            dest_image = _template_array(dest_image_url, grayscale)
+            pyramid = _pyramid_level(*dest_image.shape[:2])
+        if pyramid > 0:
+            point = _pyramid_match(src_image, dest_image_url, grayscale, confidence, pyramid)
+            if point != (-1, -1):
+                return point
+            # 缩小后的分数可能低于放宽的阈值，候选位置里没有时按step=1完整找一遍
+            step = 1
+
+    if step != 2:
+        step = 1
+    dest_image = _template_array(dest_image_url, grayscale, step)
+
+    if step == 2:
+        # 等于2的时候 速度可以提升3倍 相似度默认0.95
+        confidence *= 0.95
+        src_image = src_image[::step, ::step]
+
+    if dest_image.shape[0] > src_image.shape[0] or dest_image.shape[1] > src_image.shape[1]:
+        # 要找的图片比源图大
+        return -1, -1
+
+    with MetricsUtil.timer('matchTemplate'):
+        result = cv2.matchTemplate(src_image, dest_image, cv2.TM_CCOEFF_NORMED)
+    match_indices = np.flatnonzero(result > confidence)
+    if len(match_indices) == 0:
+        return -1, -1
+
+    matchy, matchx = np.unravel_index(match_indices[0], result.shape)
+    return int(matchx) * step, int(matchy) * step
+
+
+def screenshot_find_picture2(hwnd, left, top, right, bottom, dest_image_url, confidence=0.9, grayscale=True, step=1,
+                             pyramid=0):
     """
     截图找图(模糊匹配)
-    :param hwnd: 句柄
     :param hwnd: 要截图的窗口句柄
     :param left: 窗口中截图区域左上角x坐标
     :param top: 窗口中截图区域左上角y坐标
     :param right: 右下角x坐标
     :param bottom: 右下角y坐标
-    :param dest_image_url: 目标图片url
+    :param dest_image_url: 目标图片url，读取过的图片会缓存，见TemplateUtil
     :param grayscale: 是否转成灰度图片进行比较 这大概提升30%的效率 默认True
     :param step: 取值1或者2，为2时confidence默认0.95
     :param confidence: 相似度
+    :param pyramid: 金字塔找图的层数，0不使用，-1自动选择，见find_picture2
     :return: 坐标
     """
-    src_image = screenshot_to_bitmap_array(hwnd, left, top, right, bottom)
-    dest_image = Image.open(dest_image_url)
+    with screenshot_frame(hwnd, left, top, right, bottom) as frame:
+        return find_picture2(frame, dest_image_url, confidence, grayscale, step, pyramid)
 
-    if dest_image.size[0] > src_image.size[0] or dest_image.size[1] > src_image.size[1]:
-        # 要找的图片比源图大
-        return -1, -1
 
-    # 加载图片并转灰度图片
-    dest_array = np.array(dest_image.convert('RGB'))
-    dest_image = dest_array[:, :, ::-1].copy()
-    if grayscale:
-        dest_image = cv2.cvtColor(dest_image, cv2.COLOR_BGR2GRAY)
+# 批量查找用的线程数，OpenCV计算时会释放GIL
+BATCH_WORKERS = min(os.cpu_count() or 1, 8)
+_batch_executor = None
 
-    src_array = np.array(src_image.convert('RGB'))
-    src_image = src_array[:, :, ::-1].copy()
-    if grayscale:
-        src_image = cv2.cvtColor(src_image, cv2.COLOR_BGR2GRAY)
 
-    if step == 2:
-        # 等于2的时候 速度可以提升3倍 相似度默认0.95
-        confidence *= 0.95
-        dest_image = dest_image[::step, ::step]
-        src_image = src_image[::step, ::step]
-    else:
-        step = 1
+def _get_batch_executor():
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch_find')
+    return _batch_executor
 
-    result = cv2.matchTemplate(src_image, dest_image, cv2.TM_CCOEFF_NORMED)
-    match_indices = np.arange(result.size)[(result > confidence).flatten()]
-    matches = np.unravel_index(match_indices[:10000], result.shape)
 
-    if len(matches[0]) == 0:
-        return -1, -1
+def _clip_rect(rect, origin, width, height):
+    """
+    把查询区域裁到截图范围内
+    :param rect: 查询区域(left, top, right, bottom)，窗口坐标
+    :param origin: 截图左上角在窗口中的坐标
+    :param width: 截图宽
+    :param height: 截图高
+    :return: 裁剪后的区域，窗口坐标，和截图没有重叠时返回None
+    """
+    left = max(rect[0], origin[0])
+    top = max(rect[1], origin[1])
+    right = min(rect[2], origin[0] + width)
+    bottom = min(rect[3], origin[1] + height)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
 
-    matchx = matches[1] * step
-    matchy = matches[0] * step
 
-    for x, y in zip(matchx, matchy):
+def _run_query(image, origin, query):
+    """
+    执行单个查询
+    :param image: 整张截图
+    :param origin: 截图左上角在窗口中的坐标
+    :param query: 查询dict，见batch_find
+    :return: 查询结果，坐标为窗口坐标
+    """
+    kwargs = {k: v for k, v in query.items() if k not in ('name', 'type', 'rect')}
+    query_type = query['type']
+    height, width = image.shape[:2]
+    if query_type == 'pixel':
+        x = kwargs['x'] - origin[0]
+        y = kwargs['y'] - origin[1]
+        if not (0 <= x < width and 0 <= y < height):
+            # 像素不在截图里
+            return None if kwargs.get('color_str') is None else False
+        if kwargs.get('color_str') is None:
+            return get_pixel_rgb(image, x, y)
+        return compare_pixel(image, x, y, kwargs['color_str'])
+
+    # 只在查询区域内查找，查询区域先裁到截图范围内，坐标按裁剪后的左上角换算
+    left, top = origin
+    rect = query.get('rect')
+    if rect is not None:
+        rect = _clip_rect(rect, origin, width, height)
+        if rect is None:
+            # 查询区域和截图没有重叠
+            return [] if query_type == 'color_all' else (-1, -1)
+        left, top, right, bottom = rect
+        image = image[top - origin[1]:bottom - origin[1], left - origin[0]:right - origin[0]]
+
+    if query_type == 'color':
+        x, y = multi_point_find_color(image, **kwargs)
+    elif query_type == 'color_all':
+        return [(x + left, y + top) for x, y in multi_point_find_color_all(image, **kwargs)]
+    elif query_type == 'picture':
+        x, y = find_picture(image, **kwargs)
+    elif query_type == 'picture2':
+        x, y = find_picture2(image, **kwargs)
+    else:
+        raise ValueError('type 取值 "color", "color_all", "picture", "picture2", 或 "pixel", 现在值为：%s' % query_type)
+    if x == -1 and y == -1:
         return x, y
+    return x + left, y + top
+
+
+@MetricsUtil.timed('batch_find')
+def batch_find(image, queries, origin=(0, 0), parallel=True):
+    """
+    在同一张截图上批量查找
+    :param image: 截图，PIL的image对象或者numpy数组(BGR/BGRA)
+    :param queries: 查询dict的list，每个查询的格式：
+    {'name': 结果的key, 'type': 查询类型, 'rect': (left, top, right, bottom) 查询区域(窗口坐标，可省略), 其他参数}
+    type为color/color_all/picture/picture2时，其他参数和multi_point_find_color/multi_point_find_color_all/
+    find_picture/find_picture2的参数同名，例如
+    {'name': 'boss', 'type': 'picture2', 'rect': (0, 0, 400, 300), 'dest_image_url': 'boss.png', 'confidence': 0.9}
+    type为pixel时参数为x、y(窗口坐标)和color_str，有color_str时返回是否匹配，否则返回(R, G, B)，像素不在截图里时返回False或None
+    :param origin: 截图左上角在窗口中的坐标
+    :param parallel: 是否用线程池并行查找
+    :return: {name: 结果}，坐标都是窗口坐标，没找到为(-1,-1)
+    """
+    if not isinstance(image, np.ndarray):
+        image = _to_bgr_array(image)
+    if not parallel or len(queries) <= 1:
+        return {query['name']: _run_query(image, origin, query) for query in queries}
+    executor = _get_batch_executor()
+    futures = [(query['name'], executor.submit(_run_query, image, origin, query)) for query in queries]
+    return {name: future.result() for name, future in futures}
+
+
+def screenshot_batch_find(hwnd, queries, rect=None, parallel=True):
+    """
+    截一次图，批量查找
+    :param hwnd: 要截图的窗口句柄
+    :param queries: 查询dict的list，格式见batch_find
+    :param rect: 截图区域(left, top, right, bottom)，None时取所有查询区域的外接矩形，有查询没指定区域时截整个客户区
+    :param parallel: 是否用线程池并行查找
+    :return: {name: 结果}，坐标都是窗口坐标
+    """
+    if rect is None:
+        rect = _queries_rect(queries)
+    if rect is None:
+        session = CaptureUtil.get_session(hwnd)
+        with session.lock:
+            frame = session.capture_array()
+            return batch_find(frame, queries, (0, 0), parallel)
+    with screenshot_frame(hwnd, *rect) as frame:
+        return batch_find(frame, queries, rect[:2], parallel)
+
+
+def _queries_rect(queries):
+    """
+    所有查询区域的外接矩形，有查询没指定区域时返回None
+    """
+    rects = []
+    for query in queries:
+        if query['type'] == 'pixel':
+            rects.append((query['x'], query['y'], query['x'] + 1, query['y'] + 1))
+        elif query.get('rect') is None:
+            return None
+        else:
+            rects.append(query['rect'])
+    if not rects:
+        return None
+    return (min(r[0] for r in rects), min(r[1] for r in rects),
+            max(r[2] for r in rects), max(r[3] for r in rects))
@@ -1,10 +1,10 @@
 import ctypes
+import heapq
+import threading
+import time
+from collections import deque
 
-import win32api
-import win32con
-import win32gui
-
-from utils import TimeUtil
+from utils import MetricsUtil, TimeUtil
 
 """
     0-15位：指定当前消息的重复次数。其值就是用户按下该键后自动重复的次数，但是重复次数不累积
@@ -16,6 +16,97 @@ from utils import TimeUtil
     31位：指定其转换状态，对WM_SYSKEYDOWN消息而言，其值总为0
 """
 
+# pywin32在用到时才导入，没有Windows的环境下也能导入这个模块，用set_text_target等替换发送消息的部分测试
+WM_NULL = 0x0000
+WM_KEYDOWN = 0x0100
+WM_KEYUP = 0x0101
+WM_CHAR = 0x0102
+WM_SYSKEYDOWN = 0x0104
+WM_SYSKEYUP = 0x0105
+WM_IME_CHAR = 0x0286
+WM_MOUSEMOVE = 0x0200
+WM_LBUTTONDOWN = 0x0201
+WM_LBUTTONUP = 0x0202
+WM_RBUTTONDOWN = 0x0204
+WM_RBUTTONUP = 0x0205
+WM_PASTE = 0x0302
+MK_LBUTTON = 0x0001
+MK_RBUTTON = 0x0002
+SMTO_ABORTIFHUNG = 0x0002
+CF_UNICODETEXT = 13
+# 多个脚本进程共用系统剪贴板，paste模式用这个命名互斥量排队
+CLIPBOARD_MUTEX_NAME = 'Local\\game_scripts_tools.clipboard'
+
+
+def make_long(x, y) -> int:
+    """
+    同win32api.MAKELONG
+    """
+    return ((y & 0xFFFF) << 16) | (x & 0xFFFF)
+
+
+def post_message(hwnd, msg, wparam, lparam):
+    """
+    同win32gui.PostMessage
+    """
+    import win32gui
+    win32gui.PostMessage(hwnd, msg, wparam, lparam)
+
+
+class LparamTable(object):
+    """
+    一个键盘布局下所有256个虚拟键码的lparam，按键时直接查表
+    down/up/alt_down/alt_up: 下标为虚拟键码的list
+    """
+
+    def __init__(self, layout, scancode=None):
+        """
+        :param layout: 键盘布局句柄(HKL)
+        :param scancode: 虚拟键码转扫描码的函数，None时用这个布局的MapVirtualKeyEx，测试时可以传入查dict的函数
+        """
+        self.layout = layout
+        if scancode is None:
+            map_virtual_key = ctypes.windll.user32.MapVirtualKeyExW
+
+            def scancode(virtual_key):
+                return map_virtual_key(virtual_key, 0, layout)
+        scancodes = [scancode(virtual_key) & 0xFF for virtual_key in range(256)]
+        # 最高字节见最上面的说明：按下0x00 放开0xC0 ALT按下0x20 ALT放开0xE0
+        self.down = [(scancode << 16) | 0x0001 for scancode in scancodes]
+        self.up = [(0xC0 << 24) | lparam for lparam in self.down]
+        self.alt_down = [(0x20 << 24) | lparam for lparam in self.down]
+        self.alt_up = [(0xE0 << 24) | lparam for lparam in self.down]
+
+
+# 键盘布局句柄 -> LparamTable
+_lparam_tables = {}
+_lparam_table = None
+
+
+def set_keyboard_layout(layout=None) -> LparamTable:
+    """
+    切换按键消息使用的键盘布局，切换过的布局会缓存
+    :param layout: 键盘布局句柄(HKL)，None时取当前线程的布局，系统切换了输入法后可以再调用一次
+    :return: LparamTable
+    """
+    global _lparam_table
+    if layout is None:
+        layout = ctypes.windll.user32.GetKeyboardLayout(0)
+    table = _lparam_tables.get(layout)
+    if table is None:
+        table = _lparam_tables[layout] = LparamTable(layout)
+    _lparam_table = table
+    return table
+
+
+def get_lparam_table() -> LparamTable:
+    """
+    当前键盘布局的lparam表，第一次调用时创建
+    """
+    if _lparam_table is None:
+        return set_keyboard_layout()
+    return _lparam_table
+
 
 def get_down_lparam(virtual_key) -> int:
     """
@@ -23,11 +114,7 @@ def get_down_lparam(virtual_key) -> int:
     :param virtual_key: 按键的ASCII码
     :return:
     """
-    scancode = win32api.MapVirtualKey(virtual_key, 0)
-    secondbyte = ('00' + hex(scancode)[2:].zfill(2))[-2:]
-    # 见最上面的说明
-    s = '00' + secondbyte + '0001'
-    return int(s, 16)
+    return get_lparam_table().down[virtual_key]
 
 
 def get_alt_down_lparam(virtual_key) -> int:
@@ -36,11 +123,7 @@ def get_alt_down_lparam(virtual_key) -> int:
     :param virtual_key: 按键的ASCII码
     :return:
     """
-    scancode = win32api.MapVirtualKey(virtual_key, 0)
-    secondbyte = ('00' + hex(scancode)[2:].zfill(2))[-2:]
-    # 见最上面的说明
-    s = '20' + secondbyte + '0001'
-    return int(s, 16)
+    return get_lparam_table().alt_down[virtual_key]
 
 
 def get_alt_up_lparam(virtual_key) -> int:
@@ -49,11 +132,7 @@ def get_alt_up_lparam(virtual_key) -> int:
     :param virtual_key: 按键的ASCII码
     :return:
     """
-    scancode = win32api.MapVirtualKey(virtual_key, 0)
-    secondbyte = ('00' + hex(scancode)[2:].zfill(2))[-2:]
-    # 见最上面的说明
-    s = 'E0' + secondbyte + '0001'
-    return int(s, 16)
+    return get_lparam_table().alt_up[virtual_key]
 
 
 def get_up_lparam(virtual_key) -> int:
@@ -62,13 +141,10 @@ def get_up_lparam(virtual_key) -> int:
     :param virtual_key: 按键的ASCII码
     :return:
     """
-    scancode = win32api.MapVirtualKey(virtual_key, 0)
-    secondbyte = ('00' + hex(scancode)[2:].zfill(2))[-2:]
-    # 见最上面的说明
-    s = 'C0' + secondbyte + '0001'
-    return int(s, 16)
+    return get_lparam_table().up[virtual_key]
 
 
+@MetricsUtil.timed('input.key_press')
 def key_press(hwnd, virtual_key):
     key_down(hwnd, virtual_key)
     TimeUtil.delay(50)
@@ -76,32 +152,33 @@ def key_press(hwnd, virtual_key):
 
 
 def key_down(hwnd, virtual_key):
-    win32gui.PostMessage(hwnd, win32con.WM_KEYDOWN, virtual_key, get_down_lparam(virtual_key))
+    post_message(hwnd, WM_KEYDOWN, virtual_key, get_down_lparam(virtual_key))
 
 
 def key_up(hwnd, virtual_key):
-    win32gui.PostMessage(hwnd, win32con.WM_KEYUP, virtual_key, get_up_lparam(virtual_key))
+    post_message(hwnd, WM_KEYUP, virtual_key, get_up_lparam(virtual_key))
 
 
 def move_to(hwnd, x, y):
-    point = win32api.MAKELONG(x, y)
-    win32gui.PostMessage(hwnd, win32con.WM_MOUSEMOVE, None, point)
+    point = make_long(x, y)
+    post_message(hwnd, WM_MOUSEMOVE, None, point)
 
 
 def left_down(hwnd, x, y, delay=50):
     move_to(hwnd, x, y)
     TimeUtil.delay(delay)
-    point = win32api.MAKELONG(x, y)
-    win32gui.PostMessage(hwnd, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, point)
+    point = make_long(x, y)
+    post_message(hwnd, WM_LBUTTONDOWN, MK_LBUTTON, point)
 
 
 def left_up(hwnd, x, y, delay=50):
     move_to(hwnd, x, y)
     TimeUtil.delay(delay)
-    point = win32api.MAKELONG(x, y)
-    win32gui.PostMessage(hwnd, win32con.WM_LBUTTONUP, win32con.MK_LBUTTON, point)
+    point = make_long(x, y)
+    post_message(hwnd, WM_LBUTTONUP, MK_LBUTTON, point)
 
 
+@MetricsUtil.timed('input.left_click')
 def left_click(hwnd, x, y, delay=50):
     left_down(hwnd, x, y, delay)
     TimeUtil.delay(delay)
@@ -112,23 +189,25 @@ def left_click(hwnd, x, y, delay=50):
 def right_down(hwnd, x, y, delay=50):
     move_to(hwnd, x, y)
     TimeUtil.delay(delay)
-    point = win32api.MAKELONG(x, y)
-    win32gui.PostMessage(hwnd, win32con.WM_RBUTTONDOWN, win32con.MK_RBUTTON, point)
+    point = make_long(x, y)
+    post_message(hwnd, WM_RBUTTONDOWN, MK_RBUTTON, point)
 
 
 def right_up(hwnd, x, y, delay=50):
     move_to(hwnd, x, y)
     TimeUtil.delay(delay)
-    point = win32api.MAKELONG(x, y)
-    win32gui.PostMessage(hwnd, win32con.WM_RBUTTONUP, win32con.MK_RBUTTON, point)
+    point = make_long(x, y)
+    post_message(hwnd, WM_RBUTTONUP, MK_RBUTTON, point)
 
 
+@MetricsUtil.timed('input.right_click')
 def right_click(hwnd, x, y, delay=50):
     right_down(hwnd, x, y, delay)
     TimeUtil.delay(delay)
     right_up(hwnd, x, y, delay)
 
 
+@MetricsUtil.timed('input.alt_combo_key')
 def alt_combo_key(hwnd, virtual_key):
     """
     alt的组合键
@@ -136,21 +215,366 @@ def alt_combo_key(hwnd, virtual_key):
     :param virtual_key:
     :return:
     """
-    win32gui.PostMessage(hwnd, win32con.WM_SYSKEYDOWN, virtual_key, get_alt_down_lparam(virtual_key))
+    post_message(hwnd, WM_SYSKEYDOWN, virtual_key, get_alt_down_lparam(virtual_key))
     TimeUtil.delay(50)
-    win32gui.PostMessage(hwnd, win32con.WM_SYSKEYUP, virtual_key, get_alt_up_lparam(virtual_key))
+    post_message(hwnd, WM_SYSKEYUP, virtual_key, get_alt_up_lparam(virtual_key))
+
+
+class TextTarget(object):
+    """
+    send_text发送消息的接口，benchmarks里用本地的模拟窗口代替，测试不需要Windows
+    """
+
+    def post(self, hwnd, msg, wparam, lparam):
+        raise NotImplementedError
+
+    def send(self, hwnd, msg, wparam, lparam):
+        raise NotImplementedError
+
+    def ping(self, hwnd, timeout) -> bool:
+        """
+        检查窗口线程是否还在响应
+        发送的消息比投递(post)的消息先处理，返回True不代表之前投递的消息已经处理完，只能用来控制节奏和发现窗口卡死
+        :param timeout: 毫秒
+        :return: 超时、窗口没响应或已关闭时返回False
+        """
+        raise NotImplementedError
 
+    def acquire_clipboard(self, timeout) -> bool:
+        """
+        独占剪贴板，从读出原来的内容到恢复完成之间别的实例不能改剪贴板
+        :param timeout: 毫秒
+        :return: 超时返回False
+        """
+        raise NotImplementedError
 
-def send_text(hwnd, text):
+    def release_clipboard(self):
+        raise NotImplementedError
+
+    def get_clipboard(self):
+        raise NotImplementedError
+
+    def set_clipboard(self, text):
+        raise NotImplementedError
+
+
+class Win32TextTarget(TextTarget):
+    """
+    用pywin32发送消息和读写剪贴板
+    剪贴板是整个桌面共用的，同时运行的多个脚本进程通过命名互斥量CLIPBOARD_MUTEX_NAME排队
+    """
+
+    def __init__(self):
+        import win32event
+        import win32gui
+        self._win32event = win32event
+        self._win32gui = win32gui
+        # 互斥量按线程持有，同一进程的多个线程之间也能互斥
+        self._clipboard_mutex = win32event.CreateMutex(None, False, CLIPBOARD_MUTEX_NAME)
+
+    def post(self, hwnd, msg, wparam, lparam):
+        self._win32gui.PostMessage(hwnd, msg, wparam, lparam)
+
+    def send(self, hwnd, msg, wparam, lparam):
+        self._win32gui.SendMessage(hwnd, msg, wparam, lparam)
+
+    def ping(self, hwnd, timeout) -> bool:
+        import pywintypes
+        try:
+            # 窗口线程卡住时SendMessageTimeout直接返回，不会一直等
+            self._win32gui.SendMessageTimeout(hwnd, WM_NULL, 0, 0, SMTO_ABORTIFHUNG, timeout)
+        except pywintypes.error:
+            return False
+        return True
+
+    def get_clipboard(self):
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        try:
+            if win32clipboard.IsClipboardFormatAvailable(CF_UNICODETEXT):
+                return win32clipboard.GetClipboardData(CF_UNICODETEXT)
+            return None
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def acquire_clipboard(self, timeout) -> bool:
+        # 持有的进程没释放就退出时返回WAIT_ABANDONED，这时也已经拿到了
+        return self._win32event.WaitForSingleObject(self._clipboard_mutex, timeout) != self._win32event.WAIT_TIMEOUT
+
+    def release_clipboard(self):
+        self._win32event.ReleaseMutex(self._clipboard_mutex)
+
+    def set_clipboard(self, text):
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            if text is not None:
+                win32clipboard.SetClipboardData(CF_UNICODETEXT, text)
+        finally:
+            win32clipboard.CloseClipboard()
+
+
+_text_target = None
+
+
+def get_text_target() -> TextTarget:
+    global _text_target
+    if _text_target is None:
+        _text_target = Win32TextTarget()
+    return _text_target
+
+
+def set_text_target(target):
+    """
+    替换send_text发送消息的实现
+    :param target: TextTarget，传None恢复为Win32TextTarget
+    """
+    global _text_target
+    _text_target = target
+
+
+@MetricsUtil.timed('input.send_text')
+def send_text(hwnd, text, mode='ime', delay=10, batch=64, confirm=True, timeout=1000):
     """
     输入字符串
     :param hwnd:
     :param text:
-    :return:
+    :param mode: ime 每个字SendMessage(WM_IME_CHAR)后延时delay毫秒，兼容性最好但是最慢
+    post 每batch个字PostMessage(WM_CHAR)一批，批之间延时delay毫秒，长文本快很多
+    paste 放进剪贴板后SendMessage(WM_PASTE)，只适用于标准的编辑框，完成后恢复原来的剪贴板
+    原来剪贴板里不是文字时不恢复，多个实例同时粘贴时排队
+    :param delay: 毫秒，见mode
+    :param batch: post模式每批的字数
+    :param confirm: post模式每批发完后是否确认窗口还在响应，窗口卡死或关闭时停止发送
+    同时让发送的节奏跟上窗口线程，但不保证之前投递的字已经处理完
+    :param timeout: 确认窗口响应的超时，paste模式为等剪贴板的超时，毫秒
+    :return: post模式窗口没响应、paste模式等不到剪贴板时返回False，其他情况返回True
+    """
+    target = get_text_target()
+    if mode == 'ime':
+        for char in text:
+            target.send(hwnd, WM_IME_CHAR, ord(char), 0)
+            TimeUtil.delay(delay)
+        return True
+    if mode == 'post':
+        # WM_CHAR按UTF-16发送，基本平面以外的字拆成两个代理项
+        units = memoryview(text.encode('utf-16-le')).cast('H')
+        for start in range(0, len(units), batch):
+            for unit in units[start:start + batch]:
+                target.post(hwnd, WM_CHAR, unit, 1)
+            if confirm and not target.ping(hwnd, timeout):
+                return False
+            if delay and start + batch < len(units):
+                TimeUtil.delay(delay)
+        return True
+    if mode == 'paste':
+        if not target.acquire_clipboard(timeout):
+            return False
+        try:
+            old = target.get_clipboard()
+            target.set_clipboard(text)
+            try:
+                # SendMessage返回时已经粘贴完
+                target.send(hwnd, WM_PASTE, 0, 0)
+            finally:
+                # get_clipboard只读得到文字，set_clipboard(None)会把原来的图片等内容清空
+                if old is not None:
+                    target.set_clipboard(old)
+        finally:
+            target.release_clipboard()
+        return True
+    raise ValueError('mode 取值 "ime", "post" 或 "paste", 现在值为：%s' % mode)
+
+
+class InputDispatcher(object):
+    """
+    后台发送按键鼠标消息的线程
+    脚本一次提交整个序列(组合键、连点等)，由这个线程按时间点PostMessage，脚本线程不用等待
+    序列里每个事件是(相对序列开始的毫秒数, hwnd, msg, wparam, lparam)，可以用*_events函数生成
+    dispatcher = KeymouseUtil.get_dispatcher()
+    done = dispatcher.submit(KeymouseUtil.key_chord_events(hwnd, [0x11, 0x41]))
+    done.wait()
+    """
+
+    # 离时间点还有多久时不再等条件变量，改用TimeUtil.sleep_until精确等待，秒
+    PRECISE_WINDOW = 0.005
+    # 最多保留的发送失败记录数
+    MAX_ERRORS = 100
+
+    def __init__(self, post=None):
+        """
+        :param post: 发送消息的函数，参数为(hwnd, msg, wparam, lparam)，None时用post_message
+        """
+        self.post = post if post is not None else post_message
+        self._queue = []
+        self._seq = 0
+        self._condition = threading.Condition()
+        self._stopping = False
+        # 发送失败的记录(hwnd, msg, 异常)，窗口关闭时PostMessage会抛异常，只记录，不影响发给其他窗口的消息
+        self.errors = deque(maxlen=self.MAX_ERRORS)
+        self._thread = threading.Thread(target=self._run, name='input-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, events, start=None) -> threading.Event:
+        """
+        提交一个序列
+        :param events: [(相对开始的毫秒数, hwnd, msg, wparam, lparam), ...]
+        :param start: 序列开始的时间点(time.perf_counter())，None表示现在
+        :return: 序列里的消息全部发送后被set的threading.Event
+        """
+        done = threading.Event()
+        if start is None:
+            start = time.perf_counter()
+        events = sorted(events, key=lambda event: event[0])
+        if not events:
+            done.set()
+            return done
+        with self._condition:
+            if self._stopping or not self._thread.is_alive():
+                raise ValueError('InputDispatcher已停止')
+            last = len(events) - 1
+            for i, (offset, hwnd, msg, wparam, lparam) in enumerate(events):
+                self._seq += 1
+                heapq.heappush(self._queue, (start + offset / 1000, self._seq, hwnd, msg, wparam, lparam,
+                                             done if i == last else None))
+            self._condition.notify()
+        return done
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                due = self._queue[0][0]
+                remaining = due - time.perf_counter()
+                if remaining > self.PRECISE_WINDOW:
+                    # 期间可能提交了更早的事件，醒来后重新看队首
+                    self._condition.wait(remaining - self.PRECISE_WINDOW)
+                    continue
+                _, _, hwnd, msg, wparam, lparam, done = heapq.heappop(self._queue)
+            TimeUtil.sleep_until(due)
+            try:
+                self.post(hwnd, msg, wparam, lparam)
+            except Exception as e:
+                self.errors.append((hwnd, msg, e))
+                MetricsUtil.count('input_dispatcher_errors')
+            if done is not None:
+                done.set()
+
+    def is_alive(self) -> bool:
+        """
+        线程是否还在运行
+        """
+        return self._thread.is_alive() and not self._stopping
+
+    def pending(self) -> int:
+        """
+        还没发送的消息数
+        """
+        with self._condition:
+            return len(self._queue)
+
+    def stop(self, drain=True):
+        """
+        停止线程
+        :param drain: 是否先把队列里的消息发完，False时直接丢弃
+        """
+        with self._condition:
+            self._stopping = True
+            if not drain:
+                for event in self._queue:
+                    if event[6] is not None:
+                        event[6].set()
+                self._queue.clear()
+            self._condition.notify()
+        self._thread.join()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> InputDispatcher:
+    """
+    进程共用的InputDispatcher，第一次调用时创建，线程已停止时重新创建
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = InputDispatcher()
+        return _dispatcher
+
+
+def key_chord_events(hwnd, virtual_keys, hold=50, interval=0) -> list:
+    """
+    组合键：按顺序按下，按住hold毫秒后倒序放开
+    :param virtual_keys: 虚拟键码list，如[VK_CONTROL, 0x41]
+    :param hold: 全部按下后按住的毫秒数
+    :param interval: 相邻两个键之间的毫秒数
+    """
+    table = get_lparam_table()
+    events = []
+    for i, virtual_key in enumerate(virtual_keys):
+        events.append((i * interval, hwnd, WM_KEYDOWN, virtual_key, table.down[virtual_key]))
+    release = (len(virtual_keys) - 1) * interval + hold
+    for i, virtual_key in enumerate(reversed(virtual_keys)):
+        events.append((release + i * interval, hwnd, WM_KEYUP, virtual_key, table.up[virtual_key]))
+    return events
+
+
+def key_sequence_events(hwnd, virtual_keys, hold=50, interval=50) -> list:
+    """
+    依次按键
+    :param virtual_keys: 虚拟键码list
+    :param hold: 每个键按住的毫秒数
+    :param interval: 上一个键放开到下一个键按下的毫秒数
+    """
+    table = get_lparam_table()
+    events = []
+    for i, virtual_key in enumerate(virtual_keys):
+        offset = i * (hold + interval)
+        events.append((offset, hwnd, WM_KEYDOWN, virtual_key, table.down[virtual_key]))
+        events.append((offset + hold, hwnd, WM_KEYUP, virtual_key, table.up[virtual_key]))
+    return events
+
+
+def click_events(hwnd, x, y, count=1, delay=50, interval=50, button='left') -> list:
+    """
+    连续点击，和left_click一样先移动，delay毫秒后按下，再delay毫秒后放开
+    :param count: 点击次数
+    :param delay: 移动到按下、按下到放开的毫秒数
+    :param interval: 上一次放开到下一次按下的毫秒数
+    :param button: left right
+    """
+    if button == 'left':
+        down, up, flag = WM_LBUTTONDOWN, WM_LBUTTONUP, MK_LBUTTON
+    elif button == 'right':
+        down, up, flag = WM_RBUTTONDOWN, WM_RBUTTONUP, MK_RBUTTON
+    else:
+        raise ValueError('button 取值 "left" 或 "right", 现在值为：%s' % button)
+    point = make_long(x, y)
+    events = [(0, hwnd, WM_MOUSEMOVE, 0, point)]
+    for i in range(count):
+        offset = delay + i * (delay + interval)
+        events.append((offset, hwnd, down, flag, point))
+        events.append((offset + delay, hwnd, up, flag, point))
+    return events
+
+
+def post_events(events, wait=False):
+    """
+    用共用的InputDispatcher发送序列
+    :param events: 见InputDispatcher.submit
+    :param wait: 是否等到全部发送完
+    :return: 发送完后被set的threading.Event
     """
-    for i in range(len(text)):
-        win32gui.SendMessage(hwnd, win32con.WM_IME_CHAR, ord(text[i]), 0)
-        TimeUtil.delay(10)
+    done = get_dispatcher().submit(events)
+    if wait:
+        done.wait()
+    return done
 
 
 def foreground_move_to(x, y):
@@ -248,6 +672,7 @@ def foreground_mouse_move_drag(x1, y1, x2, y2, duration, tween_x=linear):
     # 屏幕的宽度和高度
     width, height = (ctypes.windll.user32.GetSystemMetrics(0), ctypes.windll.user32.GetSystemMetrics(1))
     # 当前鼠标位置
+    import win32api
     start_x, start_y = win32api.GetCursorPos()
     # 如果持续时间足够短，只需立即将光标移动到那里即可。
     steps = [(x2, y2)]
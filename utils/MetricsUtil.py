@@ -0,0 +1,364 @@
+import bisect
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+"""
+    耗时统计，默认关闭，关闭时被统计的函数只多一次判断
+    MetricsUtil.enable()
+    ... 运行脚本 ...
+    MetricsUtil.to_json('metrics.json')          # 或者 MetricsUtil.to_prometheus('metrics.prom')
+    统计的内容：每个函数的耗时分布和调用次数、截图的字节数、找图找色的命中率
+"""
+
+# 耗时分布的桶，毫秒，最后还有一个+Inf
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+enabled = False
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = defaultdict(int)
+# 线程id -> 标签list，用with label(...)设置，采样分析器按标签统计耗时
+_labels = {}
+
+
+class Histogram(object):
+    """
+    一个函数的耗时分布
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.buckets[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p) -> float:
+        """
+        按桶估算的分位数，返回所在桶的上限，落在+Inf桶时返回最大值
+        """
+        target = self.count * p
+        total = 0
+        for i, n in enumerate(self.buckets):
+            total += n
+            if total >= target and n > 0:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'sum_ms': self.sum, 'mean_ms': self.sum / self.count if self.count else 0.0,
+                'max_ms': self.max, 'p50_ms': self.percentile(0.5), 'p95_ms': self.percentile(0.95),
+                'p99_ms': self.percentile(0.99),
+                'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self.buckets))}
+
+
+def enable(on=True):
+    """
+    打开或关闭统计
+    """
+    global enabled
+    enabled = on
+
+
+def disable():
+    enable(False)
+
+
+def observe(name, ms):
+    """
+    记录一次耗时
+    :param name: 统计项名字
+    :param ms: 耗时，毫秒
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(ms)
+
+
+def count(name, value=1):
+    """
+    计数，统计关闭时什么都不做
+    :param name: 计数项名字，如capture_bytes
+    :param value: 增加的值
+    """
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] += value
+
+
+def hit(name, found):
+    """
+    记录一次查找是否命中，导出时会算出命中率
+    :param name: 统计项名字
+    :param found: 是否找到
+    """
+    if not enabled:
+        return
+    with _lock:
+        _counters[name + '_total'] += 1
+        if found:
+            _counters[name + '_hits'] += 1
+
+
+def found_point(result) -> bool:
+    """
+    返回坐标的查找函数是否找到，(-1, -1)表示没找到
+    """
+    return result != (-1, -1)
+
+
+def timed(name, found=None):
+    """
+    装饰器，统计函数耗时
+    :param name: 统计项名字
+    :param found: 判断返回值是否表示找到的函数，传入时同时统计命中率，如found_point
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                observe(name, (time.perf_counter() - start) * 1000)
+            if found is not None:
+                hit(name, found(result))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        observe(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name):
+    """
+    统计一段代码的耗时
+    with MetricsUtil.timer('matchTemplate'):
+        ...
+    """
+    return _Timer(name) if enabled else _null_timer
+
+
+class label(object):
+    """
+    给当前线程的脚本代码打标签，采样分析器按标签统计耗时，可以嵌套，嵌套时用/连接
+    with MetricsUtil.label('副本'):
+        with MetricsUtil.label('打怪'):
+            ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _labels.setdefault(threading.get_ident(), []).append(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        thread_id = threading.get_ident()
+        stack = _labels.get(thread_id)
+        if stack:
+            stack.pop()
+            if not stack:
+                del _labels[thread_id]
+
+
+def current_label(thread_id=None) -> str:
+    """
+    线程当前的标签
+    :param thread_id: 线程id，None时为当前线程
+    :return: 标签，没有时为空字符串
+    """
+    stack = _labels.get(thread_id if thread_id is not None else threading.get_ident())
+    return '/'.join(stack) if stack else ''
+
+
+class SamplingProfiler(object):
+    """
+    采样分析器，后台线程定时查看各线程当前的标签和正在执行的函数，按采样数估算每个标签的耗时
+    和enable无关，可以单独使用
+    with MetricsUtil.SamplingProfiler(5) as profiler:
+        ...
+    print(profiler.results())
+    """
+
+    def __init__(self, interval_ms=5, threads=None):
+        """
+        :param interval_ms: 采样间隔，毫秒
+        :param threads: 只采样这些线程id，None时采样除自己外的所有线程
+        """
+        self.interval = interval_ms / 1000
+        self.threads = threads
+        self.samples = 0
+        # 标签 -> 采样数，标签 -> 秒数，(标签, 函数) -> 采样数
+        self.label_samples = defaultdict(int)
+        self.label_seconds = defaultdict(float)
+        self.function_samples = defaultdict(int)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            # 按实际间隔计时，sleep多睡的时间也算进去
+            now = time.perf_counter()
+            elapsed = now - last
+            last = now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.threads is not None and thread_id not in self.threads):
+                    continue
+                name = current_label(thread_id)
+                code = frame.f_code
+                self.label_samples[name] += 1
+                self.label_seconds[name] += elapsed
+                self.function_samples[(name, '%s:%s' % (code.co_filename, code.co_name))] += 1
+                self.samples += 1
+
+    def results(self, top=10) -> dict:
+        """
+        :param top: 每个标签返回采样最多的几个函数
+        :return: {标签: {'samples': 采样数, 'seconds': 估算的耗时, 'functions': {函数: 采样数}}}，没有标签时为''
+        """
+        result = {}
+        for name, samples in sorted(self.label_samples.items(), key=lambda item: -item[1]):
+            functions = sorted(((func, n) for (label_name, func), n in self.function_samples.items()
+                                if label_name == name), key=lambda item: -item[1])[:top]
+            result[name] = {'samples': samples, 'seconds': self.label_seconds[name], 'functions': dict(functions)}
+        return result
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def snapshot() -> dict:
+    """
+    当前的统计结果
+    :return: {'timers': {名字: 耗时分布}, 'counters': {名字: 值}, 'hit_rates': {名字: 命中率}}
+    """
+    with _lock:
+        timers = {name: histogram.to_dict() for name, histogram in _histograms.items()}
+        counters = dict(_counters)
+    hit_rates = {}
+    for name, total in counters.items():
+        if name.endswith('_total') and total:
+            base = name[:-len('_total')]
+            hit_rates[base] = counters.get(base + '_hits', 0) / total
+    return {'time': time.time(), 'timers': timers, 'counters': counters, 'hit_rates': hit_rates}
+
+
+def to_json(path=None) -> str:
+    """
+    导出为json
+    :param path: 保存的文件路径，None时只返回字符串
+    """
+    text = json.dumps(snapshot(), ensure_ascii=False, indent=2)
+    if path is not None:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    return text
+
+
+def _metric_name(name) -> str:
+    return 'game_scripts_' + ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def to_prometheus(path=None) -> str:
+    """
+    导出为Prometheus的文本格式，可以给node_exporter的textfile收集器读取
+    :param path: 保存的文件路径，None时只返回字符串
+    """
+    lines = []
+    with _lock:
+        histograms = [(name, list(h.buckets), h.count, h.sum) for name, h in sorted(_histograms.items())]
+        counters = sorted(_counters.items())
+    if histograms:
+        lines.append('# TYPE game_scripts_duration_ms histogram')
+    for name, buckets, total, total_ms in histograms:
+        cumulative = 0
+        for bound, n in zip([str(b) for b in BUCKETS] + ['+Inf'], buckets):
+            cumulative += n
+            lines.append('game_scripts_duration_ms_bucket{name="%s",le="%s"} %d' % (name, bound, cumulative))
+        lines.append('game_scripts_duration_ms_sum{name="%s"} %f' % (name, total_ms))
+        lines.append('game_scripts_duration_ms_count{name="%s"} %d' % (name, total))
+    for name, value in counters:
+        metric = _metric_name(name)
+        lines.append('# TYPE %s counter' % metric)
+        lines.append('%s %d' % (metric, value))
+    text = '\n'.join(lines) + '\n'
+    if path is not None:
+        # 先写临时文件再改名，收集器不会读到写了一半的文件
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp, path)
+    return text
+
+
+def reset():
+    """
+    清空统计结果
+    """
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -0,0 +1,205 @@
+import multiprocessing
+import time
+
+from utils import CaptureUtil
+
+"""
+    多窗口调度：每个窗口一个工作进程，各自有自己的截图会话和OCR实例，找图找色分散到多个CPU核心上
+    脚本函数、发现窗口的函数、截图后端和OCR的工厂函数都会被传到子进程里，需要是模块级的函数(可以被pickle)
+"""
+
+
+class WorkerContext(object):
+    """
+    传给脚本函数的上下文
+    hwnd: 窗口句柄
+    session: 这个窗口的CaptureSession
+    ocr: ocr_factory创建的OCR实例，没有传ocr_factory时为None
+    state: 脚本自己用的dict，同一个进程内每次调用都是同一个
+    """
+
+    def __init__(self, hwnd, session, ocr, stop_event):
+        self.hwnd = hwnd
+        self.session = session
+        self.ocr = ocr
+        self.state = {}
+        self._stop_event = stop_event
+
+    @property
+    def stopping(self) -> bool:
+        """
+        调度器要求停止时为True，耗时长的脚本可以中途检查
+        """
+        return self._stop_event.is_set()
+
+
+def _worker_main(hwnd, script, backend_factory, ocr_factory, stop_event, ticks):
+    """
+    工作进程入口，循环调用脚本函数直到停止或脚本返回False
+    """
+    if backend_factory is not None:
+        # 进程内的screenshot_*函数也用同一个截图后端
+        CaptureUtil.set_backend_factory(backend_factory)
+    ocr = ocr_factory() if ocr_factory is not None else None
+    try:
+        with CaptureUtil.CaptureSession(hwnd) as session:
+            context = WorkerContext(hwnd, session, ocr, stop_event)
+            while not stop_event.is_set():
+                if script(context) is False:
+                    break
+                with ticks.get_lock():
+                    ticks.value += 1
+    finally:
+        if ocr is not None and hasattr(ocr, 'close'):
+            ocr.close()
+        CaptureUtil.close_all_sessions()
+
+
+class _Worker(object):
+    """
+    调度器记录的单个窗口的工作进程信息
+    """
+
+    def __init__(self, hwnd):
+        self.hwnd = hwnd
+        self.process = None
+        self.ticks = None
+        self.stop_event = None
+        self.restarts = 0
+        self.finished = False
+        # 之前崩溃的进程累计的tick数
+        self.base_ticks = 0
+        self.last_ticks = 0
+        self.last_time = time.perf_counter()
+
+    def total_ticks(self) -> int:
+        return self.base_ticks + (self.ticks.value if self.ticks is not None else 0)
+
+
+class WindowOrchestrator(object):
+    """
+    多窗口调度器
+    用法：
+    orchestrator = WindowOrchestrator(my_script, functools.partial(WindowsUtil.ergodic_window_hwnd, '游戏名'))
+    orchestrator.run()
+    """
+
+    def __init__(self, script, discover, backend_factory=None, ocr_factory=None, max_restarts=5,
+                 mp_context=None):
+        """
+        :param script: 脚本函数，参数为WorkerContext，每调用一次算一个tick，返回False时这个窗口的脚本结束
+        :param discover: 发现窗口的函数，返回窗口句柄list，例如WindowsUtil.ergodic_window_hwnd
+        :param backend_factory: 截图后端的工厂函数，参数为窗口句柄，None时用GdiCaptureBackend
+        :param ocr_factory: 创建OCR实例的函数，每个工作进程调用一次，None时不创建
+        :param max_restarts: 每个窗口的工作进程崩溃后最多重启几次
+        :param mp_context: multiprocessing的上下文，None时用默认的
+        """
+        self.script = script
+        self.discover = discover
+        self.backend_factory = backend_factory
+        self.ocr_factory = ocr_factory
+        self.max_restarts = max_restarts
+        self._mp = mp_context if mp_context is not None else multiprocessing.get_context()
+        self.workers = {}
+
+    def _start_worker(self, worker):
+        worker.stop_event = self._mp.Event()
+        worker.ticks = self._mp.Value('Q', 0)
+        worker.process = self._mp.Process(
+            target=_worker_main,
+            args=(worker.hwnd, self.script, self.backend_factory, self.ocr_factory, worker.stop_event,
+                  worker.ticks),
+            name='window-%s' % worker.hwnd, daemon=True)
+        worker.process.start()
+
+    def poll(self):
+        """
+        检查一次：给新出现的窗口启动工作进程，停掉已消失窗口的进程，重启崩溃的进程
+        """
+        hwnds = set(self.discover())
+        for hwnd in hwnds:
+            if hwnd not in self.workers:
+                worker = _Worker(hwnd)
+                self.workers[hwnd] = worker
+                self._start_worker(worker)
+
+        for hwnd, worker in list(self.workers.items()):
+            if hwnd not in hwnds:
+                self._stop_worker(worker)
+                del self.workers[hwnd]
+                continue
+            if worker.finished or worker.process.is_alive():
+                continue
+            if worker.process.exitcode == 0:
+                # 脚本正常结束
+                worker.finished = True
+            elif worker.restarts < self.max_restarts:
+                worker.restarts += 1
+                worker.base_ticks += worker.ticks.value
+                self._start_worker(worker)
+            else:
+                worker.finished = True
+
+    def _stop_worker(self, worker, timeout=5):
+        if worker.process is None:
+            return
+        worker.stop_event.set()
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+
+    def stop(self, timeout=5):
+        """
+        停止所有工作进程
+        :param timeout: 每个进程等待正常退出的秒数，超时强制结束
+        """
+        for worker in self.workers.values():
+            worker.stop_event.set()
+        for worker in self.workers.values():
+            self._stop_worker(worker, timeout)
+
+    def stats(self) -> dict:
+        """
+        每个窗口的运行情况，ticks_per_sec为距离上次调用stats期间的速度
+        :return: {hwnd: {'ticks': 总tick数, 'ticks_per_sec': 每秒tick数, 'restarts': 重启次数, 'alive': 是否在运行}}
+        """
+        now = time.perf_counter()
+        result = {}
+        for hwnd, worker in self.workers.items():
+            ticks = worker.total_ticks()
+            elapsed = now - worker.last_time
+            result[hwnd] = {
+                'ticks': ticks,
+                'ticks_per_sec': (ticks - worker.last_ticks) / elapsed if elapsed > 0 else 0.0,
+                'restarts': worker.restarts,
+                'alive': worker.process is not None and worker.process.is_alive(),
+            }
+            worker.last_ticks = ticks
+            worker.last_time = now
+        return result
+
+    def run(self, poll_interval=1.0, duration=None, report=None):
+        """
+        阻塞运行调度循环
+        :param poll_interval: 检查窗口和进程的间隔，秒
+        :param duration: 运行多少秒后停止，None表示一直运行(直到Ctrl+C)
+        :param report: 每次检查后调用report(stats())，None时不汇报
+        """
+        end = time.perf_counter() + duration if duration is not None else None
+        try:
+            while end is None or time.perf_counter() < end:
+                self.poll()
+                if report is not None:
+                    report(self.stats())
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
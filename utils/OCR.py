@@ -1,46 +1,558 @@
 import ctypes
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils import GraphColorUtil, MetricsUtil
+
+# 页面分割模式(TessPageSegMode)
+PSM_AUTO = 3
+PSM_SINGLE_BLOCK = 6
+PSM_SINGLE_LINE = 7
+PSM_SINGLE_WORD = 8
+PSM_SINGLE_CHAR = 10
+PSM_RAW_LINE = 13
+
+# 识别引擎模式(TessOcrEngineMode)
+OEM_TESSERACT_ONLY = 0
+OEM_LSTM_ONLY = 1
+OEM_TESSERACT_LSTM_COMBINED = 2
+OEM_DEFAULT = 3
+
+# 结果迭代的粒度(TessPageIteratorLevel)
+RIL_BLOCK = 0
+RIL_PARA = 1
+RIL_TEXTLINE = 2
+RIL_WORD = 3
+RIL_SYMBOL = 4
+
+# 识别参数
+# psm: 页面分割模式，单行、单词比整页分析快很多
+# whitelist: 只识别这些字符，None表示不限制
+# default和新建的TessBaseAPI一样(PSM_SINGLE_BLOCK)，设置过别的参数后可以用它恢复原来的识别结果
+OCR_PROFILES = {
+    'default': {'psm': PSM_SINGLE_BLOCK, 'whitelist': None},
+    'auto': {'psm': PSM_AUTO, 'whitelist': None},
+    'block': {'psm': PSM_SINGLE_BLOCK, 'whitelist': None},
+    'line': {'psm': PSM_SINGLE_LINE, 'whitelist': None},
+    'word': {'psm': PSM_SINGLE_WORD, 'whitelist': None},
+    'char': {'psm': PSM_SINGLE_CHAR, 'whitelist': None},
+    'digits': {'psm': PSM_SINGLE_LINE, 'whitelist': '0123456789'},
+    'number': {'psm': PSM_SINGLE_LINE, 'whitelist': '0123456789+-.,/:%'},
+}
 
 
 class OCR(object):
 
-    def __init__(self, DLL_PATH, TESSDATA_PREFIX, lang):
+    def __init__(self, DLL_PATH, TESSDATA_PREFIX, lang, oem=None):
+        """
+        :param DLL_PATH: tesseract的dll路径
+        :param TESSDATA_PREFIX: 语言包目录
+        :param lang: 语言
+        :param oem: 识别引擎模式 OEM_*，None时用TessBaseAPIInit3的默认值
+        """
         self.DLL_PATH = DLL_PATH
         self.TESSDATA_PREFIX = TESSDATA_PREFIX
         self.lang = lang
+        self.oem = oem
         self.ready = False
+        self.api = None
+        self.version = None
+        self.profile = None
+        self._image = None
         if self.do_init():
             self.ready = True
 
     def do_init(self):
         self.tesseract = ctypes.cdll.LoadLibrary(self.DLL_PATH)
-        # 设置函数返回的数据类型
+        # 设置函数返回的数据类型，只需要设置一次
         self.tesseract.TessBaseAPICreate.restype = ctypes.c_uint64
+        self.tesseract.TessBaseAPIGetUTF8Text.restype = ctypes.c_uint64
         # 创建一个Tesseract API实例
         self.api = self.tesseract.TessBaseAPICreate()
         # 初始化Tesseract API实例，并指定tessdata路径和语言模式。
-        rc = self.tesseract.TessBaseAPIInit3(ctypes.c_uint64(self.api), self.TESSDATA_PREFIX, self.lang)
+        if self.oem is None:
+            rc = self.tesseract.TessBaseAPIInit3(ctypes.c_uint64(self.api), self.TESSDATA_PREFIX, self.lang)
+        else:
+            rc = self.tesseract.TessBaseAPIInit2(ctypes.c_uint64(self.api), self.TESSDATA_PREFIX, self.lang,
+                                                 self.oem)
         if rc:
-            self.tesseract.TessBaseAPIDelete(ctypes.c_uint64(self.api))
-            print('Could not initialize tesseract.\n')
+            # 初始化失败，ready为False
+            self.close()
             return False
+        # 内存识别用到的函数
+        self.tesseract.TessBaseAPISetImage.argtypes = [ctypes.c_uint64, ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+                                                       ctypes.c_int, ctypes.c_int]
+        self.tesseract.TessBaseAPISetRectangle.argtypes = [ctypes.c_uint64, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                                           ctypes.c_int]
+        self.tesseract.TessDeleteText.argtypes = [ctypes.c_uint64]
+        # 识别参数和逐词结果用到的函数
+        self.tesseract.TessBaseAPISetPageSegMode.argtypes = [ctypes.c_uint64, ctypes.c_int]
+        self.tesseract.TessBaseAPISetVariable.argtypes = [ctypes.c_uint64, ctypes.c_char_p, ctypes.c_char_p]
+        self.tesseract.TessBaseAPIRecognize.argtypes = [ctypes.c_uint64, ctypes.c_void_p]
+        self.tesseract.TessBaseAPIGetIterator.argtypes = [ctypes.c_uint64]
+        self.tesseract.TessBaseAPIGetIterator.restype = ctypes.c_uint64
+        self.tesseract.TessResultIteratorGetPageIterator.argtypes = [ctypes.c_uint64]
+        self.tesseract.TessResultIteratorGetPageIterator.restype = ctypes.c_uint64
+        self.tesseract.TessResultIteratorGetUTF8Text.argtypes = [ctypes.c_uint64, ctypes.c_int]
+        self.tesseract.TessResultIteratorGetUTF8Text.restype = ctypes.c_uint64
+        self.tesseract.TessResultIteratorConfidence.argtypes = [ctypes.c_uint64, ctypes.c_int]
+        self.tesseract.TessResultIteratorConfidence.restype = ctypes.c_float
+        self.tesseract.TessPageIteratorBoundingBox.argtypes = [ctypes.c_uint64, ctypes.c_int] + [
+            ctypes.POINTER(ctypes.c_int)] * 4
+        self.tesseract.TessPageIteratorNext.argtypes = [ctypes.c_uint64, ctypes.c_int]
+        self.tesseract.TessResultIteratorDelete.argtypes = [ctypes.c_uint64]
         self.tesseract.TessVersion.restype = ctypes.c_char_p
-        tesseract_version = self.tesseract.TessVersion()
-        print('tesseract版本 > ' + str(tesseract_version))
+        self.version = bytes.decode(self.tesseract.TessVersion())
         return True
 
+    def _read_text(self) -> str:
+        """
+        获取识别结果的UTF-8编码文本，并释放tesseract分配的内存
+        """
+        text_out = self.tesseract.TessBaseAPIGetUTF8Text(ctypes.c_uint64(self.api))
+        try:
+            return bytes.decode(ctypes.string_at(text_out)).strip()
+        finally:
+            self.tesseract.TessDeleteText(text_out)
+
+    @MetricsUtil.timed('ocr.get_text')
     def get_text(self, path):
         if not self.ready:
             return False
         self.tesseract.TessBaseAPIProcessPages(ctypes.c_uint64(self.api), path, None, 0, None)
-        # 设置函数返回的数据类型
-        self.tesseract.TessBaseAPIGetUTF8Text.restype = ctypes.c_uint64
-        # 获取识别结果的UTF-8编码文本。
-        text_out = self.tesseract.TessBaseAPIGetUTF8Text(ctypes.c_uint64(self.api))
-        return bytes.decode(ctypes.string_at(text_out)).strip()
+        return self._read_text()
+
+    def set_profile(self, profile):
+        """
+        设置识别参数，参数没变时不会重复设置
+        :param profile: OCR_PROFILES里的名字，或者{'psm': 页面分割模式, 'whitelist': 字符白名单}
+        """
+        if isinstance(profile, str):
+            profile = OCR_PROFILES[profile]
+        if profile == self.profile:
+            return
+        self.tesseract.TessBaseAPISetPageSegMode(ctypes.c_uint64(self.api), profile.get('psm', PSM_SINGLE_BLOCK))
+        whitelist = profile.get('whitelist') or ''
+        self.tesseract.TessBaseAPISetVariable(ctypes.c_uint64(self.api), b'tessedit_char_whitelist',
+                                              whitelist.encode('utf-8'))
+        self.profile = dict(profile)
+
+    def _set_image(self, image, rect, binarize, scale):
+        """
+        把图片传给tesseract
+        :return: (x偏移, y偏移, 缩放)，用于把识别结果的坐标换算回原图坐标
+        """
+        offset = (0, 0)
+        if not isinstance(image, np.ndarray) or image.ndim == 3 or binarize or scale != 1:
+            # 需要转换的时候只转换要识别的区域
+            image = _region_gray(image, rect)
+            if rect is not None:
+                offset = rect[:2]
+            rect = None
+        if scale != 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        if binarize:
+            _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        if image.strides[1] != 1:
+            image = np.ascontiguousarray(image)
+
+        height, width = image.shape
+        self.tesseract.TessBaseAPISetImage(ctypes.c_uint64(self.api), image.ctypes.data, width, height, 1,
+                                           image.strides[0])
+        if rect is not None:
+            left, top, right, bottom = rect
+            self.tesseract.TessBaseAPISetRectangle(ctypes.c_uint64(self.api), left, top, right - left, bottom - top)
+        # tesseract识别完之前不能释放图片数据
+        self._image = image
+        return offset[0], offset[1], scale
+
+    @MetricsUtil.timed('ocr.get_text_from_array')
+    def get_text_from_array(self, image, rect=None, binarize=False, scale=1.0, profile=None):
+        """
+        直接识别内存中的图片，不需要先保存成文件
+        :param image: numpy数组(BGR/BGRA/灰度)或者PIL的image对象
+        :param rect: 只识别这个区域(left, top, right, bottom)，None表示整张图
+        :param binarize: 是否先二值化(OTSU)，背景复杂时可以提高识别率
+        :param scale: 放大倍数，字太小时放大2~3倍识别率更高
+        :param profile: 识别参数，见set_profile，None表示沿用上次的参数
+        :return: 识别结果
+        """
+        if not self.ready:
+            return False
+        if profile is not None:
+            self.set_profile(profile)
+        try:
+            self._set_image(image, rect, binarize, scale)
+            return self._read_text()
+        finally:
+            self._image = None
+
+    @MetricsUtil.timed('ocr.recognize')
+    def recognize(self, image, rect=None, binarize=False, scale=1.0, profile=None, level=RIL_WORD,
+                  min_confidence=0):
+        """
+        识别并返回每个词(或字符、行)的内容、置信度和位置
+        :param image: numpy数组(BGR/BGRA/灰度)或者PIL的image对象
+        :param rect: 只识别这个区域(left, top, right, bottom)，None表示整张图
+        :param binarize: 是否先二值化
+        :param scale: 放大倍数
+        :param profile: 识别参数，见set_profile，None表示沿用上次的参数
+        :param level: 结果的粒度 RIL_WORD 词 RIL_SYMBOL 字符 RIL_TEXTLINE 行
+        :param min_confidence: 置信度低于这个值(0~100)的结果丢掉
+        :return: [{'text': 内容, 'confidence': 置信度, 'box': (left, top, right, bottom)}, ...]，
+        box为image中的坐标，没准备好返回False
+        """
+        if not self.ready:
+            return False
+        if profile is not None:
+            self.set_profile(profile)
+        result = []
+        try:
+            offset_x, offset_y, scale = self._set_image(image, rect, binarize, scale)
+            if self.tesseract.TessBaseAPIRecognize(ctypes.c_uint64(self.api), None) != 0:
+                return result
+            iterator = self.tesseract.TessBaseAPIGetIterator(ctypes.c_uint64(self.api))
+            if not iterator:
+                return result
+            try:
+                page_iterator = self.tesseract.TessResultIteratorGetPageIterator(iterator)
+                box = [ctypes.c_int() for _ in range(4)]
+                while True:
+                    text_out = self.tesseract.TessResultIteratorGetUTF8Text(iterator, level)
+                    if text_out:
+                        try:
+                            text = bytes.decode(ctypes.string_at(text_out)).strip()
+                        finally:
+                            self.tesseract.TessDeleteText(text_out)
+                        confidence = self.tesseract.TessResultIteratorConfidence(iterator, level)
+                        self.tesseract.TessPageIteratorBoundingBox(page_iterator, level,
+                                                                   *[ctypes.byref(v) for v in box])
+                        if text and confidence >= min_confidence:
+                            left, top, right, bottom = [v.value for v in box]
+                            result.append({'text': text, 'confidence': confidence,
+                                           'box': (offset_x + int(left / scale), offset_y + int(top / scale),
+                                                   offset_x + int(right / scale), offset_y + int(bottom / scale))})
+                    if not self.tesseract.TessPageIteratorNext(page_iterator, level):
+                        break
+            finally:
+                self.tesseract.TessResultIteratorDelete(iterator)
+            return result
+        finally:
+            self._image = None
+
+    def screenshot_get_text(self, hwnd, left, top, right, bottom, binarize=False, scale=1.0, profile=None):
+        """
+        截图并识别，截图结果直接传给tesseract
+        :param hwnd: 要截图的窗口句柄
+        :param left: 窗口中截图区域左上角x坐标
+        :param top: 窗口中截图区域左上角y坐标
+        :param right: 右下角x坐标
+        :param bottom: 右下角y坐标
+        :param binarize: 是否先二值化
+        :param scale: 放大倍数
+        :param profile: 识别参数，见set_profile
+        :return: 识别结果
+        """
+        with GraphColorUtil.screenshot_frame(hwnd, left, top, right, bottom) as frame:
+            return self.get_text_from_array(frame, None, binarize, scale, profile)
+
+    def close(self):
+        """
+        释放Tesseract API实例，可以重复调用
+        """
+        if self.api is not None:
+            self.tesseract.TessBaseAPIDelete(ctypes.c_uint64(self.api))
+            self.api = None
+        self.ready = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def __del__(self):
-        # 释放Tesseract API实例。
-        self.tesseract.TessBaseAPIDelete(ctypes.c_uint64(self.api))
+        # 没有调用close时兜底释放
+        if getattr(self, 'api', None) is not None:
+            self.close()
+
+
+class OCRPool(object):
+    """
+    多个OCR实例组成的池，启动时一次性加载好语言包，多线程同时识别时每个线程拿一个实例
+    用法：
+    with OCRPool(DLL_PATH, TESSDATA_PREFIX, lang, 4) as pool:
+        with pool.engine() as ocr:
+            ocr.get_text_from_array(frame)
+        texts = pool.map(frame, [(0, 0, 100, 20), (0, 30, 100, 50)])
+    """
+
+    def __init__(self, DLL_PATH, TESSDATA_PREFIX, lang, size=4, oem=None):
+        """
+        :param size: OCR实例数量，也是map的最大并发数
+        :param oem: 识别引擎模式，见OCR
+        """
+        self.size = size
+        self.engines = []
+        self._idle = queue.Queue()
+        self._executor = None
+        self._lock = threading.Lock()
+        try:
+            for _ in range(size):
+                ocr = OCR(DLL_PATH, TESSDATA_PREFIX, lang, oem)
+                if not ocr.ready:
+                    raise RuntimeError('tesseract初始化失败：%s %s' % (TESSDATA_PREFIX, lang))
+                self.engines.append(ocr)
+                self._idle.put(ocr)
+        except Exception:
+            self.close()
+            raise
+
+    def acquire(self, timeout=None) -> OCR:
+        """
+        取出一个空闲的OCR实例，用完要调用release放回去
+        :param timeout: 等待空闲实例的秒数，None表示一直等
+        """
+        if not self.engines:
+            raise RuntimeError('OCRPool已关闭')
+        return self._idle.get(timeout=timeout)
+
+    def release(self, ocr):
+        """
+        放回OCR实例
+        """
+        self._idle.put(ocr)
+
+    def engine(self, timeout=None):
+        """
+        with语句取出一个OCR实例，退出时自动放回
+        """
+        return _PooledEngine(self, timeout)
+
+    def _get_text(self, image, rect, binarize, scale, profile):
+        with self.engine() as ocr:
+            return ocr.get_text_from_array(image, rect, binarize, scale, profile)
+
+    def map(self, image, rects, binarize=False, scale=1.0, profile=None) -> list:
+        """
+        并行识别同一张图的多个区域
+        :param image: numpy数组(BGR/BGRA/灰度)
+        :param rects: 区域(left, top, right, bottom)的list
+        :param binarize: 是否先二值化
+        :param scale: 放大倍数
+        :param profile: 识别参数，见OCR.set_profile
+        :return: 识别结果list，顺序和rects一致
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='ocr')
+        futures = [self._executor.submit(self._get_text, image, rect, binarize, scale, profile) for rect in rects]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        释放所有OCR实例
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        for ocr in self.engines:
+            ocr.close()
+        self.engines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _PooledEngine(object):
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.ocr = None
+
+    def __enter__(self) -> OCR:
+        self.ocr = self.pool.acquire(self.timeout)
+        return self.ocr
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.release(self.ocr)
+        self.ocr = None
+
+
+def _region_gray(image, rect=None):
+    """
+    取出区域并转成灰度数组
+    :param image: numpy数组(BGR/BGRA/灰度)或者PIL的image对象
+    :param rect: 区域(left, top, right, bottom)，None表示整张图
+    """
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image.convert('L'))
+    if rect is not None:
+        left, top, right, bottom = rect
+        image = image[top:bottom, left:right]
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    return image
+
+
+class OCRCache(object):
+    """
+    OCR结果缓存，区域二值化后的像素一样就直接返回上次的识别结果
+    near_duplicate大于0时，二值化后不同的像素数不超过这个值也算命中，可以容忍少量噪点
+    识别时总是明确设置识别参数，不沿用引擎上次的参数，同一区域用不同参数识别的结果分开缓存
+    """
+
+    def __init__(self, ocr, max_entries=1024, max_bytes=16 * 1024 * 1024, near_duplicate=0, profile='default'):
+        """
+        :param ocr: OCR或OCRPool
+        :param max_entries: 最多缓存多少条结果
+        :param max_bytes: 缓存的二值化像素最多占多少字节
+        :param near_duplicate: 允许不同的像素数，0表示必须完全一样
+        :param profile: 调用时没指定识别参数时用的参数，见OCR.set_profile
+        """
+        self.ocr = ocr
+        self.profile = profile
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.near_duplicate = near_duplicate
+        self.size = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        # key: (识别参数, 形状, 摘要) value: (二值化像素, 识别结果)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.near_hits + self.misses
+        return (self.hits + self.near_hits) / total if total else 0.0
+
+    def stats(self) -> dict:
+        """
+        统计信息
+        :return: {'hits': 完全命中, 'near_hits': 近似命中, 'misses': 未命中, 'hit_rate': 命中率, 'entries': 缓存条数,
+        'bytes': 缓存字节数}
+        """
+        return {'hits': self.hits, 'near_hits': self.near_hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'entries': len(self._cache), 'bytes': self.size}
+
+    @staticmethod
+    def _fingerprint(gray, options):
+        """
+        二值化并压缩成位图
+        :param options: 识别参数，参数不同的结果分开缓存
+        :return: (key, 位图)
+        """
+        _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        bits = np.packbits(binary, axis=None)
+        return (options, gray.shape, hashlib.blake2b(bits.tobytes(), digest_size=16).digest()), bits
+
+    def _lookup(self, key, bits):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if self.near_duplicate > 0:
+                for other_key, (other_bits, text) in reversed(self._cache.items()):
+                    if other_key[:2] != key[:2]:
+                        continue
+                    if int(np.unpackbits(np.bitwise_xor(bits, other_bits)).sum()) <= self.near_duplicate:
+                        self._cache.move_to_end(other_key)
+                        self.near_hits += 1
+                        return True, text
+            self.misses += 1
+            return False, None
+
+    def _store(self, key, bits, text):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = (bits, text)
+            self.size += bits.nbytes
+            while len(self._cache) > 1 and (len(self._cache) > self.max_entries or self.size > self.max_bytes):
+                _, (evicted, _) = self._cache.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def _resolve_profile(self, profile):
+        """
+        :return: (识别参数dict, 缓存key用的参数)，名字和内容相同的dict得到同一个key
+        """
+        if profile is None:
+            profile = self.profile
+        if isinstance(profile, str):
+            profile = OCR_PROFILES[profile]
+        return profile, tuple(sorted(profile.items()))
+
+    def _recognize(self, profile, method, *args):
+        if isinstance(self.ocr, OCRPool):
+            with self.ocr.engine() as ocr:
+                ocr.set_profile(profile)
+                return getattr(ocr, method)(*args)
+        self.ocr.set_profile(profile)
+        return getattr(self.ocr, method)(*args)
+
+    def get_text_from_array(self, image, rect=None, binarize=False, scale=1.0, profile=None):
+        """
+        同OCR.get_text_from_array，区域没变化时直接返回缓存
+        :param profile: 识别参数，None时用创建时的profile
+        """
+        profile, profile_key = self._resolve_profile(profile)
+        gray = _region_gray(image, rect)
+        key, bits = self._fingerprint(gray, (binarize, scale, profile_key))
+        found, text = self._lookup(key, bits)
+        MetricsUtil.hit('ocr_cache', found)
+        if found:
+            return text
+        text = self._recognize(profile, 'get_text_from_array', gray, None, binarize, scale)
+        if text is not False:
+            self._store(key, bits, text)
+        return text
+
+    def get_text(self, path, profile=None):
+        """
+        同OCR.get_text，图片内容没变化时直接返回缓存
+        :param profile: 识别参数，None时用创建时的profile
+        """
+        profile, profile_key = self._resolve_profile(profile)
+        with Image.open(path if isinstance(path, str) else bytes.decode(path)) as image:
+            gray = np.asarray(image.convert('L'))
+        key, bits = self._fingerprint(gray, ('file', profile_key))
+        found, text = self._lookup(key, bits)
+        if found:
+            return text
+        text = self._recognize(profile, 'get_text', path)
+        if text is not False:
+            self._store(key, bits, text)
+        return text
+
+    def screenshot_get_text(self, hwnd, left, top, right, bottom, binarize=False, scale=1.0, profile=None):
+        """
+        同OCR.screenshot_get_text，区域没变化时直接返回缓存
+        """
+        with GraphColorUtil.screenshot_frame(hwnd, left, top, right, bottom) as frame:
+            return self.get_text_from_array(frame, None, binarize, scale, profile)
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._cache.clear()
+            self.size = 0
 
 
 if __name__ == '__main__':
@@ -48,7 +560,8 @@ if __name__ == '__main__':
     DLL_PATH = '../dll/tesseract50.dll'
     TESSDATA_PREFIX = b'../tessdata'
     lang = b'chi_sim'
-    ocr = OCR(DLL_PATH, TESSDATA_PREFIX, lang)
-    # 传入图片进行识别
-    result = ocr.get_text(b'../1.jpg')
-    print(result)
+    with OCR(DLL_PATH, TESSDATA_PREFIX, lang) as ocr:
+        print('tesseract版本 > ' + str(ocr.version))
+        # 传入图片进行识别
+        result = ocr.get_text(b'../1.jpg')
+        print(result)
@@ -0,0 +1,324 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from utils import CaptureUtil
+
+"""
+    截图录制和回放
+    录制：截到的每一帧连同时间、窗口句柄和截图区域写进一个固定大小的环形文件(内存映射)，写满后覆盖最早的帧
+    回放：ReplayCaptureBackend按录制的顺序把帧交给CaptureSession，所有screenshot_*函数和OCR都能离线、可重复地运行
+    ring = RecordUtil.FrameRing('frames.ring', slots=600, slot_size=1920 * 1080 * 4)
+    RecordUtil.install_recorder(ring)     # 之后的截图都会录下来
+    ...
+    RecordUtil.install_replay('frames.ring')     # 在Linux上回放
+"""
+
+# 文件头：标识 版本 帧槽数 每个槽的字节数 已写入的总帧数
+HEADER_FORMAT = '<4sIIIQ'
+HEADER_SIZE = 64
+# 总帧数在文件头里的位置
+COUNT_OFFSET = struct.calcsize('<4sIII')
+MAGIC = b'GSFR'
+VERSION = 1
+# 索引：序号 时间 窗口句柄 left top right bottom 宽 高 通道数 数据字节数
+ENTRY_FORMAT = '<QdQiiiiIIII'
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+# 正在覆盖的槽的序号
+INVALID_SEQ = 0xFFFFFFFFFFFFFFFF
+# 数据区按页对齐
+ALIGNMENT = 4096
+
+
+class FrameRing(object):
+    """
+    内存映射的环形帧文件
+    每一帧固定占一个槽，第seq帧在第seq % slots个槽里，按序号读取不需要查找
+    """
+
+    def __init__(self, path, slots=None, slot_size=None):
+        """
+        :param path: 文件路径
+        :param slots: 帧槽数，传入时新建文件(已有的文件会被覆盖)，None时打开已有的文件
+        :param slot_size: 每个槽的字节数，要能放下最大的一帧(宽*高*4)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if slots is not None:
+            if not slot_size or slots <= 0:
+                raise ValueError('slots和slot_size必须大于0')
+            self.slots = slots
+            self.slot_size = slot_size
+            self._file = open(path, 'w+b')
+            self._file.truncate(self._data_offset() + slots * slot_size)
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+            struct.pack_into(HEADER_FORMAT, self._mmap, 0, MAGIC, VERSION, slots, slot_size, 0)
+        else:
+            self._file = open(path, 'r+b')
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+            magic, version, self.slots, self.slot_size, _ = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+            if magic != MAGIC or version != VERSION:
+                self.close()
+                raise ValueError('不是帧录制文件：%s' % path)
+
+    def _data_offset(self) -> int:
+        index_end = HEADER_SIZE + self.slots * ENTRY_SIZE
+        return (index_end + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+    @property
+    def write_count(self) -> int:
+        """
+        写入过的总帧数，也是下一帧的序号
+        """
+        return struct.unpack_from('<Q', self._mmap, COUNT_OFFSET)[0]
+
+    @property
+    def first_seq(self) -> int:
+        """
+        还保留着的最早一帧的序号
+        """
+        return max(self.write_count - self.slots, 0)
+
+    def __len__(self):
+        return min(self.write_count, self.slots)
+
+    def append(self, frame, hwnd=0, rect=None, timestamp=None) -> int:
+        """
+        写入一帧
+        :param frame: 形状为(高, 宽, 通道数)的uint8数组，通常是BGRA
+        :param hwnd: 窗口句柄
+        :param rect: 截图区域(left, top, right, bottom)，None表示(0, 0, 宽, 高)
+        :param timestamp: 时间，None时取time.time()
+        :return: 这一帧的序号
+        """
+        frame = np.ascontiguousarray(frame)
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        if frame.nbytes > self.slot_size:
+            raise ValueError('帧太大：%d字节，槽只有%d字节' % (frame.nbytes, self.slot_size))
+        if rect is None:
+            rect = (0, 0, width, height)
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            seq = self.write_count
+            slot = seq % self.slots
+            offset = self._data_offset() + slot * self.slot_size
+            entry_offset = HEADER_SIZE + slot * ENTRY_SIZE
+            # 先把槽的序号改成无效值，覆盖旧帧期间读的一方会发现这一帧已经不在了
+            struct.pack_into('<Q', self._mmap, entry_offset, INVALID_SEQ)
+            # 直接拷进映射的内存，不经过中间的bytes
+            np.frombuffer(self._mmap, dtype=np.uint8, count=frame.nbytes, offset=offset)[:] = frame.reshape(-1)
+            struct.pack_into(ENTRY_FORMAT, self._mmap, entry_offset, seq, timestamp, hwnd,
+                             *rect, width, height, channels, frame.nbytes)
+            # 数据和索引都写好后再更新总帧数，读的一方不会读到写了一半的帧
+            struct.pack_into('<Q', self._mmap, COUNT_OFFSET, seq + 1)
+        return seq
+
+    def info(self, seq) -> dict:
+        """
+        读取一帧的信息
+        :param seq: 序号
+        :return: {'seq':, 'timestamp':, 'hwnd':, 'rect': (left, top, right, bottom), 'width':, 'height':,
+        'channels':}
+        """
+        if not self.first_seq <= seq < self.write_count:
+            raise IndexError('第%d帧不存在或已被覆盖' % seq)
+        slot = seq % self.slots
+        entry = struct.unpack_from(ENTRY_FORMAT, self._mmap, HEADER_SIZE + slot * ENTRY_SIZE)
+        stored_seq, timestamp, hwnd, left, top, right, bottom, width, height, channels, _ = entry
+        if stored_seq != seq:
+            raise IndexError('第%d帧已被覆盖' % seq)
+        return {'seq': seq, 'timestamp': timestamp, 'hwnd': hwnd, 'rect': (left, top, right, bottom),
+                'width': width, 'height': height, 'channels': channels}
+
+    def read(self, seq, copy=True):
+        """
+        读取一帧
+        :param seq: 序号
+        :param copy: 是否复制，不复制时返回的数组直接指向文件，这个槽被覆盖后内容会变
+        :return: (信息, 数组)，信息同info，复制期间这一帧被覆盖时抛出IndexError
+        """
+        info = self.info(seq)
+        shape = (info['height'], info['width'], info['channels'])
+        offset = self._data_offset() + (seq % self.slots) * self.slot_size
+        frame = np.frombuffer(self._mmap, dtype=np.uint8, count=int(np.prod(shape)), offset=offset).reshape(shape)
+        if not copy:
+            return info, frame
+        frame = frame.copy()
+        # 复制期间这个槽可能开始被覆盖，复制完再检查一次序号，没变才说明复制的是完整的一帧
+        stored_seq = struct.unpack_from('<Q', self._mmap, HEADER_SIZE + (seq % self.slots) * ENTRY_SIZE)[0]
+        if stored_seq != seq:
+            raise IndexError('第%d帧已被覆盖' % seq)
+        return info, frame
+
+    def __getitem__(self, index):
+        """
+        按保留的帧从旧到新的顺序读取，支持负数下标
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.read(self.first_seq + index)
+
+    def seek_time(self, timestamp) -> int:
+        """
+        找到timestamp时刻正在显示的帧(时间不晚于timestamp的最后一帧)，帧按时间顺序写入，二分查找
+        :return: 序号，比最早一帧还早时返回最早一帧的序号
+        """
+        low, high = self.first_seq, self.write_count - 1
+        if high < low:
+            raise IndexError('没有录制的帧')
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.info(middle)['timestamp'] <= timestamp:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordingCaptureBackend(CaptureUtil.CaptureBackend):
+    """
+    包装一个截图后端，截到的每一帧都写进FrameRing
+    """
+
+    def __init__(self, backend, ring, hwnd):
+        """
+        :param backend: 实际截图的后端
+        :param ring: FrameRing
+        :param hwnd: 窗口句柄，记录在帧信息里
+        """
+        self.backend = backend
+        self.ring = ring
+        self.hwnd = hwnd
+
+    def client_size(self) -> (int, int):
+        return self.backend.client_size()
+
+    def allocate(self, width, height):
+        self.backend.allocate(width, height)
+
+    def grab(self, left, top, width, height, out):
+        self.backend.grab(left, top, width, height, out)
+        self.ring.append(out, self.hwnd, (left, top, left + width, top + height))
+
+    def close(self):
+        self.backend.close()
+
+
+class ReplayCaptureBackend(CaptureUtil.CaptureBackend):
+    """
+    按录制的顺序回放帧，每截一次图取下一帧，不等待，比实际运行快
+    截图区域要在录制时的区域内，录完后抛出EOFError(loop为True时从头开始)
+    """
+
+    def __init__(self, ring, hwnd=None, loop=False):
+        """
+        :param ring: FrameRing或者文件路径
+        :param hwnd: 只回放这个窗口录制的帧，None时回放所有帧
+        :param loop: 回放完后是否从头开始
+        """
+        self.ring = ring if isinstance(ring, FrameRing) else FrameRing(ring)
+        self._owns_ring = not isinstance(ring, FrameRing)
+        self.hwnd = hwnd
+        self.loop = loop
+        self.seq = self.ring.first_seq
+        # 当前帧，client_size和grab共用，取了一帧后再截图才前进
+        self._current = None
+
+    def _peek(self):
+        if self._current is not None:
+            return self._current
+        while True:
+            if self.seq >= self.ring.write_count:
+                if not self.loop or len(self.ring) == 0:
+                    raise EOFError('录制的帧已经回放完')
+                self.seq = self.ring.first_seq
+            info = self.ring.info(self.seq)
+            self.seq += 1
+            if self.hwnd is None or info['hwnd'] == self.hwnd:
+                self._current = info
+                return info
+
+    def client_size(self) -> (int, int):
+        # 没有客户区大小的记录，用当前帧区域的右下角代替
+        _, _, right, bottom = self._peek()['rect']
+        return right, bottom
+
+    def grab(self, left, top, width, height, out):
+        info = self._peek()
+        self._current = None
+        rec_left, rec_top, rec_right, rec_bottom = info['rect']
+        if left < rec_left or top < rec_top or left + width > rec_right or top + height > rec_bottom:
+            raise ValueError('截图区域%s超出了录制的区域%s' % ((left, top, left + width, top + height), info['rect']))
+        _, frame = self.ring.read(info['seq'], copy=False)
+        region = frame[top - rec_top:top - rec_top + height, left - rec_left:left - rec_left + width]
+        out[:, :, :3] = region[:, :, :3]
+        out[:, :, 3] = region[:, :, 3] if region.shape[2] == 4 else 255
+        # 录制和回放同时进行时，复制期间这一帧可能被覆盖
+        self.ring.info(info['seq'])
+
+    def close(self):
+        if self._owns_ring:
+            self.ring.close()
+
+
+def install_recorder(ring):
+    """
+    之后创建的截图会话都把截图录进ring，已有的会话会被关闭
+    :param ring: FrameRing
+    """
+    factory = CaptureUtil.get_backend_factory()
+    CaptureUtil.close_all_sessions()
+    CaptureUtil.set_backend_factory(lambda hwnd: RecordingCaptureBackend(factory(hwnd), ring, hwnd))
+
+
+def install_replay(ring, by_hwnd=False, loop=False):
+    """
+    之后创建的截图会话都从录制文件回放，已有的会话会被关闭
+    :param ring: FrameRing或者文件路径
+    :param by_hwnd: 是否按窗口句柄分开回放，录制时有多个窗口时用，句柄要和录制时一样
+    :param loop: 回放完后是否从头开始
+    """
+    if not isinstance(ring, FrameRing):
+        ring = FrameRing(ring)
+    CaptureUtil.close_all_sessions()
+    CaptureUtil.set_backend_factory(lambda hwnd: ReplayCaptureBackend(ring, hwnd if by_hwnd else None, loop))
+
+
+if __name__ == '__main__':
+    # 把录制的帧导出成图片：python RecordUtil.py frames.ring 输出目录
+    import cv2
+
+    ring_path, output_dir = sys.argv[1:3]
+    os.makedirs(output_dir, exist_ok=True)
+    with FrameRing(ring_path) as frames:
+        for i in range(len(frames)):
+            frame_info, image = frames[i]
+            cv2.imwrite(os.path.join(output_dir, '%08d_%x_%d_%d.png' % (
+                frame_info['seq'], frame_info['hwnd'], frame_info['rect'][0], frame_info['rect'][1])), image)
+        print('导出了%d帧' % len(frames))
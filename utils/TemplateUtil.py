@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 找图用的图片后缀
+TEMPLATE_EXTENSIONS = ('.png', '.bmp', '.jpg', '.jpeg')
+
+
+def _normalize_path(path) -> str:
+    """
+    统一路径格式，作为缓存的key
+    :param path: 图片路径，str、bytes或者PathLike
+    :return: 绝对路径
+    """
+    path = os.fspath(path)
+    if isinstance(path, bytes):
+        path = os.fsdecode(path)
+    return os.path.abspath(path)
+
+
+class TemplateStore(object):
+    """
+    找图用的目标图片缓存
+    每张图片只从磁盘读取一次，按(是否灰度, 步长, 金字塔层数)分别缓存预处理好的numpy数组
+    文件修改时间变了会重新读取，总内存超过budget时淘汰最久没用到的
+    """
+
+    def __init__(self, budget=256 * 1024 * 1024):
+        """
+        :param budget: 缓存占用内存的上限，单位字节
+        """
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key: (路径, 是否灰度, 步长, 金字塔层数) value: (修改时间, 数组)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, grayscale=True, step=1, level=0) -> np.ndarray:
+        """
+        获取预处理好的目标图片
+        :param path: 图片路径
+        :param grayscale: 是否转成灰度图片
+        :param step: 缩小的步长，和screenshot_find_picture2的step一致
+        :param level: 金字塔层数，每层用cv2.pyrDown缩小一半，0表示原图
+        :return: 灰度图为二维数组，否则为BGR三通道数组，数组只读
+        """
+        path = _normalize_path(path)
+        mtime = os.stat(path).st_mtime_ns
+        key = (path, bool(grayscale), step, level)
+        with self._lock:
+            array = self._lookup(key, mtime)
+            if array is not None:
+                self.hits += 1
+                return array
+            self.misses += 1
+            # 原图(BGR, 步长1)也缓存起来，其他参数的版本都从它转换
+            base_key = (path, False, 1, 0)
+            base = self._lookup(base_key, mtime)
+            if base is None:
+                base = self._load(path)
+                self._put(base_key, mtime, base)
+            if key == base_key:
+                return base
+            array = base
+            if grayscale:
+                array = cv2.cvtColor(base, cv2.COLOR_BGR2GRAY)
+            if step != 1:
+                array = np.ascontiguousarray(array[::step, ::step])
+            for _ in range(level):
+                array = cv2.pyrDown(array)
+            self._put(key, mtime, array)
+            return array
+
+    def _lookup(self, key, mtime):
+        """
+        查缓存，文件修改过的视为没有缓存
+        """
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != mtime:
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    @staticmethod
+    def _load(path) -> np.ndarray:
+        """
+        从磁盘读取图片，转成BGR三通道数组
+        """
+        with Image.open(path) as image:
+            array = np.asarray(image.convert('RGB'))
+        return cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+
+    def _put(self, key, mtime, array):
+        array.setflags(write=False)
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self.size -= old[1].nbytes
+        self._cache[key] = (mtime, array)
+        self.size += array.nbytes
+        # 超出内存上限，淘汰最久没用到的，至少保留刚放进去的这个
+        while self.size > self.budget and len(self._cache) > 1:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def preload(self, directory, grayscale=True, step=1, extensions=TEMPLATE_EXTENSIONS) -> int:
+        """
+        预加载目录下所有的图片，一般在脚本启动时调用
+        :param directory: 图片目录，会遍历子目录
+        :param grayscale: 是否转成灰度图片
+        :param step: 缩小的步长
+        :param extensions: 要加载的图片后缀
+        :return: 加载的图片数量
+        """
+        count = 0
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.lower().endswith(extensions):
+                    self.get(os.path.join(root, name), grayscale, step)
+                    count += 1
+        return count
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._cache.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+
+# 默认的缓存，GraphColorUtil的找图函数都用这个
+default_store = TemplateStore()
+
+
+def get_template(path, grayscale=True, step=1, level=0) -> np.ndarray:
+    """
+    从默认缓存获取预处理好的目标图片
+    :param path: 图片路径
+    :param grayscale: 是否转成灰度图片
+    :param step: 缩小的步长
+    :param level: 金字塔层数
+    :return: numpy数组
+    """
+    return default_store.get(path, grayscale, step, level)
+
+
+def preload(directory, grayscale=True, step=1) -> int:
+    """
+    预加载目录下所有的图片到默认缓存
+    :param directory: 图片目录
+    :param grayscale: 是否转成灰度图片
+    :param step: 缩小的步长
+    :return: 加载的图片数量
+    """
+    return default_store.preload(directory, grayscale, step)
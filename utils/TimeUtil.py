@@ -1,12 +1,154 @@
+import atexit
+import ctypes
+import sys
+import threading
 import time
+from collections import deque
 
+from utils import MetricsUtil
 
+# 最后这段时间用忙等，保证精度，秒
+# 忙等的时间跟着time.sleep实际多睡的时间走，time.sleep精度高时(非Windows、Python 3.11+或timeBeginPeriod成功)最多SPIN_MAX
+# 提高计时器精度失败时要盖住Windows约15.6ms的睡眠粒度，最多SPIN_MAX_COARSE
+SPIN_MIN = 0.0002
+SPIN_MAX = 0.002
+SPIN_MAX_COARSE = 0.02
+# 按最近多少次time.sleep多睡的时间估算忙等时间，取其中的百分位数，偶尔一次卡顿不会让之后的延时都变成忙等
+OVERSLEEP_HISTORY = 50
+OVERSLEEP_PERCENTILE = 0.9
+# 保留最近多少次延时的误差用于统计
+JITTER_HISTORY = 1000
+
+_oversleep = deque(maxlen=OVERSLEEP_HISTORY)
+_oversleep_lock = threading.Lock()
+# 提前多久醒来忙等，秒
+_spin_margin = 0.0015
+_spin_max = SPIN_MAX
+_timer_resolution_set = False
+_jitter = deque(maxlen=JITTER_HISTORY)
+_jitter_lock = threading.Lock()
+
+
+def _record_oversleep(overslept):
+    global _spin_margin
+    with _oversleep_lock:
+        _oversleep.append(overslept)
+        samples = sorted(_oversleep)
+    estimate = samples[min(int(len(samples) * OVERSLEEP_PERCENTILE), len(samples) - 1)]
+    _spin_margin = min(max(estimate * 1.5, SPIN_MIN), _spin_max)
+
+
+def _set_timer_resolution():
+    """
+    Python 3.11以前Windows上time.sleep的精度只有系统计时器的精度(默认约15.6ms)，用timeBeginPeriod提高到1ms
+    3.11以后time.sleep用高精度计时器，不需要
+    提高失败时放宽忙等的上限
+    """
+    global _timer_resolution_set, _spin_max
+    _timer_resolution_set = True
+    if sys.platform != 'win32' or sys.version_info >= (3, 11):
+        return
+    winmm = ctypes.windll.winmm
+    if winmm.timeBeginPeriod(1) == 0:
+        atexit.register(winmm.timeEndPeriod, 1)
+    else:
+        _spin_max = SPIN_MAX_COARSE
+
+
+def sleep_until(deadline) -> float:
+    """
+    延时到指定时间点
+    先用time.sleep粗略睡眠，提前醒来后在最后一小段时间里忙等，既精确又不怎么占CPU
+    忙等的时间按time.sleep最近多睡的时间估算，一般不到1ms，最多SPIN_MAX，计时器精度低时最多SPIN_MAX_COARSE
+    :param deadline: time.perf_counter()的时间点，秒
+    :return: 实际比deadline晚了多少，秒
+    """
+    if not _timer_resolution_set:
+        _set_timer_resolution()
+    while True:
+        remaining = deadline - time.perf_counter()
+        margin = _spin_margin
+        if remaining <= margin:
+            break
+        target = remaining - margin
+        start = time.perf_counter()
+        time.sleep(target)
+        # 记录time.sleep多睡的时间，下次提前醒来
+        _record_oversleep(time.perf_counter() - start - target)
+    while time.perf_counter() < deadline:
+        pass
+    late = time.perf_counter() - deadline
+    with _jitter_lock:
+        _jitter.append(late)
+    return late
+
+
+@MetricsUtil.timed('delay')
 def delay(ms):
     """
     延时
     :param ms: 毫秒
     :return:
     """
-    start_time = time.perf_counter()
-    while time.perf_counter() - start_time < ms / 1000:
-        pass
+    sleep_until(time.perf_counter() + ms / 1000)
+
+
+class Ticker(object):
+    """
+    固定周期的定时器，按开始时间计算每次的时间点，不会因为每次执行耗时而累积误差
+    用法：
+    ticker = Ticker(100)
+    while True:
+        do_something()
+        ticker.tick()
+    """
+
+    def __init__(self, interval_ms):
+        """
+        :param interval_ms: 周期，毫秒
+        """
+        self.interval = interval_ms / 1000
+        self.start = time.perf_counter()
+        self.count = 0
+        # 因为执行太慢跳过的周期数
+        self.skipped = 0
+
+    def tick(self) -> float:
+        """
+        等到下一个周期的时间点，如果已经晚了一个周期以上，跳过错过的周期
+        :return: 实际比时间点晚了多少，秒
+        """
+        self.count += 1
+        deadline = self.start + self.count * self.interval
+        now = time.perf_counter()
+        if now - deadline > self.interval:
+            missed = int((now - deadline) / self.interval)
+            self.count += missed
+            self.skipped += missed
+            deadline = self.start + self.count * self.interval
+        return sleep_until(deadline)
+
+
+def jitter_stats() -> dict:
+    """
+    最近延时的误差统计，单位毫秒
+    :return: {'count': 次数, 'mean': 平均, 'p50': 中位数, 'p95':, 'p99':, 'max': 最大}
+    """
+    with _jitter_lock:
+        samples = sorted(_jitter)
+    if not samples:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+
+    def percentile(p):
+        return samples[min(int(len(samples) * p), len(samples) - 1)] * 1000
+
+    return {'count': len(samples), 'mean': sum(samples) / len(samples) * 1000, 'p50': percentile(0.5),
+            'p95': percentile(0.95), 'p99': percentile(0.99), 'max': samples[-1] * 1000}
+
+
+def reset_jitter_stats():
+    """
+    清空误差统计
+    """
+    with _jitter_lock:
+        _jitter.clear()
@@ -0,0 +1,109 @@
+import time
+
+from utils import CaptureUtil, GraphColorUtil
+from utils.FrameDiffUtil import ChangeDetector, region_fingerprint
+
+
+def _is_found(result) -> bool:
+    """
+    判断查询结果是否表示找到了
+    """
+    if isinstance(result, bool):
+        return result
+    if isinstance(result, list):
+        return len(result) > 0
+    if isinstance(result, tuple) and len(result) == 2:
+        return result != (-1, -1)
+    return result is not None
+
+
+def wait_for_any(hwnd, queries, timeout=10000, rect=None, min_interval=20, max_interval=300, backoff=1.5):
+    """
+    等待任意一个目标出现
+    每轮只截一次图；画面没变化时逐渐拉长轮询间隔并跳过查找，画面一变化就恢复到最短间隔
+    :param hwnd: 要截图的窗口句柄
+    :param queries: 查询dict的list，格式见GraphColorUtil.batch_find，pixel查询要带color_str
+    :param timeout: 超时时间，毫秒
+    :param rect: 截图区域(left, top, right, bottom)，None时取所有查询区域的外接矩形
+    :param min_interval: 最短轮询间隔，毫秒
+    :param max_interval: 最长轮询间隔，毫秒
+    :param backoff: 画面没变化时轮询间隔每次乘以这个值
+    :return: (找到的查询name, 结果)，超时返回(None, None)
+    """
+    if rect is None:
+        rect = GraphColorUtil._queries_rect(queries)
+    origin = rect[:2] if rect is not None else (0, 0)
+    detector = ChangeDetector(max_entries=max(len(queries), 1))
+    session = CaptureUtil.get_session(hwnd)
+    deadline = time.perf_counter() + timeout / 1000
+    interval = min_interval
+    last_fingerprint = None
+    while True:
+        with session.lock:
+            frame = session.capture_array(rect)
+            fingerprint = region_fingerprint(frame)
+            if fingerprint != last_fingerprint:
+                results = detector.batch_find(frame, queries, origin)
+                for query in queries:
+                    result = results[query['name']]
+                    if _is_found(result):
+                        return query['name'], result
+        # 画面在变化时尽快再看一次，没变化时逐渐放慢
+        if fingerprint != last_fingerprint:
+            interval = min_interval
+        else:
+            interval = min(interval * backoff, max_interval)
+        last_fingerprint = fingerprint
+
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return None, None
+        time.sleep(min(interval / 1000, remaining))
+
+
+def wait_for_picture(hwnd, left, top, right, bottom, dest_image_url, timeout=10000, confidence=0.9, grayscale=True,
+                     step=1, pyramid=0, min_interval=20, max_interval=300):
+    """
+    等待图片出现(模糊匹配)
+    :param hwnd: 要截图的窗口句柄
+    :param left: 窗口中截图区域左上角x坐标
+    :param top: 窗口中截图区域左上角y坐标
+    :param right: 右下角x坐标
+    :param bottom: 右下角y坐标
+    :param dest_image_url: 目标图片url
+    :param timeout: 超时时间，毫秒
+    :param confidence: 相似度
+    :param grayscale: 是否转成灰度图片进行比较
+    :param step: 取值1或者2，见find_picture2
+    :param pyramid: 金字塔找图的层数，见find_picture2
+    :param min_interval: 最短轮询间隔，毫秒
+    :param max_interval: 最长轮询间隔，毫秒
+    :return: 找到的绝对坐标，超时返回(-1,-1)
+    """
+    query = {'name': 'picture', 'type': 'picture2', 'rect': (left, top, right, bottom),
+             'dest_image_url': dest_image_url, 'confidence': confidence, 'grayscale': grayscale, 'step': step,
+             'pyramid': pyramid}
+    _, result = wait_for_any(hwnd, [query], timeout, None, min_interval, max_interval)
+    return result if result is not None else (-1, -1)
+
+
+def wait_for_color(hwnd, left, top, right, bottom, multi_point_color_str, timeout=10000, similarity=1.0,
+                   min_interval=20, max_interval=300):
+    """
+    等待多点颜色出现
+    :param hwnd: 要截图的窗口句柄
+    :param left: 窗口中截图区域左上角x坐标
+    :param top: 窗口中截图区域左上角y坐标
+    :param right: 右下角x坐标
+    :param bottom: 右下角y坐标
+    :param multi_point_color_str: 多点字符串，格式见multi_point_find_color
+    :param timeout: 超时时间，毫秒
+    :param similarity: 相似度
+    :param min_interval: 最短轮询间隔，毫秒
+    :param max_interval: 最长轮询间隔，毫秒
+    :return: 找到的绝对坐标，超时返回(-1,-1)
+    """
+    query = {'name': 'color', 'type': 'color', 'rect': (left, top, right, bottom),
+             'multi_point_color_str': multi_point_color_str, 'similarity': similarity}
+    _, result = wait_for_any(hwnd, [query], timeout, None, min_interval, max_interval)
+    return result if result is not None else (-1, -1)
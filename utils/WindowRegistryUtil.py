@@ -0,0 +1,448 @@
+import re
+import threading
+import time
+
+"""
+    窗口索引：把桌面上的窗口一次读进来，按标题、类名、进程id建索引，之后查找不再逐个调用GetWindowText/GetClassName
+    registry = WindowRegistryUtil.get_registry()
+    registry.ergodic_window_hwnd('游戏名')          # 和WindowsUtil.ergodic_window_hwnd用法一样
+    registry.find(title_regex=r'^梦幻.*', pid=1234)
+    registry.find_child_window(hwnd, None, 'Edit')
+    调用系统的部分可以用FakeDesktop替换，方便在没有Windows的环境下测试
+"""
+
+
+class Desktop(object):
+    """
+    读取窗口信息的接口
+    """
+
+    def top_windows(self) -> list:
+        """
+        所有顶层窗口，按z序从上到下
+        """
+        raise NotImplementedError
+
+    def child_windows(self, hwnd) -> list:
+        """
+        直接子窗口，按z序从上到下
+        """
+        raise NotImplementedError
+
+    def window_text(self, hwnd) -> str:
+        raise NotImplementedError
+
+    def class_name(self, hwnd) -> str:
+        raise NotImplementedError
+
+    def process_id(self, hwnd) -> int:
+        raise NotImplementedError
+
+    def is_window(self, hwnd) -> bool:
+        raise NotImplementedError
+
+
+class Win32Desktop(Desktop):
+    """
+    用pywin32读取窗口信息
+    """
+
+    def __init__(self):
+        import win32con
+        import win32gui
+        import win32process
+        self._win32con = win32con
+        self._win32gui = win32gui
+        self._win32process = win32process
+
+    def top_windows(self) -> list:
+        result = []
+        # EnumWindows一次调用拿到所有顶层窗口，比逐个GetWindow(GW_HWNDNEXT)快
+        self._win32gui.EnumWindows(lambda hwnd, windows: windows.append(hwnd) or True, result)
+        return result
+
+    def child_windows(self, hwnd) -> list:
+        result = []
+        child = self._win32gui.GetWindow(hwnd, self._win32con.GW_CHILD)
+        while child:
+            result.append(child)
+            child = self._win32gui.GetWindow(child, self._win32con.GW_HWNDNEXT)
+        return result
+
+    def window_text(self, hwnd) -> str:
+        return self._win32gui.GetWindowText(hwnd)
+
+    def class_name(self, hwnd) -> str:
+        return self._win32gui.GetClassName(hwnd)
+
+    def process_id(self, hwnd) -> int:
+        return self._win32process.GetWindowThreadProcessId(hwnd)[1]
+
+    def is_window(self, hwnd) -> bool:
+        return bool(self._win32gui.IsWindow(hwnd))
+
+
+class FakeDesktop(Desktop):
+    """
+    内存里的假桌面，用于测试
+    calls: 每个方法被调用的次数
+    """
+
+    def __init__(self):
+        self.windows = {}
+        self.calls = {}
+        self._next_hwnd = 0x10000
+
+    def add_window(self, title, class_name='', pid=0, parent=0) -> int:
+        """
+        添加窗口，新窗口在同级窗口的最上面
+        :return: 窗口句柄
+        """
+        self._next_hwnd += 2
+        self.windows[self._next_hwnd] = {'title': title, 'class': class_name, 'pid': pid, 'parent': parent,
+                                         'order': -self._next_hwnd}
+        return self._next_hwnd
+
+    def remove_window(self, hwnd):
+        """
+        关闭窗口，子窗口一起关闭
+        """
+        for child in [h for h, w in self.windows.items() if w['parent'] == hwnd]:
+            self.remove_window(child)
+        self.windows.pop(hwnd, None)
+
+    def set_title(self, hwnd, title):
+        self.windows[hwnd]['title'] = title
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _children(self, parent) -> list:
+        return sorted((h for h, w in self.windows.items() if w['parent'] == parent),
+                      key=lambda h: self.windows[h]['order'])
+
+    def top_windows(self) -> list:
+        self._count('top_windows')
+        return self._children(0)
+
+    def child_windows(self, hwnd) -> list:
+        self._count('child_windows')
+        return self._children(hwnd)
+
+    def _get(self, hwnd, key, default):
+        window = self.windows.get(hwnd)
+        return window[key] if window is not None else default
+
+    def window_text(self, hwnd) -> str:
+        self._count('window_text')
+        return self._get(hwnd, 'title', '')
+
+    def class_name(self, hwnd) -> str:
+        self._count('class_name')
+        return self._get(hwnd, 'class', '')
+
+    def process_id(self, hwnd) -> int:
+        self._count('process_id')
+        return self._get(hwnd, 'pid', 0)
+
+    def is_window(self, hwnd) -> bool:
+        self._count('is_window')
+        return hwnd in self.windows
+
+
+class WindowInfo(object):
+    """
+    索引里的一个窗口，类名和进程id窗口存在期间不会变，标题按title_ttl重新读取
+    """
+    __slots__ = ('hwnd', 'title', 'class_name', 'pid', 'title_time')
+
+    def __init__(self, hwnd, title, class_name, pid, title_time):
+        self.hwnd = hwnd
+        self.title = title
+        self.class_name = class_name
+        self.pid = pid
+        self.title_time = title_time
+
+    def __repr__(self):
+        return 'WindowInfo(hwnd=%#x, title=%r, class_name=%r, pid=%d)' % (self.hwnd, self.title, self.class_name,
+                                                                          self.pid)
+
+
+class WindowRegistry(object):
+    """
+    顶层窗口的索引
+    查找时如果距离上次刷新超过max_age就增量刷新一次：只枚举窗口句柄，新窗口才读类名和进程id，
+    标题超过title_ttl才重新读，已关闭的窗口从索引里删除
+    """
+
+    def __init__(self, desktop=None, max_age=1.0, title_ttl=5.0):
+        """
+        :param desktop: Desktop，None时用Win32Desktop
+        :param max_age: 索引多少秒后查找时自动刷新，0表示每次查找都刷新
+        :param title_ttl: 标题多少秒后重新读取，游戏窗口的标题可能会变
+        """
+        self.desktop = desktop if desktop is not None else Win32Desktop()
+        self.max_age = max_age
+        self.title_ttl = title_ttl
+        self._lock = threading.RLock()
+        self._windows = {}
+        # 顶层窗口的z序
+        self._order = []
+        self._by_class = {}
+        self._by_pid = {}
+        self._by_title = {}
+        # 子窗口：父窗口句柄 -> [WindowInfo, ...]
+        self._children = {}
+        self._refresh_time = None
+        # 索引每变化一次加1，查找结果的缓存按这个失效
+        self.generation = 0
+        self._cache = {}
+
+    @staticmethod
+    def _index_add(index, key, hwnd):
+        index.setdefault(key, set()).add(hwnd)
+
+    @staticmethod
+    def _index_remove(index, key, hwnd):
+        hwnds = index.get(key)
+        if hwnds is not None:
+            hwnds.discard(hwnd)
+            if not hwnds:
+                del index[key]
+
+    def _add(self, hwnd, now):
+        desktop = self.desktop
+        info = WindowInfo(hwnd, desktop.window_text(hwnd), desktop.class_name(hwnd), desktop.process_id(hwnd), now)
+        self._windows[hwnd] = info
+        self._index_add(self._by_class, info.class_name, hwnd)
+        self._index_add(self._by_pid, info.pid, hwnd)
+        self._index_add(self._by_title, info.title, hwnd)
+
+    def _remove(self, hwnd):
+        info = self._windows.pop(hwnd, None)
+        if info is None:
+            return
+        self._index_remove(self._by_class, info.class_name, hwnd)
+        self._index_remove(self._by_pid, info.pid, hwnd)
+        self._index_remove(self._by_title, info.title, hwnd)
+        self._children.pop(hwnd, None)
+
+    def _set_title(self, info, title, now):
+        info.title_time = now
+        if title != info.title:
+            self._index_remove(self._by_title, info.title, info.hwnd)
+            info.title = title
+            self._index_add(self._by_title, title, info.hwnd)
+            return True
+        return False
+
+    def refresh(self, full=False):
+        """
+        增量刷新索引
+        :param full: 是否重新读取所有窗口的标题
+        """
+        with self._lock:
+            now = time.monotonic()
+            order = self.desktop.top_windows()
+            changed = order != self._order
+            current = set(order)
+            for hwnd in [h for h in self._windows if h not in current]:
+                self._remove(hwnd)
+            for hwnd in order:
+                info = self._windows.get(hwnd)
+                if info is None:
+                    self._add(hwnd, now)
+                elif full or now - info.title_time >= self.title_ttl:
+                    changed |= self._set_title(info, self.desktop.window_text(hwnd), now)
+            self._order = order
+            self._refresh_time = now
+            if changed:
+                self.generation += 1
+                self._cache.clear()
+
+    def _ensure_fresh(self):
+        if self._refresh_time is None or time.monotonic() - self._refresh_time >= self.max_age:
+            self.refresh()
+
+    def invalidate(self, hwnd=None):
+        """
+        把窗口从索引里删除，下次刷新时如果还在会重新读取，hwnd为None时清空整个索引
+        """
+        with self._lock:
+            if hwnd is None:
+                for known in list(self._windows):
+                    self._remove(known)
+                self._children.clear()
+                self._order = []
+                self._refresh_time = None
+            else:
+                self._remove(hwnd)
+                for children in self._children.values():
+                    children[:] = [child for child in children if child.hwnd != hwnd]
+            self.generation += 1
+            self._cache.clear()
+
+    def is_window(self, hwnd) -> bool:
+        """
+        判断窗口存在，不存在时从索引里删除
+        """
+        if self.desktop.is_window(hwnd):
+            return True
+        self.invalidate(hwnd)
+        return False
+
+    def get(self, hwnd) -> WindowInfo:
+        """
+        窗口的信息，不在索引里时返回None
+        """
+        self._ensure_fresh()
+        return self._windows.get(hwnd)
+
+    def find(self, title=None, class_name=None, pid=None, vague=True, title_regex=None) -> list:
+        """
+        查找顶层窗口，条件都满足才算找到，结果在索引不变时会缓存
+        按标题查找时，找到的窗口会按现在的标题再确认一次；没找到时重新读取超过max_age的候选窗口标题再找，
+        不会因为索引里的标题还没到title_ttl而找错
+        :param title: 标题，None表示不限
+        :param class_name: 类名，None表示不限
+        :param pid: 进程id，None表示不限
+        :param vague: 标题是否模糊匹配(包含就算)
+        :param title_regex: 标题的正则表达式(re.search)，None表示不限
+        :return: 句柄list，按z序从上到下
+        """
+        with self._lock:
+            self._ensure_fresh()
+            key = (title, class_name, pid, vague, title_regex)
+            result = self._cache.get(key)
+            if result is None:
+                result = self._find(title, class_name, pid, vague, title_regex)
+                self._cache[key] = result
+            # 缓存的窗口可能已经关了，确认一下，关了的从索引里删掉重新查
+            for hwnd in result:
+                if not self.desktop.is_window(hwnd):
+                    self.invalidate(hwnd)
+                    return self.find(title, class_name, pid, vague, title_regex)
+            if title is None and title_regex is None:
+                return list(result)
+            now = time.monotonic()
+            if result:
+                stale = result
+            else:
+                stale = [hwnd for hwnd in self._candidates(class_name, pid)
+                         if now - self._windows[hwnd].title_time >= self.max_age]
+            changed = False
+            for hwnd in stale:
+                changed |= self._set_title(self._windows[hwnd], self.desktop.window_text(hwnd), now)
+            if changed:
+                self.generation += 1
+                self._cache.clear()
+                return self.find(title, class_name, pid, vague, title_regex)
+            return list(result)
+
+    def _candidates(self, class_name, pid):
+        """
+        用类名和进程id的索引缩小范围
+        :return: 句柄的集合，都为None时返回所有窗口
+        """
+        candidates = None
+        for index, value in ((self._by_class, class_name), (self._by_pid, pid)):
+            if value is not None:
+                hwnds = index.get(value, set())
+                candidates = hwnds if candidates is None else candidates & hwnds
+        return candidates if candidates is not None else self._windows.keys()
+
+    def _find(self, title, class_name, pid, vague, title_regex) -> list:
+        candidates = self._candidates(class_name, pid)
+        # 标题完全匹配时再用标题的索引缩小范围
+        if title is not None and not vague:
+            candidates = candidates & self._by_title.get(title, set())
+
+        pattern = re.compile(title_regex) if title_regex is not None else None
+        result = []
+        for hwnd in self._order:
+            if hwnd not in candidates:
+                continue
+            info = self._windows[hwnd]
+            if title is not None and vague and info.title.find(title) < 0:
+                continue
+            if pattern is not None and pattern.search(info.title) is None:
+                continue
+            result.append(hwnd)
+        return result
+
+    def ergodic_window_hwnd(self, window_name, class_name=None, vague=True) -> list:
+        """
+        同WindowsUtil.ergodic_window_hwnd，从索引里查找
+        """
+        return self.find(window_name, class_name, None, vague)
+
+    def find_window(self, window_name, class_name=None) -> int:
+        """
+        同WindowsUtil.find_window，标题完全匹配
+        :return: 句柄，没找到返回0
+        """
+        result = self.find(window_name, class_name, None, False)
+        return result[0] if result else 0
+
+    def _child_infos(self, hwnd, reload):
+        children = self._children.get(hwnd)
+        if children is None or reload:
+            desktop = self.desktop
+            now = time.monotonic()
+            children = [WindowInfo(child, desktop.window_text(child), desktop.class_name(child), 0, now)
+                        for child in desktop.child_windows(hwnd)]
+            self._children[hwnd] = children
+        return children
+
+    def find_child_window(self, hwnd, window_name, class_name=None) -> int:
+        """
+        同WindowsUtil.find_child_window，子窗口列表会缓存，缓存里找不到、找到的窗口已关闭或者标题已经变了时重新读取
+        :return: 子窗口句柄，没找到返回0
+        """
+        if window_name is None and class_name is None:
+            raise ValueError("window_name和class_name不能都为None")
+        desktop = self.desktop
+        with self._lock:
+            for reload in (False, True):
+                for child in self._child_infos(hwnd, reload):
+                    if not self._child_matches(child.title, child.class_name, window_name, class_name):
+                        continue
+                    if not desktop.is_window(child.hwnd):
+                        break
+                    # 刚重新读取的列表不用再确认，缓存里的要按现在的标题和类名再比较一次
+                    if reload or self._child_matches(desktop.window_text(child.hwnd), desktop.class_name(child.hwnd),
+                                                     window_name, class_name):
+                        return child.hwnd
+                    break
+            return 0
+
+    @staticmethod
+    def _child_matches(title, child_class, window_name, class_name) -> bool:
+        return (window_name is None or title == window_name) and (class_name is None or child_class == class_name)
+
+    def __len__(self):
+        return len(self._windows)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> WindowRegistry:
+    """
+    进程共用的窗口索引，第一次调用时创建
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = WindowRegistry()
+        return _registry
+
+
+def set_registry(registry):
+    """
+    替换共用的窗口索引，测试时可以传入用FakeDesktop创建的WindowRegistry
+    """
+    global _registry
+    with _registry_lock:
+        _registry = registry